@@ -0,0 +1,513 @@
+"""
+Benchmarks for what the Python around iperf3 costs: process spawn and output capture,
+result parsing and storage, server restart gaps, discovery and the logging path. iperf3
+itself is replaced by fake_iperf3.py and every listener is on loopback, so the numbers
+are the wrapper's own overhead.
+
+    python benchmarks/bench.py                      # run everything, compare with the baselines
+    python benchmarks/bench.py --save               # ... and record the results as the new baselines
+    python benchmarks/bench.py client_test logger   # only these scenarios
+    python benchmarks/bench.py --list
+
+Every scenario runs in a process of its own, so its peak RSS is its own and the client,
+server and iperf3_v2 modules (which share names) never meet. The exit code is 1 when a
+scenario failed or regressed beyond --tolerance against the stored baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+CLIENT_DIR = os.path.join(ROOT, "iperf3_auto_client")
+SERVER_DIR = os.path.join(ROOT, "iperf3_auto_server")
+FAKE_IPERF = os.path.join(BENCH_DIR, "fake_iperf3.py")
+BASELINES = os.path.join(BENCH_DIR, "baselines.json")
+# Metric -> True when higher is better; only these are compared against the baselines
+COMPARED = {"p50_ms": False, "p90_ms": False, "lines_per_second": True, "peak_rss_kb": False}
+
+SCENARIOS = {}
+
+
+def scenario(package, iterations):
+    """Registers a benchmark: it runs with `package` first on sys.path, `iterations` times at scale 1."""
+    def register(func):
+        SCENARIOS[func.__name__] = (package, iterations, func)
+        return func
+    return register
+
+
+def percentile(values, q):
+    """Linear interpolation between the closest ranks, like numpy's default."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * q
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def free_port(host="127.0.0.1"):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(condition, timeout=10.0, poll=0.001):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("condition not reached")
+        time.sleep(poll)
+
+
+def make_launcher(directory):
+    """An 'iperf3' executable in `directory` that runs the fake with this interpreter."""
+    if os.name == "nt":
+        path = os.path.join(directory, "iperf3.cmd")
+        with open(path, "w") as f:
+            f.write(f'@"{sys.executable}" "{FAKE_IPERF}" %*\n')
+    else:
+        path = os.path.join(directory, "iperf3")
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_IPERF}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+def write_config(path, **settings):
+    with open(path, "w") as f:
+        f.write("[settings]\n" + "".join(f"{key} = {value}\n" for key, value in settings.items()))
+
+
+def start_fake_server(port, bind="127.0.0.1"):
+    process = subprocess.Popen([sys.executable, FAKE_IPERF, "-s", "-p", str(port), "-B", bind],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until(lambda: _accepts(bind, port))
+    return process
+
+
+def _accepts(host, port):
+    try:
+        with socket.create_connection((host, port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+class Measurement:
+    """Latencies of the timed operations and the output lines they processed."""
+
+    def __init__(self):
+        self.latencies = []
+        self.lines = 0
+        self.elapsed = 0.0
+
+    def time(self, func, *args, lines=0, **kwargs):
+        started = time.perf_counter()
+        value = func(*args, **kwargs)
+        took = time.perf_counter() - started
+        self.latencies.append(took)
+        self.elapsed += took
+        self.lines += lines
+        return value
+
+    def summary(self):
+        ms = [latency * 1000 for latency in self.latencies]
+        return {
+            "count": len(ms),
+            "p50_ms": percentile(ms, 0.5),
+            "p90_ms": percentile(ms, 0.9),
+            "p99_ms": percentile(ms, 0.99),
+            "max_ms": max(ms) if ms else None,
+            "lines_per_second": self.lines / self.elapsed if self.lines and self.elapsed else None,
+            "peak_rss_kb": peak_rss_kb(),
+        }
+
+
+# Client: IperfClient against a fake server
+
+def client_config(launcher, port):
+    write_config("config.ini", port=port, log_file="./client_log.txt", result_store="./results.db",
+                 tuning_cache="./tuning.json", iperf_path=launcher, use_system_iperf="false")
+
+
+def client_streaming(iterations, duration, version, text=False):
+    from iperf_client import IperfClient
+    os.environ["FAKE_IPERF_VERSION"] = version
+    port = free_port()
+    client_config(make_launcher(os.getcwd()), port)
+    server = start_fake_server(port)
+    try:
+        client = IperfClient()
+        measurement = Measurement()
+        for _ in range(iterations):
+            if text:
+                parser, flags = client.streaming_parser("127.0.0.1", port)
+                cmd = client.build_command("127.0.0.1", duration=duration, port=port) + flags
+                result = measurement.time(client._run_streaming, cmd, parser, lines=duration + 8)
+            else:
+                # Counted as --json-stream lines (start, intervals, end), --json carries the same in one document
+                result = measurement.time(client.run_json_test, "127.0.0.1", duration=duration, port=port,
+                                          lines=duration + 2)
+            if result.error:
+                raise RuntimeError(result.error)
+        return measurement
+    finally:
+        server.kill()
+
+
+@scenario(CLIENT_DIR, 40)
+def client_test(iterations):
+    """Short --json-stream tests: spawn, capture, parse and store, per test."""
+    return client_streaming(iterations, 1, "3.17")
+
+
+@scenario(CLIENT_DIR, 5)
+def client_json_stream(iterations):
+    """Long --json-stream tests as fast as the fake prints them: lines/s through ResultParser."""
+    return client_streaming(iterations, 20000, "3.17")
+
+
+@scenario(CLIENT_DIR, 5)
+def client_json_document(iterations):
+    """The same tests for iperf3 < 3.17, which prints one --json document at the end."""
+    return client_streaming(iterations, 20000, "3.9")
+
+
+@scenario(CLIENT_DIR, 5)
+def client_text(iterations):
+    """Human readable output through TextResultParser, as soak tests do on iperf3 < 3.17."""
+    return client_streaming(iterations, 20000, "3.9", text=True)
+
+
+@scenario(CLIENT_DIR, 5)
+def log_import(iterations):
+    """log_import.py reading a text log of 50 fake iperf3 tests whole, into a fresh store each time."""
+    from log_import import import_log
+    from result_store import ResultStore
+    port = free_port()
+    server = start_fake_server(port)
+    try:
+        with open("legacy_log.txt", "w") as log:
+            for _ in range(50):
+                subprocess.run([sys.executable, FAKE_IPERF, "-c", "127.0.0.1", "-p", str(port), "-t", "100"],
+                               stdout=log, check=True)
+    finally:
+        server.kill()
+    with open("legacy_log.txt", "rb") as f:
+        lines = sum(1 for _ in f)
+    measurement = Measurement()
+    for index in range(iterations):
+        store = ResultStore(f"./import_{index}.db")
+        try:
+            runs = measurement.time(import_log, store, "legacy_log.txt", workers=1, log=lambda message: None,
+                                    lines=lines)
+        finally:
+            store.close()
+        if runs != 50:
+            raise RuntimeError(f"imported {runs} of 50 runs")
+    return measurement
+
+
+@scenario(CLIENT_DIR, 20000)
+def logger(iterations):
+    """logger.info() on the client's logger, until the batch writer has flushed everything."""
+    import logger as logger_module
+    log = logger_module.setup_logger("./bench_log.txt", "bench")
+    measurement = Measurement()
+    started = time.perf_counter()
+    for index in range(iterations):
+        measurement.time(log.info, f"Interval {index}: 941.52 Mbits/sec, 0 retransmits")
+    logger_module.close_writers()
+    measurement.elapsed = time.perf_counter() - started
+    measurement.lines = iterations
+    return measurement
+
+
+# Server: IperfServer supervising a fake iperf3 -s
+
+def start_iperf_server():
+    import configparser
+    from iperf_server import IperfServer
+    from supervisor import port_is_listening
+    port = free_port()
+    write_config("config.ini", port=port, log_file="./server_log.txt", iperf_path=make_launcher(os.getcwd()),
+                 use_system_iperf="false", admission="false", host_sampling="false")
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    server = IperfServer(config)
+    threading.Thread(target=server.pool.run, daemon=True).start()
+    wait_until(lambda: port_is_listening(port))
+    return server, port
+
+
+@scenario(SERVER_DIR, 20)
+def server_restart(iterations):
+    """Gap between iperf3 -s dying and listening again: the supervisor's poll plus the respawn."""
+    from supervisor import port_is_listening
+    server, port = start_iperf_server()
+    instance = server.pool.instances[0]
+    # Measure the respawn, not the crash-loop backoff
+    instance.stable_after = 0
+    measurement = Measurement()
+    try:
+        for _ in range(iterations):
+            # At a random point of the pool's 0.5 s check cycle, not right after the last restart
+            time.sleep(random.uniform(0, 0.5))
+            old = instance.process
+            old.kill()
+            old.wait()
+            measurement.time(wait_until, lambda: instance.process is not old and instance.is_running()
+                             and port_is_listening(port))
+    finally:
+        server.pool.stop()
+    return measurement
+
+
+@scenario(SERVER_DIR, 200)
+def server_test_tracking(iterations):
+    """From a test's connection closing to its port being free again: output capture and parsing."""
+    server, port = start_iperf_server()
+    measurement = Measurement()
+    try:
+        for _ in range(iterations):
+            sock = socket.create_connection(("127.0.0.1", port))
+            sock.sendall(b"x" * 36 + b"\0")
+            sock.recv(1)
+            sock.sendall(b"\0" * 65536)
+            wait_until(lambda: port not in server.free_ports())
+            # 'Accepted', the summary and 'Server listening' lines: three lines per test
+            measurement.time(lambda: (sock.close(), wait_until(lambda: port in server.free_ports())), lines=3)
+    finally:
+        server.pool.stop()
+    return measurement
+
+
+# iperf3_v2: discovery and logging
+
+def loopback_address():
+    """127.0.0.254 where the whole of 127/8 is loopback (Linux), so a /24 scan probes every host first."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.254", 0))
+        return "127.0.0.254"
+    except OSError:
+        return "127.0.0.1"
+
+
+@scenario(ROOT, 20)
+def scan_subnet(iterations):
+    """scan_subnet_for_server over 127.0.0.0/24 with the fake server on the last address."""
+    import iperf3_v2
+    address = loopback_address()
+    port = free_port(address)
+    server = start_fake_server(port, address)
+    measurement = Measurement()
+    try:
+        for _ in range(iterations):
+            found = measurement.time(iperf3_v2.scan_subnet_for_server, "127.0.0.0/24", port, "./v2_log.txt")
+            if found != (address, port):
+                raise RuntimeError(f"scan found {found}, expected {(address, port)}")
+    finally:
+        server.kill()
+    return measurement
+
+
+@scenario(ROOT, 50)
+def listen_for_broadcast(iterations):
+    """listen_for_broadcast from the call until it returns the announced server."""
+    import iperf3_v2
+    stop = threading.Event()
+
+    def announce():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            while not stop.wait(0.001):
+                sock.sendto(b"127.0.0.1:5201", ("127.0.0.1", 50000))
+
+    threading.Thread(target=announce, daemon=True).start()
+    measurement = Measurement()
+    try:
+        for _ in range(iterations):
+            found = measurement.time(iperf3_v2.listen_for_broadcast, "./v2_log.txt", timeout=5)
+            if found != ("127.0.0.1", 5201):
+                raise RuntimeError(f"listen_for_broadcast returned {found}")
+    finally:
+        stop.set()
+    return measurement
+
+
+@scenario(ROOT, 20000)
+def v2_log(iterations):
+    """iperf3_v2.log(): console print plus the queued log file write."""
+    import iperf3_v2
+    from logger import close_writers
+    measurement = Measurement()
+    started = time.perf_counter()
+    for index in range(iterations):
+        measurement.time(iperf3_v2.log, f"Interval {index}: 941.52 Mbits/sec", "./v2_log.txt")
+    close_writers()
+    measurement.elapsed = time.perf_counter() - started
+    measurement.lines = iterations
+    return measurement
+
+
+# Runner
+
+def run_child(name, workdir, output, scale):
+    package, iterations, func = SCENARIOS[name]
+    sys.path.insert(0, package)
+    os.chdir(workdir)
+    measurement = func(max(1, int(iterations * scale)))
+    with open(output, "w") as f:
+        json.dump(measurement.summary(), f)
+
+
+def run_scenario(name, scale, timeout):
+    """Runs one scenario in a fresh interpreter; returns its summary or raises RuntimeError."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    output = os.path.join(workdir, "result.json")
+    child_log = os.path.join(workdir, "child.log")
+    try:
+        with open(child_log, "w") as log:
+            process = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", name, "--workdir", workdir,
+                 "--output", output, "--scale", str(scale)],
+                stdout=log, stderr=subprocess.STDOUT, timeout=timeout
+            )
+        if process.returncode != 0 or not os.path.exists(output):
+            with open(child_log, errors="replace") as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f"exited with code {process.returncode}\n{tail}")
+        with open(output) as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"timed out after {timeout}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def machine():
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def load_baselines(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baselines(path, results):
+    baselines = load_baselines(path)
+    baselines["machine"] = machine()
+    baselines.setdefault("scenarios", {}).update(results)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def compare(result, baseline, tolerance):
+    """['p50_ms +42%', ...] for the metrics that got worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for metric, higher_is_better in COMPARED.items():
+        current, previous = result.get(metric), baseline.get(metric)
+        if not current or not previous:
+            continue
+        change = current / previous - 1
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{metric} {change:+.0%}")
+    return regressions
+
+
+def format_value(value, digits=2):
+    if value is None:
+        return "-"
+    return f"{value:,.{digits}f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the iperf3 orchestration with a fake iperf3.")
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run (default: all)")
+    parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies every scenario's iterations")
+    parser.add_argument("--baselines", default=BASELINES, help="baseline file (default: %(default)s)")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative change that counts as a regression (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per scenario (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.workdir, args.output, args.scale)
+        return 0
+    if args.list:
+        for name, (_, iterations, func) in SCENARIOS.items():
+            print(f"{name:<22} {iterations:>6}x  {func.__doc__}")
+        return 0
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    baselines = load_baselines(args.baselines)
+    if baselines and baselines.get("machine") != machine():
+        print(f"Note: the baselines were recorded on {baselines.get('machine')}", file=sys.stderr)
+    results = {}
+    failed = regressed = False
+    if not args.json:
+        print(f"{'scenario':<22} {'n':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10} "
+              f"{'lines/s':>12} {'peak MB':>8}  vs baseline")
+    for name in args.scenarios or list(SCENARIOS):
+        try:
+            result = run_scenario(name, args.scale, args.timeout)
+        except RuntimeError as e:
+            failed = True
+            print(f"{name:<22} FAILED: {e}", file=sys.stderr)
+            continue
+        results[name] = result
+        baseline = baselines.get("scenarios", {}).get(name)
+        regressions = compare(result, baseline, args.tolerance) if baseline else []
+        regressed = regressed or bool(regressions)
+        if not args.json:
+            rss = result["peak_rss_kb"] / 1024 if result["peak_rss_kb"] else None
+            verdict = "REGRESSED " + ", ".join(regressions) if regressions else ("ok" if baseline else "no baseline")
+            print(f"{name:<22} {result['count']:>6} {format_value(result['p50_ms']):>10} "
+                  f"{format_value(result['p90_ms']):>10} {format_value(result['p99_ms']):>10} "
+                  f"{format_value(result['max_ms']):>10} {format_value(result['lines_per_second'], 0):>12} "
+                  f"{format_value(rss, 1):>8}  {verdict}", flush=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if args.save and results:
+        save_baselines(args.baselines, results)
+        print(f"Baselines saved to {args.baselines}", file=sys.stderr)
+    return 1 if failed or regressed and not args.save else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Scripted stand-in for iperf3, so the orchestration can be benchmarked without moving
+real traffic. It speaks enough of the control protocol for discovery probes (cookie in,
+state byte out) and prints text, --json or --json-stream output like iperf3 3.x. Like
+iperf3, it only flushes every line with --forceflush (or --json-stream); otherwise its
+output on a pipe is block-buffered.
+
+    FAKE_IPERF_VERSION  version it reports, "3.17" by default (3.17+ has --json-stream)
+    FAKE_IPERF_MBPS     bitrate of every stream, 940 by default
+    FAKE_IPERF_PACE     seconds between interval reports, 0 prints them as fast as possible
+"""
+import atexit
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+VERSION = os.environ.get("FAKE_IPERF_VERSION", "3.17")
+RATE = float(os.environ.get("FAKE_IPERF_MBPS", "940")) * 1e6
+PACE = float(os.environ.get("FAKE_IPERF_PACE", "0"))
+IPERF_COOKIE_SIZE = 37
+IPERF_PARAM_EXCHANGE = b"\x09"
+IPERF_ACCESS_DENIED = b"\xff"
+# Set from the arguments in main()
+FLUSH = False
+# Block-buffered even under PYTHONUNBUFFERED, the way C stdio buffers a pipe
+OUT = open(sys.stdout.fileno(), "w", buffering=8192, closefd=False)
+atexit.register(OUT.flush)
+
+
+def arg(args, name, default=None):
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def stream_record(socket_id, start, bits_per_second, udp, sender=True):
+    data = {"socket": socket_id, "start": start, "end": start + 1, "seconds": 1,
+            "bytes": int(bits_per_second / 8), "bits_per_second": bits_per_second, "omitted": False,
+            "sender": sender}
+    if udp:
+        data.update({"packets": data["bytes"] // 1448, "jitter_ms": 0.01, "lost_packets": 0, "lost_percent": 0.0})
+    else:
+        data.update({"retransmits": 0, "snd_cwnd": 1310720, "rtt": 120})
+    return data
+
+
+def text_line(name, start, end, transfer, bits_per_second, role=""):
+    line = (f"[{name:>3}] {start:6.2f}-{end:<6.2f} sec  {transfer / 1048576:.1f} MBytes  "
+            f"{bits_per_second / 1e6:.0f} Mbits/sec    0")
+    return f"{line}             {role}" if role else f"{line}   1.25 MBytes"
+
+
+def emit(line):
+    OUT.write(line + "\n")
+    if FLUSH:
+        OUT.flush()
+
+
+def connect(host, port):
+    try:
+        sock = socket.create_connection((host, port), timeout=2)
+        sock.sendall(b"x" * (IPERF_COOKIE_SIZE - 1) + b"\0")
+        if sock.recv(1) == IPERF_ACCESS_DENIED:
+            sock.close()
+            return None, "the server is busy running a test. try again later"
+        return sock, None
+    except OSError as e:
+        return None, f"unable to connect to server: {e}"
+
+
+def client(args):
+    host = arg(args, "-c")
+    port = int(arg(args, "-p", "5201"))
+    duration = int(arg(args, "-t", "10"))
+    streams = int(arg(args, "-P", "1"))
+    udp = "-u" in args
+    json_doc = "--json" in args
+    json_stream = "--json-stream" in args
+    rate = RATE
+    if udp:
+        bandwidth = arg(args, "-b", "1M")
+        rate = float(bandwidth.rstrip("KMG")) * {"K": 1e3, "M": 1e6, "G": 1e9}.get(bandwidth[-1], 1)
+    sock, error = connect(host, port)
+    if sock is None:
+        emit(json.dumps({"error": error}) if json_doc else f"iperf3: error - {error}")
+        return 1
+
+    sockets = [5 + 2 * index for index in range(streams)]
+    start = {"version": f"iperf {VERSION}", "timestamp": {"timesecs": int(time.time())},
+             "connecting_to": {"host": host, "port": port},
+             "test_start": {"protocol": "UDP" if udp else "TCP", "num_streams": streams, "duration": duration,
+                            "reverse": int("--reverse" in args), "bidir": 0}}
+    if json_stream:
+        emit(json.dumps({"event": "start", "data": start}))
+    elif not json_doc:
+        emit(f"Connecting to host {host}, port {port}")
+        for socket_id in sockets:
+            emit(f"[{socket_id:>3}] local 127.0.0.1 port {40000 + socket_id} connected to {host} port {port}")
+        emit("[ ID] Interval           Transfer     Bitrate         Retr  Cwnd")
+
+    intervals = []
+    total = 0
+    for second in range(duration):
+        records = [stream_record(socket_id, second, rate * random.uniform(0.97, 1.03), udp) for socket_id in sockets]
+        summed = dict(records[0], bytes=sum(r["bytes"] for r in records),
+                      bits_per_second=sum(r["bits_per_second"] for r in records))
+        total += summed["bytes"]
+        interval = {"streams": records, "sum": summed}
+        if json_stream:
+            emit(json.dumps({"event": "interval", "data": interval}))
+        elif json_doc:
+            intervals.append(interval)
+        else:
+            for record in records:
+                emit(text_line(record["socket"], second, second + 1, record["bytes"], record["bits_per_second"]))
+            if streams > 1:
+                emit(text_line("SUM", second, second + 1, summed["bytes"], summed["bits_per_second"]))
+        if PACE:
+            time.sleep(PACE)
+
+    bits_per_second = total * 8 / max(duration, 1)
+    totals = {"start": 0, "end": duration, "seconds": duration, "bytes": total, "bits_per_second": bits_per_second}
+    end = {"sum_sent": dict(totals, retransmits=0, sender=True), "sum_received": dict(totals, sender=True)}
+    if udp:
+        end["sum"] = dict(totals, jitter_ms=0.01, lost_packets=0, packets=total // 1448, lost_percent=0.0)
+    if json_stream:
+        emit(json.dumps({"event": "end", "data": end}))
+    elif json_doc:
+        emit(json.dumps({"start": start, "intervals": intervals, "end": end}, indent=4))
+    else:
+        emit("- - - - - - - - - - - - - - - - - - - - - - - - -")
+        name = "SUM" if streams > 1 else sockets[0]
+        emit(text_line(name, 0, duration, total, bits_per_second, "sender"))
+        emit(text_line(name, 0, duration, total, bits_per_second, "receiver"))
+        emit("")
+        emit("iperf Done.")
+    sock.close()
+    return 0
+
+
+def server(args):
+    port = int(arg(args, "-p", "5201"))
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((arg(args, "-B", "0.0.0.0"), port))
+    listener.listen(64)
+    busy = threading.Lock()
+    tests = [1]
+
+    def listening():
+        emit("-----------------------------------------------------------")
+        emit(f"Server listening on {port} (test #{tests[0]})")
+        emit("-----------------------------------------------------------")
+
+    def handle(conn, address):
+        try:
+            conn.settimeout(5)
+            if not conn.recv(IPERF_COOKIE_SIZE):
+                return
+            if not busy.acquire(blocking=False):
+                conn.sendall(IPERF_ACCESS_DENIED)
+                return
+            try:
+                conn.sendall(IPERF_PARAM_EXCHANGE)
+                emit(f"Accepted connection from {address[0]}, port {address[1]}")
+                conn.settimeout(None)
+                received = 0
+                for chunk in iter(lambda: conn.recv(65536), b""):
+                    received += len(chunk)
+                emit(text_line(5, 0, 1, received, received * 8, "receiver"))
+                tests[0] += 1
+                listening()
+            finally:
+                busy.release()
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    listening()
+    while True:
+        conn, address = listener.accept()
+        threading.Thread(target=handle, args=(conn, address), daemon=True).start()
+
+
+def main():
+    global FLUSH
+    args = sys.argv[1:]
+    FLUSH = "--forceflush" in args or "--json-stream" in args
+    if "--version" in args or "-v" in args:
+        emit(f"iperf {VERSION} (cJSON 1.7.15)")
+        return 0
+    if "-s" in args:
+        return server(args)
+    return client(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
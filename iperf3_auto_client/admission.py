@@ -0,0 +1,94 @@
+import threading
+from control import Connection
+
+ADMISSION_PORT = 50004
+
+
+class AdmissionError(Exception):
+    pass
+
+
+class Reservation:
+    """
+    A place in a server's admission queue (see the server's admission.py). enter() blocks
+    until the server grants ports, with the queue position and ETA passed to on_update as
+    they change; the connection stays open, with a heartbeat, until release(). Use it as
+    a context manager around the tests that should run on the granted ports.
+    """
+
+    def __init__(self, host, port=ADMISSION_PORT, duration=60, ports=1, weight=None, timeout=None,
+                 on_update=None, connect_timeout=2):
+        self.host = host
+        self.port = port
+        self.duration = duration
+        self.count = ports
+        self.weight = weight
+        self.timeout = timeout
+        self.on_update = on_update
+        self.connect_timeout = connect_timeout
+        self.connection = None
+        self.token = None
+        self.ports = None
+        self.waited = None
+        self.expiry = None
+        self._stop = threading.Event()
+
+    def enter(self):
+        """Waits for the grant and returns the granted ports; raises AdmissionError or OSError."""
+        self.connection = Connection.connect(self.host, self.port, self.connect_timeout)
+        self.connection.send({"op": "reserve", "duration": self.duration, "ports": self.count,
+                              "weight": self.weight})
+        self.connection.sock.settimeout(self.timeout)
+        try:
+            while True:
+                message = self.connection.receive()
+                if message is None:
+                    raise AdmissionError("server closed the admission connection")
+                event = message.get("event")
+                if event == "error":
+                    raise AdmissionError(message.get("error") or "server rejected the reservation")
+                self.expiry = message.get("expiry", self.expiry)
+                if self.token is None and message.get("token") is not None:
+                    # Renew while waiting too, or a long queue would look like a client that has vanished;
+                    # started once, when the server has handed out the ticket's token
+                    self.token = message["token"]
+                    threading.Thread(target=self._heartbeat, args=(self.connection,), daemon=True).start()
+                if event == "queued":
+                    if self.on_update is not None:
+                        self.on_update(message["position"], message.get("eta"))
+                elif event == "granted":
+                    self.ports = message["ports"]
+                    self.waited = message.get("waited")
+                    break
+                else:
+                    raise AdmissionError(message.get("error") or f"reservation {event}")
+        except BaseException:
+            self.release()
+            raise
+        self.connection.sock.settimeout(None)
+        return self.ports
+
+    def _heartbeat(self, connection, interval=5.0):
+        while not self._stop.wait(min(interval, (self.expiry or 3 * interval) / 3)):
+            try:
+                connection.send({"op": "renew"})
+            except OSError:
+                break
+
+    def release(self):
+        self._stop.set()
+        if self.connection is not None:
+            try:
+                self.connection.send({"op": "release"})
+            except OSError:
+                pass
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
@@ -0,0 +1,266 @@
+import argparse
+import json
+import numpy as np
+from results import split_bidir
+
+GROUP_FIELDS = ('server', 'client', 'direction', 'protocol')
+VALUE_FIELDS = ('bits_per_second', 'seconds', 'retransmits', 'rtt_ms', 'jitter_ms', 'lost_percent')
+
+
+class IntervalTable:
+    """
+    Every interval of many runs as flat NumPy columns. `group` indexes `groups`, one
+    (server, client, direction, protocol) key per path and direction, and `run` tells
+    the cycles apart. Missing values (no RTT on UDP, no jitter on TCP) are NaN.
+    """
+
+    def __init__(self, groups, group, run, start, columns):
+        self.groups = groups
+        self.group = group
+        self.run = run
+        self.start = start
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.group)
+
+    @classmethod
+    def from_results(cls, results, client=None):
+        """Builds the table from TestResults or CycleResults (bidir results are split)."""
+        keys, rows = {}, []
+        for run_id, result in enumerate(_flatten(results)):
+            key = (result.server, client, 'reverse' if result.reverse else 'regular', result.protocol)
+            code = keys.setdefault(key, len(keys))
+            for report in result.intervals:
+                interval = report.sum
+                if interval.omitted:
+                    continue
+                rtts = [s.rtt for s in report.streams if s.rtt is not None]
+                rows.append((code, run_id, interval.start, interval.bits_per_second, interval.seconds,
+                             interval.retransmits, sum(rtts) / len(rtts) if rtts else None,
+                             interval.jitter_ms, interval.lost_percent))
+        data = np.array(rows, dtype=float).reshape(-1, 9) if rows else np.empty((0, 9))
+        return cls._from_matrix(list(keys), data)
+
+    @classmethod
+    def from_store(cls, store, chunk_size=100000, **filters):
+        """Loads the intervals of the runs in a ResultStore that match `filters`."""
+        keys, run_groups = {}, {}
+        for run in store.runs(newest_first=False, **filters):
+            key = tuple(run[field] for field in GROUP_FIELDS)
+            run_groups[run['id']] = keys.setdefault(key, len(keys))
+        if not run_groups:
+            return cls._from_matrix([], np.empty((0, 9)))
+        run_ids = np.fromiter(run_groups, dtype=np.int64, count=len(run_groups))
+        codes = np.fromiter(run_groups.values(), dtype=np.int64, count=len(run_groups))
+        chunks = []
+        cursor = store.interval_rows(**filters)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=float))
+        data = np.concatenate(chunks) if chunks else np.empty((0, 8))
+        # run ids come back sorted, so each row's group is a binary search away
+        order = np.argsort(run_ids)
+        group = codes[order][np.searchsorted(run_ids[order], data[:, 0].astype(np.int64))]
+        return cls._from_matrix(list(keys), np.column_stack([group, data]))
+
+    @classmethod
+    def _from_matrix(cls, groups, data):
+        columns = {name: data[:, 3 + i] for i, name in enumerate(VALUE_FIELDS)}
+        return cls(groups, data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2], columns)
+
+
+def _flatten(results):
+    for result in results:
+        if hasattr(result, 'regular'):
+            parts = (result.regular, result.reverse)
+        elif result.bidir:
+            parts = split_bidir(result)
+        else:
+            parts = (result,)
+        for part in parts:
+            if part is not None:
+                yield part
+
+
+def grouped_percentiles(group, values, n_groups, percentiles):
+    """
+    Percentiles of `values` within each group, all groups at once (linear interpolation
+    like np.percentile). NaNs are ignored; groups without values get NaN.
+    Returns an array of shape (n_groups, len(percentiles)).
+    """
+    valid = ~np.isnan(values)
+    group, values = group[valid], values[valid]
+    counts = np.bincount(group, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = np.full((n_groups, len(percentiles)), np.nan)
+    present = counts > 0
+    if not present.any():
+        return result
+    # One plain sort instead of an argsort per group: group + value scaled into [0, 0.5]
+    # orders by group, then by value, and the value can be recovered from the fraction
+    low_value, span = values.min(), np.ptp(values) or 1.0
+    keys = np.sort(group + (values - low_value) / span * 0.5)
+    ordered = (keys - np.floor(keys)) * 2 * span + low_value
+    for column, p in enumerate(percentiles):
+        position = starts[present] + p / 100.0 * (counts[present] - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, starts[present] + counts[present] - 1)
+        fraction = position - low
+        result[present, column] = ordered[low] * (1 - fraction) + ordered[high] * fraction
+    return result
+
+
+def grouped_moments(group, values, n_groups):
+    """(count, mean, sample stddev) of `values` per group, ignoring NaNs."""
+    valid = ~np.isnan(values)
+    group, values = group[valid], values[valid]
+    counts = np.bincount(group, minlength=n_groups).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(group, weights=values, minlength=n_groups) / counts
+        squares = np.bincount(group, weights=(values - means[group]) ** 2, minlength=n_groups)
+        stddevs = np.sqrt(squares / (counts - 1))
+    return counts, means, stddevs
+
+
+def find_outliers(group, values, n_groups, threshold=3.5, medians=None):
+    """
+    Flags values whose modified z-score (distance from the group median in units of
+    1.4826 * MAD) exceeds `threshold`. Returns (mask, scores).
+    """
+    if medians is None:
+        medians = grouped_percentiles(group, values, n_groups, (50,))[:, 0]
+    deviations = np.abs(values - medians[group])
+    mads = grouped_percentiles(group, deviations, n_groups, (50,))[:, 0] * 1.4826
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = deviations / mads[group]
+    # A group whose values are mostly identical has MAD 0: only flag values that differ
+    scores = np.where(mads[group] == 0, np.where(deviations > 0, np.inf, 0.0), scores)
+    mask = np.nan_to_num(scores, nan=0.0) > threshold
+    return mask, scores
+
+
+def analyze(table, percentiles=(1, 5, 50, 95, 99), outlier_threshold=3.5, max_outliers=100):
+    """
+    Statistics per path and direction over every interval of every run in `table`:
+    throughput percentiles, stddev and coefficient of variation (per interval and across
+    runs), retransmit rate, RTT, UDP jitter and loss distributions and outlier intervals.
+    """
+    n_groups = len(table.groups)
+    group = table.group
+    bps = table.columns['bits_per_second']
+    seconds = table.columns['seconds']
+    retransmits = table.columns['retransmits']
+
+    counts, means, stddevs = grouped_moments(group, bps, n_groups)
+    bps_percentiles = grouped_percentiles(group, bps, n_groups, tuple(percentiles) + (50,))
+    rtt_percentiles = grouped_percentiles(group, table.columns['rtt_ms'], n_groups, (50, 95))
+    jitter_percentiles = grouped_percentiles(group, table.columns['jitter_ms'], n_groups, (50, 95, 99))
+    loss_percentiles = grouped_percentiles(group, table.columns['lost_percent'], n_groups, (50, 95, 99))
+    total_seconds = np.bincount(group, weights=np.nan_to_num(seconds), minlength=n_groups)
+    total_retransmits = np.bincount(group, weights=np.nan_to_num(retransmits), minlength=n_groups)
+    has_retransmits = np.bincount(group, weights=~np.isnan(retransmits), minlength=n_groups) > 0
+
+    # Mean throughput of each run, then how much the runs differ from each other
+    n_runs = int(table.run.max()) + 1 if len(table) else 0
+    run_counts, run_means, _ = grouped_moments(table.run, bps, n_runs)
+    run_group = np.zeros(n_runs, dtype=np.int64)
+    run_group[table.run] = group
+    run_group, run_means = run_group[run_counts > 0], run_means[run_counts > 0]
+    cycles, cycle_means, cycle_stddevs = grouped_moments(run_group, run_means, n_groups)
+
+    outliers, scores = find_outliers(group, bps, n_groups, outlier_threshold, medians=bps_percentiles[:, -1])
+    outlier_counts = np.bincount(group[outliers], minlength=n_groups)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cvs = stddevs / means
+        cycle_cvs = cycle_stddevs / cycle_means
+        retransmit_rates = total_retransmits / total_seconds
+
+    report = []
+    for g, key in enumerate(table.groups):
+        entry = dict(zip(GROUP_FIELDS, key))
+        entry.update(
+            intervals=int(counts[g]),
+            cycles=int(cycles[g]),
+            mean_bps=_number(means[g]),
+            stddev_bps=_number(stddevs[g]),
+            cv=_number(cvs[g]),
+            percentiles_bps={str(p): _number(v) for p, v in zip(percentiles, bps_percentiles[g])},
+            cycle_stddev_bps=_number(cycle_stddevs[g]),
+            cycle_cv=_number(cycle_cvs[g]),
+            retransmits=int(total_retransmits[g]) if has_retransmits[g] else None,
+            retransmits_per_second=_number(retransmit_rates[g]) if has_retransmits[g] else None,
+            rtt_ms={'p50': _number(rtt_percentiles[g, 0]), 'p95': _number(rtt_percentiles[g, 1])},
+            jitter_ms={f'p{p}': _number(v) for p, v in zip((50, 95, 99), jitter_percentiles[g])},
+            lost_percent={f'p{p}': _number(v) for p, v in zip((50, 95, 99), loss_percentiles[g])},
+            outlier_intervals=int(outlier_counts[g]),
+        )
+        report.append(entry)
+
+    flagged = np.flatnonzero(outliers)
+    flagged = flagged[np.argsort(-scores[flagged], kind='stable')][:max_outliers]
+    outlier_list = [
+        dict(zip(GROUP_FIELDS, table.groups[group[i]]), run=int(table.run[i]), start=float(table.start[i]),
+             bits_per_second=float(bps[i]), score=_number(scores[i]))
+        for i in flagged
+    ]
+    return {'groups': report, 'outliers': outlier_list}
+
+
+def _number(value):
+    value = float(value)
+    return None if np.isnan(value) or np.isinf(value) else value
+
+
+def describe(report):
+    lines = []
+    for entry in report['groups']:
+        p = entry['percentiles_bps']
+        line = (f"{entry['server']} {entry['direction']} {entry['protocol']}: {entry['cycles']} cycles, "
+                f"{entry['intervals']} intervals, mean {(entry['mean_bps'] or 0) / 1e6:.2f} Mbits/sec, "
+                f"p5 {(p.get('5') or 0) / 1e6:.2f}, p50 {(p.get('50') or 0) / 1e6:.2f}, "
+                f"p95 {(p.get('95') or 0) / 1e6:.2f}, CV {(entry['cv'] or 0):.1%}, "
+                f"cycle CV {(entry['cycle_cv'] or 0):.1%}, {entry['outlier_intervals']} outlier intervals")
+        if entry['retransmits'] is not None:
+            line += f", {entry['retransmits_per_second']:.2f} retransmits/s"
+        if entry['jitter_ms']['p50'] is not None:
+            line += (f", jitter p50 {entry['jitter_ms']['p50']:.3f} ms, "
+                     f"loss p95 {(entry['lost_percent']['p95'] or 0):.2f}%")
+        lines.append(line)
+    return lines
+
+
+def main(argv=None):
+    from result_store import ResultStore
+
+    parser = argparse.ArgumentParser(description="Statistics over stored iperf3 results")
+    parser.add_argument('--db', default='./iperf3_results.db', help="result store path")
+    parser.add_argument('--server')
+    parser.add_argument('--client')
+    parser.add_argument('--direction', choices=('regular', 'reverse'))
+    parser.add_argument('--protocol', choices=('TCP', 'UDP'))
+    parser.add_argument('--since', help="epoch, ISO time or age such as 7d / 12h")
+    parser.add_argument('--until')
+    parser.add_argument('--threshold', type=float, default=3.5, help="outlier modified z-score")
+    parser.add_argument('--json', action='store_true', help="print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.db)
+    try:
+        table = IntervalTable.from_store(store, server=args.server, client=args.client, direction=args.direction,
+                                         protocol=args.protocol, since=args.since, until=args.until,
+                                         successful=True)
+    finally:
+        store.close()
+    report = analyze(table, outlier_threshold=args.threshold)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("\n".join(describe(report)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import json
+import socket
+import threading
+
+CONTROL_PORT = 50002
+# Mesh agents answer discovery solicits here, apart from the iperf3 servers on DISCOVERY_PORT
+MESH_DISCOVERY_PORT = 50005
+MAX_MESSAGE = 16 * 1024 * 1024
+
+
+class Connection:
+    """
+    Newline-delimited JSON messages over one TCP connection, used between mesh agents
+    and whoever drives them. Sends may come from several threads.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = sock.makefile("rb")
+        self._send_lock = threading.Lock()
+        self.peer = sock.getpeername()
+
+    @classmethod
+    def connect(cls, host, port, timeout=5):
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.settimeout(None)
+        return cls(sock)
+
+    def send(self, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """Returns the next message, or None once the peer has closed the connection."""
+        line = self.reader.readline(MAX_MESSAGE)
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.reader.close()
+        self.sock.close()
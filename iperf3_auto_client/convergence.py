@@ -0,0 +1,78 @@
+import math
+from collections import deque
+from statistics import NormalDist
+
+
+def t_quantile(confidence, degrees_of_freedom):
+    # Cornish-Fisher expansion of Student's t around the normal quantile, accurate to a
+    # few percent from 3 degrees of freedom, which is all a stopping rule needs
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    v = degrees_of_freedom
+    return z + (z ** 3 + z) / (4 * v) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * v ** 2)
+
+
+class ConvergenceDetector:
+    """
+    Decides when a throughput test can stop. Keeps a rolling window of interval rates
+    and reports convergence once the confidence interval of their mean is within
+    `tolerance` (relative) of the mean, but never before `min_duration` seconds.
+    """
+
+    def __init__(self, tolerance=0.02, window=5, min_duration=5, max_duration=60, confidence=0.95, warmup=1):
+        self.tolerance = tolerance
+        self.window = max(window, 3)
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.confidence = confidence
+        self.warmup = warmup
+        self.samples = deque(maxlen=self.window)
+        self.elapsed = 0.0
+        self.seen = 0
+        self.converged = False
+        self._t = t_quantile(confidence, self.window - 1)
+
+    def add(self, bits_per_second, end_time=None):
+        self.seen += 1
+        if end_time is not None:
+            self.elapsed = end_time
+        # The first intervals include TCP slow start and would only widen the interval
+        if self.seen > self.warmup:
+            self.samples.append(bits_per_second)
+        if not self.converged and self.elapsed >= self.min_duration and len(self.samples) == self.window:
+            mean = self.mean
+            self.converged = mean > 0 and self.half_width <= self.tolerance * mean
+        return self.converged
+
+    def add_interval(self, report, reverse=False):
+        """Feeds one interval; with reverse, the other direction of a --bidir report."""
+        total = report.sum_reverse if reverse else report.sum
+        if total is None or total.omitted:
+            return self.converged
+        return self.add(total.bits_per_second, report.end)
+
+    @property
+    def mean(self):
+        return sum(self.samples) / len(self.samples) if self.samples else 0.0
+
+    @property
+    def stddev(self):
+        n = len(self.samples)
+        if n < 2:
+            return 0.0
+        mean = self.mean
+        return math.sqrt(sum((x - mean) ** 2 for x in self.samples) / (n - 1))
+
+    @property
+    def half_width(self):
+        n = len(self.samples)
+        if n < 2:
+            return float('inf')
+        return self._t * self.stddev / math.sqrt(n)
+
+    def cannot_reach(self, target):
+        """True once a full window shows, with the configured confidence, that the mean stays below target."""
+        return len(self.samples) == self.window and self.mean + self.half_width < target
+
+    def describe(self):
+        return (f"mean {self.mean / 1e6:.2f} Mbits/sec ± {self.half_width / 1e6:.2f} "
+                f"({self.confidence:.0%} CI over {len(self.samples)} intervals) after {self.elapsed:.0f}s")
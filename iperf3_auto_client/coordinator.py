@@ -0,0 +1,220 @@
+import argparse
+import hmac
+import itertools
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from control import Connection
+from mesh import MeshOrchestrator
+from results import IntervalReport, TestResult
+
+COORDINATOR_PORT = 50003
+
+
+class AgentSession:
+    """
+    The coordinator's side of one agent's persistent control connection. Requests are
+    multiplexed by id, so several jobs can be in flight at once, and interval events
+    streamed back by the agent are handed to the job's on_interval as they arrive.
+    Has the same run_test() as mesh.AgentHandle, so a MeshOrchestrator can use it.
+    """
+
+    def __init__(self, connection, info, on_close=None, token=None):
+        self.connection = connection
+        self.token = token
+        self.host = info.get("address") or connection.peer[0]
+        self.name = info.get("name", f"{self.host}:{connection.peer[1]}")
+        self.iperf_port = info.get("iperf_port")
+        self.version = info.get("version")
+        self.on_close = on_close
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name=f"agent:{self.name}", daemon=True)
+        self._reader.start()
+
+    def __repr__(self):
+        return f"AgentSession({self.name}, {self.host}, iperf port {self.iperf_port})"
+
+    def _read_loop(self):
+        try:
+            while True:
+                message = self.connection.receive()
+                if message is None:
+                    break
+                with self._lock:
+                    job = self._pending.get(message.get("id"))
+                if job is None:
+                    continue
+                future, on_interval = job
+                if message.get("event") == "interval":
+                    if on_interval is not None:
+                        on_interval(IntervalReport.from_dict(message["interval"]))
+                    continue
+                with self._lock:
+                    self._pending.pop(message.get("id"), None)
+                future.set_result(message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._fail_pending()
+
+    def _fail_pending(self):
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(ConnectionError(f"agent {self.name} disconnected"))
+        self.connection.close()
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def submit(self, message, on_interval=None):
+        """Sends a job and returns a Future for the agent's final reply."""
+        future = Future()
+        with self._lock:
+            if self.closed:
+                future.set_exception(ConnectionError(f"agent {self.name} disconnected"))
+                return future
+            message = dict(message, id=next(self._ids), token=self.token)
+            self._pending[message["id"]] = (future, on_interval)
+        try:
+            self.connection.send(message)
+        except OSError as e:
+            with self._lock:
+                self._pending.pop(message["id"], None)
+            future.set_exception(e)
+        return future
+
+    def run_test(self, server, reverse=False, duration=10, extra_args=None, on_interval=None, adaptive=False):
+        """Has this agent test towards `server` (another session, or a (host, port) pair)."""
+        host, port = (server.host, server.iperf_port) if hasattr(server, "host") else server
+        message = {"op": "test", "server": host, "port": port, "reverse": reverse, "duration": duration,
+                   "args": extra_args or [], "adaptive": adaptive, "stream": on_interval is not None}
+        try:
+            reply = self.submit(message, on_interval).result()
+        except (OSError, ConnectionError) as e:
+            return TestResult(server=host, port=port, reverse=reverse, error=str(e))
+        if "result" not in reply:
+            return TestResult(server=host, port=port, reverse=reverse, error=reply.get("error", "no result"))
+        return TestResult.from_dict(reply["result"])
+
+    def close(self):
+        self.connection.close()
+
+
+class Coordinator:
+    """
+    Accepts the persistent control connections that agents open (mesh_agent.py
+    --coordinator) and keeps one AgentSession per agent, so jobs go out straight away
+    without discovery or connection setup. An agent that reconnects replaces its old
+    session. With a `token`, only agents whose hello carries the same mesh_token are
+    accepted, and it goes with every job.
+    """
+
+    def __init__(self, port=COORDINATOR_PORT, bind="", log=print, token=None):
+        self.port = port
+        self.bind = bind
+        self.log = log
+        self.token = token or None
+        self.sessions = {}
+        self.sock = None
+        self._changed = threading.Condition()
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.bind, self.port))
+        self.sock.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        self.log(f"Coordinator waiting for agents on port {self.port}")
+        return self
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._register, args=(conn,), daemon=True).start()
+
+    def _register(self, conn):
+        connection = Connection(conn)
+        try:
+            conn.settimeout(10)
+            hello = connection.receive()
+            conn.settimeout(None)
+        except (OSError, ValueError):
+            hello = None
+        if not hello or hello.get("op") != "hello":
+            connection.close()
+            return
+        token = hello.get("token")
+        if self.token is not None and not (isinstance(token, str) and hmac.compare_digest(token, self.token)):
+            self.log(f"Rejected an agent from {connection.peer[0]}: wrong or missing token")
+            connection.close()
+            return
+        session = AgentSession(connection, hello.get("info", {}), on_close=self._unregister, token=self.token)
+        with self._changed:
+            old = self.sessions.get(session.name)
+            self.sessions[session.name] = session
+            self._changed.notify_all()
+        if old is not None:
+            old.close()
+        self.log(f"Agent {session.name} connected from {connection.peer[0]} (iperf3 port {session.iperf_port})")
+
+    def _unregister(self, session):
+        with self._changed:
+            if self.sessions.get(session.name) is session:
+                del self.sessions[session.name]
+                self.log(f"Agent {session.name} disconnected")
+            self._changed.notify_all()
+
+    def agents(self):
+        with self._changed:
+            return sorted(self.sessions.values(), key=lambda s: s.name)
+
+    def wait_for_agents(self, count, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while len(self.sessions) < count:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+        return self.agents()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        for session in self.agents():
+            session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive connected agents: run a full mesh over them")
+    parser.add_argument('--port', type=int, default=COORDINATOR_PORT)
+    parser.add_argument('--agents', type=int, default=2, help="wait for this many agents")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--bidir', action='store_true')
+    parser.add_argument('--repeat', type=int, default=1, help="meshes to run over the same connections")
+    parser.add_argument('--interval', type=float, default=0, help="seconds between meshes")
+    parser.add_argument('--token', help="the agents' mesh_token")
+    args = parser.parse_args()
+
+    coordinator = Coordinator(args.port, token=args.token).start()
+    coordinator.wait_for_agents(args.agents, args.timeout)
+    try:
+        for run in range(args.repeat):
+            if run and args.interval:
+                time.sleep(args.interval)
+            orchestrator = MeshOrchestrator(coordinator.agents(), args.duration, args.bidir)
+            orchestrator.run()
+            print(orchestrator.describe())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        coordinator.close()
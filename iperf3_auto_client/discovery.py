@@ -0,0 +1,196 @@
+import random
+import socket
+import struct
+import threading
+import time
+from tracing import traced
+
+# Wire format shared with the server's discovery.py, all integers in network byte order:
+#   solicit: magic "IPF3", type 1, protocol version, nonce (u32)
+#   offer:   magic "IPF3", type 2, protocol version, nonce (u32), IPv4 address, base port (u16),
+#            load percent (u8), port count (u8), ports (u16 each), version length (u8), version
+MAGIC = b"IPF3"
+PROTOCOL_VERSION = 1
+TYPE_SOLICIT = 1
+TYPE_OFFER = 2
+HEADER = struct.Struct("!4sBBI")
+OFFER = struct.Struct("!4sHBB")
+DISCOVERY_PORT = 50001
+
+
+class ServerOffer:
+    __slots__ = ('ip', 'port', 'free_ports', 'load', 'version', 'latency')
+
+    def __init__(self, ip, port, free_ports, load, version, latency):
+        self.ip = ip
+        self.port = port
+        self.free_ports = free_ports
+        self.load = load
+        self.version = version
+        self.latency = latency
+
+    def pick_port(self):
+        return random.choice(self.free_ports) if self.free_ports else self.port
+
+    def __repr__(self):
+        return (f"ServerOffer({self.ip}:{self.port}, free={self.free_ports}, load={self.load}%, "
+                f"version={self.version!r}, {self.latency * 1000:.1f} ms)")
+
+
+def decode_solicit(data):
+    if len(data) < HEADER.size:
+        return None
+    magic, message_type, version, nonce = HEADER.unpack_from(data)
+    if magic != MAGIC or message_type != TYPE_SOLICIT:
+        return None
+    return nonce
+
+
+def encode_offer(nonce, ip, port, free_ports, load, version=""):
+    free_ports = list(free_ports)[:255]
+    version = version.encode("utf-8")[:255]
+    load = max(0, min(100, int(round(load * 100))))
+    return (
+        HEADER.pack(MAGIC, TYPE_OFFER, PROTOCOL_VERSION, nonce)
+        + OFFER.pack(socket.inet_aton(ip), port, load, len(free_ports))
+        + struct.pack(f"!{len(free_ports)}H", *free_ports)
+        + struct.pack("!B", len(version)) + version
+    )
+
+
+def encode_solicit(nonce):
+    return HEADER.pack(MAGIC, TYPE_SOLICIT, PROTOCOL_VERSION, nonce)
+
+
+def decode_offer(data, nonce, latency=0.0):
+    try:
+        magic, message_type, version, reply_nonce = HEADER.unpack_from(data)
+        if magic != MAGIC or message_type != TYPE_OFFER or reply_nonce != nonce:
+            return None
+        offset = HEADER.size
+        ip, port, load, port_count = OFFER.unpack_from(data, offset)
+        offset += OFFER.size
+        free_ports = list(struct.unpack_from(f"!{port_count}H", data, offset))
+        offset += 2 * port_count
+        (version_length,) = struct.unpack_from("!B", data, offset)
+        offset += 1
+        server_version = data[offset:offset + version_length].decode("utf-8", "replace")
+    except struct.error:
+        return None
+    return ServerOffer(socket.inet_ntoa(ip), port, free_ports, load, server_version, latency)
+
+
+@traced("solicit_servers")
+def solicit_servers(multicast_group="224.0.0.1", discovery_port=DISCOVERY_PORT, timeout=0.5,
+                    strategy="first", settle=0.05, retries=3, targets=None):
+    """
+    Multicasts (and broadcasts) a solicit and returns the offers received, best first.
+    With strategy "first" it returns as soon as one server answers; with "least_loaded" it
+    keeps listening `settle` seconds after the first answer and sorts by load. The solicit
+    is repeated a few times within the timeout in case a datagram is lost. Pass `targets`
+    to unicast the solicit to known addresses instead.
+    """
+    targets = list(targets) if targets else [multicast_group, "<broadcast>"]
+    nonce = random.getrandbits(32)
+    message = encode_solicit(nonce)
+    offers = {}
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        started = time.monotonic()
+        deadline = started + timeout
+        resend_at = [started + timeout * i / retries for i in range(retries)]
+        while True:
+            now = time.monotonic()
+            while resend_at and resend_at[0] <= now:
+                resend_at.pop(0)
+                for destination in targets:
+                    try:
+                        sock.sendto(message, (destination, discovery_port))
+                    except OSError:
+                        pass
+            if now >= deadline:
+                break
+            wake = min([deadline] + resend_at[:1])
+            sock.settimeout(max(wake - now, 0.001))
+            try:
+                data, address = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            offer = decode_offer(data, nonce, time.monotonic() - started)
+            if offer is None or offer.ip in offers:
+                continue
+            offers[offer.ip] = offer
+            if strategy == "first":
+                break
+            # Give the other servers a moment to answer, then stop
+            deadline = min(deadline, time.monotonic() + settle)
+
+    ordered = list(offers.values())
+    if strategy == "least_loaded":
+        ordered.sort(key=lambda o: (o.load, -len(o.free_ports), o.latency))
+    return ordered
+
+
+class DiscoveryResponder:
+    """
+    Answers client solicits on the discovery port straight away with a binary offer
+    carrying this server's address, idle ports, load and iperf3 version. A copy of the
+    server's, so mesh agents can answer on their own discovery port.
+    """
+
+    def __init__(self, ip, port, free_ports, load, version="", multicast_group="224.0.0.1",
+                 discovery_port=DISCOVERY_PORT, log=print):
+        self.ip = ip
+        self.port = port
+        self.free_ports = free_ports
+        self.load = load
+        self.version = version
+        self.multicast_group = multicast_group
+        self.discovery_port = discovery_port
+        self.log = log
+        self.sock = None
+        self.answered = 0
+
+    def open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", self.discovery_port))
+        try:
+            group = socket.inet_aton(self.multicast_group) + socket.inet_aton("0.0.0.0")
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group)
+        except OSError as e:
+            self.log(f"Discovery: could not join {self.multicast_group}, answering broadcasts only: {e}")
+        self.sock = sock
+        return sock
+
+    def serve_forever(self):
+        if self.sock is None:
+            self.open()
+        self.log(f"Discovery responder listening on UDP {self.discovery_port}")
+        while True:
+            try:
+                data, address = self.sock.recvfrom(512)
+            except OSError:
+                break
+            nonce = decode_solicit(data)
+            if nonce is None:
+                continue
+            offer = encode_offer(nonce, self.ip, self.port, self.free_ports(), self.load(), self.version)
+            try:
+                self.sock.sendto(offer, address)
+                self.answered += 1
+            except OSError as e:
+                self.log(f"Discovery: could not answer {address[0]}: {e}")
+
+    def start(self):
+        self.open()
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from discovery import solicit_servers, DISCOVERY_PORT
+from network_utils import probe_iperf_server
+from tracing import traced
+
+
+class DiscoveryCache:
+    """
+    Remembers recently used servers on disk so a returning client can skip discovery.
+    Entries expire `ttl` seconds after they were last seen and only the `max_entries`
+    most recent ones are kept.
+    """
+
+    def __init__(self, path, ttl=86400, max_entries=16):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.evict()
+
+    def save(self):
+        self.evict()
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def evict(self, now=None):
+        now = now or time.time()
+        fresh = {ip: e for ip, e in self.entries.items() if now - e.get("last_seen", 0) < self.ttl}
+        newest = sorted(fresh.items(), key=lambda item: item[1]["last_seen"], reverse=True)
+        self.entries = dict(newest[:self.max_entries])
+
+    def record(self, ip, ports, source="discovery"):
+        self.entries[ip] = {"ports": list(ports), "last_seen": time.time(), "source": source}
+        self.save()
+
+    def remove(self, ip):
+        if self.entries.pop(ip, None) is not None:
+            self.save()
+
+    def fresh_entries(self):
+        """(ip, entry) pairs, most recently seen first."""
+        self.evict()
+        return list(self.entries.items())
+
+    @traced("find_cached_server")
+    def find_live_server(self, discovery_port=DISCOVERY_PORT, timeout=0.3):
+        """
+        Returns (ip, ports) of the most recently seen cached server that is still alive, or
+        (None, None). Servers are first asked with a unicast solicit, which also refreshes
+        their idle port list; servers without a discovery responder get an iperf3 handshake.
+        """
+        entries = self.fresh_entries()
+        if not entries:
+            return None, None
+
+        # Every cached server gets the whole timeout to answer, not just the fastest one
+        offers = solicit_servers(discovery_port=discovery_port, timeout=timeout, retries=2,
+                                 targets=[ip for ip, _ in entries], strategy="least_loaded", settle=timeout)
+        if offers:
+            # Prefer the one seen most recently over the least loaded one
+            rank = {ip: index for index, (ip, _) in enumerate(entries)}
+            offer = min(offers, key=lambda o: rank.get(o.ip, len(rank)))
+            ports = offer.free_ports or [offer.port]
+            self.record(offer.ip, ports, "cache")
+            return offer.ip, ports
+
+        with ThreadPoolExecutor(max_workers=len(entries)) as executor:
+            alive = list(executor.map(
+                lambda item: probe_iperf_server(item[0], item[1]["ports"][0], timeout), entries))
+        for (ip, entry), is_alive in zip(entries, alive):
+            if is_alive:
+                self.record(ip, entry["ports"], "cache")
+                return ip, entry["ports"]
+        return None, None
@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+
+PROC_STAT = "/proc/stat"
+PROC_NET_DEV = "/proc/net/dev"
+PROC_SOFTIRQS = "/proc/softirqs"
+
+
+def parse_cpu_list(text):
+    """'0-3,6' -> [0, 1, 2, 3, 6], the format taskset and /sys/devices/system/cpu use."""
+    cores = []
+    for part in str(text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cores.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(cores))
+
+
+def pin_process(pid, cores):
+    """Restricts a running process to `cores`; returns False where the OS has no affinity API."""
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(pid, cores)
+    return True
+
+
+def affinity_args(cores):
+    # iperf3 -A pins to a single core, so it is only the fallback where we cannot pin ourselves
+    if cores and not hasattr(os, "sched_setaffinity"):
+        return ["-A", str(cores[0])]
+    return []
+
+
+def read_cpu_times(path=PROC_STAT):
+    """{cpu: (busy, total, softirq)} in clock ticks, for every core listed in /proc/stat."""
+    times = {}
+    with open(path) as f:
+        for line in f:
+            if not line.startswith("cpu") or line.startswith("cpu "):
+                continue
+            fields = line.split()
+            # user nice system idle iowait irq softirq steal (guest time is already in user)
+            values = [int(v) for v in fields[1:9]]
+            total = sum(values)
+            idle = values[3] + values[4]
+            times[int(fields[0][3:])] = (total - idle, total, values[6])
+    return times
+
+
+def read_net_dev(path=PROC_NET_DEV):
+    """{interface: (rx_bytes, tx_bytes)}."""
+    counters = {}
+    with open(path) as f:
+        for line in f:
+            name, sep, data = line.partition(":")
+            if not sep or "|" in line:
+                continue
+            fields = data.split()
+            counters[name.strip()] = (int(fields[0]), int(fields[8]))
+    return counters
+
+
+def read_net_softirqs(path=PROC_SOFTIRQS):
+    """{cpu: NET_RX + NET_TX softirqs raised so far}."""
+    with open(path) as f:
+        header = f.readline().split()
+        counts = [0] * len(header)
+        for line in f:
+            fields = line.split()
+            if fields and fields[0] in ("NET_RX:", "NET_TX:"):
+                for index, value in enumerate(fields[1:len(header) + 1]):
+                    counts[index] += int(value)
+    return {int(name[3:]): count for name, count in zip(header, counts)}
+
+
+def link_speed(interface):
+    """Negotiated link speed in bits/s, or None for virtual interfaces and where it is unknown."""
+    try:
+        with open(f"/sys/class/net/{interface}/speed") as f:
+            speed = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return speed * 1e6 if speed > 0 else None
+
+
+def host_sampling_supported():
+    return all(os.path.exists(path) for path in (PROC_STAT, PROC_NET_DEV))
+
+
+class HostStats:
+    """
+    What the host did during one test: utilisation of the busiest core that iperf3 could
+    run on, its softirq share, NIC throughput against link speed, and which of the two
+    limited the test ('cpu', 'nic' or None).
+    """
+    __slots__ = (
+        'cores', 'samples', 'cpu_percent', 'peak_cpu_percent', 'softirq_percent', 'net_softirqs_per_second',
+        'interface', 'link_bps', 'rx_bps', 'tx_bps', 'nic_percent', 'bound'
+    )
+
+    def __init__(self, cores=None, samples=0, cpu_percent=None, peak_cpu_percent=None, softirq_percent=None,
+                 net_softirqs_per_second=None, interface=None, link_bps=None, rx_bps=None, tx_bps=None,
+                 nic_percent=None, bound=None):
+        self.cores = cores
+        self.samples = samples
+        self.cpu_percent = cpu_percent
+        self.peak_cpu_percent = peak_cpu_percent
+        self.softirq_percent = softirq_percent
+        self.net_softirqs_per_second = net_softirqs_per_second
+        self.interface = interface
+        self.link_bps = link_bps
+        self.rx_bps = rx_bps
+        self.tx_bps = tx_bps
+        self.nic_percent = nic_percent
+        self.bound = bound
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def describe(self):
+        text = f"busiest core {self.cpu_percent or 0:.0f}% (softirq {self.softirq_percent or 0:.0f}%)"
+        if self.interface is not None:
+            text += (f", {self.interface} rx {(self.rx_bps or 0) / 1e6:.1f} / "
+                     f"tx {(self.tx_bps or 0) / 1e6:.1f} Mbits/sec")
+            if self.nic_percent is not None:
+                text += f" ({self.nic_percent:.0f}% of link)"
+        if self.bound:
+            text += f", {self.bound.upper()}-bound"
+        return text
+
+
+class HostSampler:
+    """
+    Samples /proc/stat, /proc/net/dev and /proc/softirqs every `interval` seconds while a
+    test runs. Utilisation is taken per sample from the busiest of `cores` (all cores when
+    None), so a process the scheduler moves between cores still shows up as saturated;
+    the NIC figures are for the interface that moved the most bytes.
+    """
+
+    def __init__(self, cores=None, interval=1.0, cpu_threshold=90.0, nic_threshold=90.0):
+        self.cores = list(cores) if cores else None
+        self.interval = interval
+        self.cpu_threshold = cpu_threshold
+        self.nic_threshold = nic_threshold
+        self._stop = threading.Event()
+        self._thread = None
+        # Running totals rather than lists, so a 24 h soak test samples in constant memory
+        self._samples = 0
+        self._busiest_total = 0.0
+        self._busiest_peak = 0.0
+        self._softirq_total = 0.0
+        self._peak_net = {}
+        self._first = None
+        self._last = None
+
+    def _snapshot(self):
+        softirqs = read_net_softirqs() if os.path.exists(PROC_SOFTIRQS) else {}
+        return time.monotonic(), read_cpu_times(), read_net_dev(), softirqs
+
+    def _add_sample(self, previous, current):
+        elapsed = current[0] - previous[0]
+        busiest = softirq = 0.0
+        for cpu, (busy, total, irq) in current[1].items():
+            if self.cores is not None and cpu not in self.cores or cpu not in previous[1]:
+                continue
+            ticks = total - previous[1][cpu][1]
+            if ticks > 0:
+                percent = 100.0 * (busy - previous[1][cpu][0]) / ticks
+                if percent >= busiest:
+                    busiest = percent
+                    softirq = 100.0 * (irq - previous[1][cpu][2]) / ticks
+        self._samples += 1
+        self._busiest_total += busiest
+        self._busiest_peak = max(self._busiest_peak, busiest)
+        self._softirq_total += softirq
+        if elapsed > 0:
+            for name, (rx, tx) in current[2].items():
+                if name in previous[2]:
+                    rate = 8 * max(rx - previous[2][name][0], tx - previous[2][name][1]) / elapsed
+                    self._peak_net[name] = max(self._peak_net.get(name, 0.0), rate)
+
+    def _run(self):
+        previous = self._first
+        while not self._stop.wait(self.interval):
+            current = self._snapshot()
+            self._add_sample(previous, current)
+            previous = current
+        self._last = previous
+
+    def start(self):
+        self._first = self._snapshot()
+        self._thread = threading.Thread(target=self._run, name="host-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops sampling and returns the HostStats of the whole test."""
+        self._stop.set()
+        self._thread.join()
+        last = self._snapshot()
+        if last[0] - self._last[0] >= self.interval / 2 or not self._samples:
+            self._add_sample(self._last, last)
+        return self.summarize(self._first, last)
+
+    def summarize(self, first, last):
+        elapsed = max(last[0] - first[0], 1e-9)
+        totals = {name: (rx - first[2][name][0], tx - first[2][name][1])
+                  for name, (rx, tx) in last[2].items() if name in first[2]}
+        stats = HostStats(cores=self.cores, samples=self._samples)
+        if self._samples:
+            stats.cpu_percent = self._busiest_total / self._samples
+            stats.peak_cpu_percent = self._busiest_peak
+            stats.softirq_percent = self._softirq_total / self._samples
+        if last[3]:
+            raised = sum(count - first[3].get(cpu, 0) for cpu, count in last[3].items()
+                         if self.cores is None or cpu in self.cores)
+            stats.net_softirqs_per_second = raised / elapsed
+        if totals:
+            interface = max(totals, key=lambda name: max(totals[name]))
+            rx, tx = totals[interface]
+            if rx or tx:
+                stats.interface = interface
+                stats.rx_bps = 8 * rx / elapsed
+                stats.tx_bps = 8 * tx / elapsed
+                stats.link_bps = link_speed(interface)
+                if stats.link_bps:
+                    stats.nic_percent = 100.0 * self._peak_net.get(interface, 0.0) / stats.link_bps
+        stats.bound = self.classify(stats)
+        return stats
+
+    def classify(self, stats):
+        # A saturated link explains a busy CPU too (interrupts, copies), so it wins
+        if stats.nic_percent is not None and stats.nic_percent >= self.nic_threshold:
+            return "nic"
+        if stats.cpu_percent is not None and stats.cpu_percent >= self.cpu_threshold:
+            return "cpu"
+        return None
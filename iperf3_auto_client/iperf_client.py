@@ -1,21 +1,55 @@
 import os
-import tempfile
-import requests
+import asyncio
+import atexit
+import time
+import re
 import subprocess
-import zipfile
-import shutil
+import signal
+import threading
+import sqlite3
 import sys
 from datetime import datetime
 import configparser
-from logger import setup_logger
+from logger import setup_logger_from_config
+from results import ResultParser, TextResultParser
+from convergence import ConvergenceDetector
+from soak import SoakMonitor, stream_process
+from result_store import ResultStore
+from regression import RegressionDetector
+from rate_search import UdpRateSearch, parse_rate
+from tuning import TuningCache, ParameterSweep, TUNING_FLAGS, sweep_values
+from host_stats import HostSampler, parse_cpu_list, pin_process, affinity_args, host_sampling_supported
+from provisioning import provision_iperf, ProvisioningError
+from native_engine import NativeClient, TestParams, IPERF_COMPATIBLE
+from admission import Reservation, AdmissionError, ADMISSION_PORT
+from network_utils import get_default_interface_ip
+import tracing
+from tracing import traced
 
 class IperfClient:
     def __init__(self):
         self.config = self.load_config()
-        self.logger = setup_logger(self.config['settings']['log_file'])
+        self.logger = setup_logger_from_config(self.config['settings'], 'IperfClient')
+        self.trace_file = self.config['settings'].get('trace_file', fallback='').strip()
+        if self.trace_file:
+            # Started before setup_iperf so tool setup shows up in the trace too
+            tracing.enable()
+            atexit.register(self.write_trace)
         
         self.port = int(self.config['settings']['port'])
+        self.json_output = self.config['settings'].getboolean('json_output', fallback=False)
         self.iperf_path = self.setup_iperf()
+        # Without an iperf3 the tests run on the built-in engine, see native_engine.py
+        self.engine = "iperf3" if self.iperf_path else "native"
+        self._iperf_version = None
+        self.store = self.open_store()
+        self.regressions = self.open_baselines()
+        self.client_ip = get_default_interface_ip()
+        self.tuning = TuningCache(
+            self.config['settings'].get('tuning_cache', fallback='./iperf3_tuning_cache.json'),
+            ttl=self.config['settings'].getint('tuning_ttl', fallback=7 * 86400)
+        )
+        self.cores = parse_cpu_list(self.config['settings'].get('cpu_affinity', fallback=''))
 
     def load_config(self):
         config = configparser.ConfigParser()
@@ -25,63 +59,434 @@ class IperfClient:
     def log(self, message):
         self.logger.info(message)
 
+    def write_trace(self):
+        """Writes the Chrome trace of this run to `trace_file` and logs the per-phase summary."""
+        tracer = tracing.active()
+        if tracer is None or not tracer.events:
+            return
+        try:
+            tracer.write_chrome_trace(self.trace_file)
+            self.log(f"Trace written to {self.trace_file}")
+        except OSError as e:
+            self.log(f"Could not write trace to {self.trace_file}: {str(e)}")
+        for line in tracer.describe().splitlines():
+            self.log(f"Trace: {line}")
+
+    def open_store(self):
+        path = self.config['settings'].get('result_store', fallback='./iperf3_results.db')
+        if not path:
+            return None
+        try:
+            return ResultStore(path)
+        except sqlite3.Error as e:
+            self.log(f"Could not open result store {path}, results will not be stored: {str(e)}")
+            return None
+
+    def open_baselines(self):
+        settings = self.config['settings']
+        path = settings.get('regression_baselines', fallback='./iperf3_baselines.json')
+        if not path:
+            return None
+        return RegressionDetector(
+            path, log=self.log,
+            threshold=settings.getfloat('regression_threshold', fallback=4.0),
+            min_drop=settings.getfloat('regression_min_drop', fallback=0.1),
+            warmup=settings.getint('regression_warmup', fallback=5)
+        )
+
+    def reserve(self, server_ip, duration, ports=1):
+        """
+        Waits for this client's turn in the server's admission queue and returns the
+        Reservation (its `ports` are ours until release()), or None to go ahead without
+        one, e.g. when the server has no admission queue.
+        """
+        settings = self.config['settings']
+        if not settings.getboolean('admission', fallback=True):
+            return None
+        reservation = Reservation(
+            server_ip, settings.getint('admission_port', fallback=ADMISSION_PORT), duration, ports,
+            timeout=settings.getfloat('admission_timeout', fallback=0) or None,
+            on_update=lambda position, eta: self.log(
+                f"Waiting for {server_ip}: position {position} in the queue, about {eta:.0f}s to go")
+        )
+        try:
+            reservation.enter()
+        except ConnectionRefusedError:
+            self.log(f"{server_ip} has no admission queue, testing without a reservation")
+            return None
+        except (AdmissionError, OSError) as e:
+            self.log(f"Could not reserve a slot on {server_ip}, testing without a reservation: {str(e)}")
+            return None
+        self.log(f"Reserved port(s) {','.join(str(p) for p in reservation.ports)} on {server_ip} "
+                 f"after waiting {reservation.waited or 0:.1f}s")
+        return reservation
+
+    def with_tuning(self, server_ip, reverse=False, extra_args=None):
+        """Adds the cached best settings for this path unless the caller chose its own."""
+        extra_args = list(extra_args or [])
+        if not self.config['settings'].getboolean('use_tuned', fallback=True) or "-u" in extra_args:
+            return extra_args
+        if any(flag in extra_args for flag in TUNING_FLAGS):
+            return extra_args
+        entry = self.tuning.get(self.client_ip, server_ip, reverse)
+        return extra_args + entry["args"] if entry else extra_args
+
+    def pin(self, pid):
+        try:
+            pin_process(pid, self.cores)
+        except OSError as e:
+            self.log(f"Could not pin iperf3 to CPUs {self.cores}: {str(e)}")
+
+    def host_sampler(self):
+        """A started HostSampler for the next test, or None when sampling is off or unsupported."""
+        settings = self.config['settings']
+        if not settings.getboolean('host_sampling', fallback=True) or not host_sampling_supported():
+            return None
+        return HostSampler(
+            self.cores,
+            interval=settings.getfloat('host_sample_interval', fallback=1.0),
+            cpu_threshold=settings.getfloat('cpu_bound_threshold', fallback=90.0),
+            nic_threshold=settings.getfloat('nic_bound_threshold', fallback=90.0),
+        ).start()
+
+    def finish_result(self, parser, sampler, error=None):
+        result = parser.finish(error)
+        if sampler is not None:
+            result.host = sampler.stop()
+            self.log(f"Host during test: {result.host.describe()}")
+        return result
+
+    def record_result(self, result):
+        if self.store is not None and result is not None:
+            try:
+                self.store.record(result, self.client_ip)
+            except sqlite3.Error as e:
+                self.log(f"Could not store result: {str(e)}")
+        if self.regressions is not None and result is not None:
+            self.regressions.record(result, self.client_ip)
+        return result
+
+    @traced()
     def setup_iperf(self):
-        iperf_path = self.config['settings']['iperf_path']
-        cygwin_dll_path = self.config['settings']['cygwin_dll_path']
-        
-        if not os.path.exists(iperf_path):
+        settings = self.config['settings']
+        engine = settings.get('engine', fallback='auto').strip().lower()
+        if engine == 'native':
+            self.log("Using the native Python engine instead of iperf3")
+            return None
+        try:
+            return provision_iperf(
+                settings.get('iperf_path'),
+                url=settings.get('iperf_url'),
+                sha256=settings.get('iperf_sha256', fallback='').strip() or None,
+                cache_dir=settings.get('tool_cache', fallback='').strip() or None,
+                use_system=settings.getboolean('use_system_iperf', fallback=True),
+                allow_unverified=settings.getboolean('allow_unverified_download', fallback=False),
+                log=self.log
+            )
+        except (ProvisioningError, OSError) as e:
+            if engine == 'auto':
+                self.log(f"iperf3 is not available ({str(e)}), using the native Python engine")
+                return None
+            self.log(f"Error setting up iperf3: {str(e)}")
+            sys.exit(1)
+
+    def iperf_version(self):
+        if self.engine == "native":
+            return IPERF_COMPATIBLE
+        if self._iperf_version is None:
+            self._iperf_version = (0, 0)
             try:
-                self.log("Downloading iperf3...")
-                url = self.config['settings']['iperf_url']
-                response = requests.get(url, timeout=30)
-                response.raise_for_status()
-                
-                zip_path = os.path.join(tempfile.gettempdir(), "iperf3.14_64.zip")
-
-                with open(zip_path, "wb") as f:
-                    f.write(response.content)
-                
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(os.path.dirname(iperf_path))
-                
-                os.remove(zip_path)
-                self.log(f"iperf3 and cygwin1.dll downloaded to {iperf_path}")
-                
-                if not os.path.exists(iperf_path) or not os.path.exists(cygwin_dll_path):
-                    raise FileNotFoundError(f"Files not found in {iperf_path} or {cygwin_dll_path}")
-                
+                output = subprocess.run([self.iperf_path, "--version"], capture_output=True, text=True, timeout=10).stdout
+                match = re.search(r"iperf (\d+)\.(\d+)", output)
+                if match:
+                    self._iperf_version = (int(match.group(1)), int(match.group(2)))
             except Exception as e:
-                self.log(f"Error downloading iperf3: {str(e)}")
-                sys.exit(1)
-        
-        return iperf_path
+                self.log(f"Could not determine iperf3 version: {str(e)}")
+        return self._iperf_version
+
+    def build_command(self, server_ip, reverse=False, duration=60, port=None, extra_args=None):
+        cmd = [
+            self.iperf_path or "native", "-c", server_ip, "-p", str(port or self.port),
+            "--format", "m", "-t", str(duration)
+        ]
+        if reverse:
+            cmd.append("--reverse")
+        if extra_args:
+            cmd.extend(extra_args)
+        cmd.extend(affinity_args(self.cores))
+        return cmd
+
+    @traced()
+    def run_test(self, server_ip, reverse=False, json_output=False, on_interval=None, port=None):
+        if json_output or self.engine == "native":
+            return self.run_json_test(server_ip, reverse=reverse, port=port, on_interval=on_interval)
 
-    def run_test(self, server_ip, reverse=False):
-        self.log(f"Starting iperf3 client test to {server_ip}:{self.port} with {'reverse' if reverse else 'regular'} mode")
+        port = port or self.port
+        self.log(f"Starting iperf3 client test to {server_ip}:{port} with {'reverse' if reverse else 'regular'} mode")
+        extra_args = self.with_tuning(server_ip, reverse)
+        # Parsed from the interval lines as they come, so the test is stored and judged like a JSON one
+        parser, stream_args = self.streaming_parser(server_ip, port, reverse, extra_args, on_interval)
+        cmd = self.build_command(server_ip, reverse, port=port, extra_args=extra_args) + stream_args
+        return self.record_result(self._run_streaming(cmd, parser))
+
+    @traced()
+    def run_json_test(self, server_ip, reverse=False, duration=60, port=None, extra_args=None, on_interval=None,
+                      trial=False):
+        port = port or self.port
+        self.log(f"Starting iperf3 JSON test to {server_ip}:{port} with {'reverse' if reverse else 'regular'} mode")
+        if not trial:
+            extra_args = self.with_tuning(server_ip, reverse, extra_args)
+        record = (lambda result: result) if trial else self.record_result
+        cmd = self.build_command(server_ip, reverse, duration, port, extra_args)
+        # --json-stream (iperf3 3.17+) emits every interval as it happens, plain --json only at the end
+        if self.iperf_version() >= (3, 17):
+            parser = ResultParser(server_ip, port, reverse, on_interval)
+            return record(self._run_streaming(cmd + ["--json-stream"], parser))
+
+        cmd.append("--json")
+        parser = ResultParser(server_ip, port, reverse, on_interval)
+        sampler = self.host_sampler()
         try:
-            cmd = [
-                self.iperf_path, "-c", server_ip, "-p", str(self.port),
-                "--format", "m", "-t", "60"
-            ]
-            if reverse:
-                cmd.append("--reverse")
-            
             self.log(f"Running command: {' '.join(cmd)}")
-            
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True
             )
+            self.pin(process.pid)
             output, error = process.communicate()
+            if output.strip():
+                parser.feed_document(output)
 
             if process.returncode != 0:
-                self.log(f"Test failed with exit code {process.returncode}. Error: {error.strip()}")
-                return False
-            
-            self.log(f"Test completed successfully (Reverse: {reverse})")
-            return True
+                result = self.finish_result(parser, sampler,
+                                            error.strip() or f"iperf3 exited with code {process.returncode}")
+                self.log(f"Test failed with exit code {process.returncode}. Error: {result.error}")
+                return record(result)
+
+            result = self.finish_result(parser, sampler)
+            self.log(result.describe())
+            return record(result)
         except Exception as e:
             self.log(f"Error running test: {str(e)}")
-            return False
\ No newline at end of file
+            return record(self.finish_result(parser, sampler, str(e)))
+
+    def streaming_parser(self, server_ip, port, reverse=False, extra_args=None, on_interval=None, keep_intervals=True):
+        """Returns a parser that sees every interval as it happens, and the iperf3 flags it needs."""
+        if self.iperf_version() >= (3, 17):
+            return ResultParser(server_ip, port, reverse, on_interval, keep_intervals), ["--json-stream"]
+        extra_args = extra_args or []
+        num_streams = int(extra_args[extra_args.index("-P") + 1]) if "-P" in extra_args else 1
+        parser = TextResultParser(server_ip, port, reverse, on_interval, num_streams, "-u" in extra_args,
+                                  keep_intervals)
+        return parser, ["-i", "1", "--forceflush"]
+
+    @traced()
+    def run_soak_test(self, server_ip, duration=None, reverse=False, port=None, extra_args=None, on_interval=None):
+        """
+        Long-running test (e.g. 24 h) in constant memory: intervals go to a SoakMonitor
+        instead of being kept, and downsampled history is written to `soak_history`.
+        Returns the monitor, whose `result` is the final TestResult.
+        """
+        settings = self.config['settings']
+        duration = duration or settings.getint('soak_duration', fallback=86400)
+        port = port or self.port
+        monitor = SoakMonitor(
+            recent=settings.getint('soak_recent_intervals', fallback=3600),
+            downsample=settings.getint('soak_downsample', fallback=60),
+            history_file=settings.get('soak_history', fallback='./iperf3_soak_history.csv')
+        )
+        report_every = settings.getint('soak_report_interval', fallback=300)
+        extra_args = self.with_tuning(server_ip, reverse, extra_args)
+
+        def handle_interval(report):
+            monitor.add(report)
+            if monitor.intervals and monitor.intervals % report_every == 0:
+                self.log(f"Soak progress: {monitor.describe()}")
+            if on_interval is not None:
+                on_interval(report)
+
+        parser, stream_args = self.streaming_parser(server_ip, port, reverse, extra_args, handle_interval,
+                                                    keep_intervals=False)
+        cmd = self.build_command(server_ip, reverse, duration, port, extra_args) + stream_args
+        self.log(f"Starting {duration}s soak test to {server_ip}:{port}. Running command: {' '.join(cmd)}")
+        sampler = self.host_sampler()
+        try:
+            if self.engine == "native":
+                NativeClient(TestParams.from_args(cmd[1:])).run(parser.feed_event)
+                error = None
+            else:
+                returncode = asyncio.run(stream_process(cmd, parser.feed_line, on_start=self.pin))
+                error = f"iperf3 exited with code {returncode}" if returncode != 0 else None
+        except Exception as e:
+            error = str(e)
+        except KeyboardInterrupt:
+            error = "interrupted"
+        monitor.close()
+        monitor.result = self.record_result(self.finish_result(parser, sampler, error))
+        self.log(f"Soak test finished: {monitor.describe()}")
+        if error:
+            self.log(f"Soak test error: {monitor.result.error}")
+        return monitor
+
+    @traced()
+    def run_adaptive_test(self, server_ip, reverse=False, port=None, extra_args=None, on_interval=None,
+                          tolerance=None, min_duration=None, max_duration=None, prune_below=None, trial=False):
+        """
+        Stops once throughput has converged, or as soon as it clearly cannot reach
+        `prune_below` bits/s. Trial runs (parameter sweeps) use exactly `extra_args`
+        and are not recorded.
+        """
+        settings = self.config['settings']
+        make_detector = lambda: ConvergenceDetector(
+            tolerance=tolerance or settings.getfloat('adaptive_tolerance', fallback=0.02),
+            window=settings.getint('adaptive_window', fallback=5),
+            min_duration=min_duration or settings.getint('adaptive_min_duration', fallback=5),
+            max_duration=max_duration or settings.getint('adaptive_max_duration', fallback=60),
+        )
+        detector = make_detector()
+        port = port or self.port
+        if not trial:
+            extra_args = self.with_tuning(server_ip, reverse, extra_args)
+        # A --bidir test carries both directions: each gets its own detector and the test
+        # only stops once both have converged
+        detectors = [(detector, False)]
+        if extra_args and "--bidir" in extra_args:
+            detectors.append((make_detector(), True))
+        self.log(f"Starting adaptive iperf3 test to {server_ip}:{port} with {'reverse' if reverse else 'regular'} mode "
+                 f"(tolerance {detector.tolerance:.1%}, {detector.min_duration}-{detector.max_duration}s)")
+
+        def handle_interval(report):
+            for d, other_direction in detectors:
+                d.add_interval(report, other_direction)
+            if on_interval is not None:
+                on_interval(report)
+
+        parser, stream_args = self.streaming_parser(server_ip, port, reverse, extra_args, handle_interval)
+        cmd = self.build_command(server_ip, reverse, detector.max_duration, port, extra_args) + stream_args
+        converged = lambda: all(d.converged for d, _ in detectors)
+        pruned = lambda: prune_below is not None and any(d.cannot_reach(prune_below) for d, _ in detectors)
+        describe = lambda: "; ".join(d.describe() for d, _ in detectors)
+        result = self._run_streaming(cmd, parser, should_stop=lambda: converged() or pruned())
+        if converged():
+            self.log(f"Throughput converged: {describe()}")
+        elif pruned():
+            self.log(f"Stopped, cannot reach {prune_below / 1e6:.2f} Mbits/sec: {describe()}")
+        return result if trial else self.record_result(result)
+
+    @traced()
+    def run_sweep(self, server_ip, port=None, reverse=False):
+        """Finds and caches the best -P/-w/-l/-Z settings for this path; returns (params, bits/s)."""
+        settings = self.config['settings']
+        sweep = ParameterSweep(
+            self, server_ip, port=port, reverse=reverse,
+            streams=sweep_values(settings.get('sweep_streams', fallback='1, 2, 4, 8'), int),
+            windows=sweep_values(settings.get('sweep_windows', fallback='default, 512K, 2M, 8M')),
+            lengths=sweep_values(settings.get('sweep_lengths', fallback='default, 128K, 1M')),
+            zerocopy=[False, True] if settings.getboolean('sweep_zerocopy', fallback=True) else [False],
+            min_gain=settings.getfloat('sweep_min_gain', fallback=0.03),
+            max_duration=settings.getint('sweep_max_duration', fallback=20),
+        )
+        params, bits_per_second = sweep.run()
+        if bits_per_second > 0:
+            self.tuning.record(self.client_ip, server_ip, reverse, params, bits_per_second)
+        return params, bits_per_second
+
+    @traced()
+    def run_udp_rate_search(self, server_ip, port=None, reverse=False, max_loss=None, max_jitter=None):
+        """Binary-searches the highest loss-free UDP rate; returns the UdpRateSearch with its step trace."""
+        settings = self.config['settings']
+        if max_jitter is None and settings.get('udp_max_jitter', fallback='').strip():
+            max_jitter = settings.getfloat('udp_max_jitter')
+        search = UdpRateSearch(
+            self, server_ip, port=port, reverse=reverse,
+            min_rate=parse_rate(settings.get('udp_min_rate', fallback='1M')),
+            max_rate=parse_rate(settings.get('udp_max_rate', fallback='1G')),
+            max_loss=max_loss if max_loss is not None else settings.getfloat('udp_max_loss', fallback=0.0),
+            max_jitter=max_jitter,
+            precision=settings.getfloat('udp_precision', fallback=0.01),
+            trial_duration=settings.getint('udp_trial_duration', fallback=5),
+            max_trials=settings.getint('udp_max_trials', fallback=10),
+        )
+        search.run()
+        return search
+
+    def ensure_tuned(self, server_ip, port=None, directions=(False, True)):
+        """Sweeps every direction that has no fresh cached settings yet."""
+        for reverse in directions:
+            if self.tuning.get(self.client_ip, server_ip, reverse) is None:
+                self.log(f"No tuned settings for {server_ip} ({'reverse' if reverse else 'regular'}), sweeping")
+                self.run_sweep(server_ip, port, reverse)
+
+    def _run_streaming(self, cmd, parser, should_stop=None):
+        if self.engine == "native":
+            return self._run_native(cmd, parser, should_stop)
+        stopped = False
+        sampler = self.host_sampler()
+        try:
+            self.log(f"Running command: {' '.join(cmd)}")
+            launched = time.perf_counter_ns()
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True
+            )
+            self.pin(process.pid)
+            for line in process.stdout:
+                if launched is not None:
+                    # Process start, connection and parameter exchange, up to iperf3's first output
+                    tracing.add_span("iperf3_startup", launched)
+                    launched = None
+                parser.feed_line(line)
+                if not stopped and should_stop is not None and should_stop():
+                    stopped = True
+                    self._interrupt(process)
+            process.wait()
+
+            if stopped:
+                # iperf3 reports the interrupt as an error, but we asked for it
+                parser.result.error = None
+                result = self.finish_result(parser, sampler)
+                self.log(f"Test stopped early after {result.intervals[-1].end:.0f}s. {result.describe()}")
+                return result
+
+            if process.returncode != 0:
+                result = self.finish_result(parser, sampler, f"iperf3 exited with code {process.returncode}")
+                self.log(f"Test failed with exit code {process.returncode}. Error: {result.error}")
+                return result
+
+            result = self.finish_result(parser, sampler)
+            self.log(result.describe())
+            return result
+        except Exception as e:
+            self.log(f"Error running test: {str(e)}")
+            return self.finish_result(parser, sampler, str(e))
+
+    def _run_native(self, cmd, parser, should_stop=None):
+        """_run_streaming on the native engine: the same events into the same parser, in this process."""
+        sampler = self.host_sampler()
+        try:
+            params = TestParams.from_args(cmd[1:])
+            self.log(f"Running native test: {params.describe()}")
+            stopped = NativeClient(params).run(parser.feed_event, should_stop)
+        except Exception as e:
+            result = self.finish_result(parser, sampler, str(e) or type(e).__name__)
+            self.log(f"Test failed. Error: {result.error}")
+            return result
+
+        result = self.finish_result(parser, sampler)
+        if stopped:
+            self.log(f"Test stopped early after {result.intervals[-1].end:.0f}s. {result.describe()}")
+        else:
+            self.log(result.describe())
+        return result
+
+    def _interrupt(self, process, grace=5):
+        # SIGINT makes the iperf3 client finish the test cleanly and still print its summary
+        if os.name == "posix":
+            process.send_signal(signal.SIGINT)
+        else:
+            process.terminate()
+        threading.Timer(grace, lambda: process.poll() is None and process.kill()).start()
@@ -0,0 +1,355 @@
+import argparse
+import gzip
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
+from results import TextResultParser
+
+CHUNK_SIZE = 64 * 1024 * 1024
+# How far back a chunk looks for the timestamp in force where it starts
+CONTEXT_SIZE = 64 * 1024
+# The start of a file identifies it: if it changed, the file was rotated or rewritten
+HEAD_SIZE = 1024
+WEEKDAYS = (b"Mon", b"Tue", b"Wed", b"Thu", b"Fri", b"Sat", b"Sun")
+MONTHS = {name: number for number, name in enumerate(
+    (b"Jan", b"Feb", b"Mar", b"Apr", b"May", b"Jun", b"Jul", b"Aug", b"Sep", b"Oct", b"Nov", b"Dec"), 1)}
+# First bytes of the only lines the scanner looks at: "[", "Connecting", "Accepted", "Server", "iperf", "Reverse"
+MARKERS = frozenset(b"[CASiR")
+
+
+def _clock(text, start=0):
+    """'YYYY-mm-dd HH:MM:SS' at text[start:] as epoch seconds (local time), None if it is not one."""
+    if len(text) < start + 19 or text[start + 4] != 45 or text[start + 13] != 58:
+        return None
+    try:
+        return time.mktime((int(text[start:start + 4]), int(text[start + 5:start + 7]),
+                            int(text[start + 8:start + 10]), int(text[start + 11:start + 13]),
+                            int(text[start + 14:start + 16]), int(text[start + 17:start + 19]), 0, 0, -1))
+    except (ValueError, OverflowError):
+        return None
+
+
+def split_prefix(line):
+    """
+    Takes the prefixes the loggers put on a line; returns (timestamp, channel, rest) with
+    timestamp None when the line has none. The formats, told apart by fixed positions:
+
+        2024-03-01 12:00:00,123 - INFO - message     logger.py (IperfServer, IperfClient)
+        [2024-03-01 12:00:00] message                iperf3_v2.log
+        Time: Fri, 01 Mar 2024 12:00:00 GMT          iperf3 -V
+        Fri Mar  1 12:00:00 2024 [  5] ...           iperf3 --timestamps
+
+    channel is the port of IperfServer's "[5201] ..." debug lines, which interleave the
+    output of every server of a pool in one file. Lines that are log messages rather than
+    iperf3 output come back with an empty rest.
+    """
+    if len(line) > 23 and line[4] == 45 and line[10] == 32 and line[19] == 44:
+        timestamp = _clock(line)
+        parts = line.split(b" - ", 2)
+        rest = parts[2] if len(parts) == 3 else b""
+        if rest[:1] == b"[":
+            close = rest.find(b"]")
+            if rest[1:close].isdigit():
+                return timestamp, rest[1:close], rest[close + 2:]
+        return timestamp, None, b""
+    if len(line) > 20 and line[0] == 91 and line[5] == 45 and line[20] == 93:
+        return _clock(line, 1), None, b""
+    if line.startswith(b"Time: "):
+        try:
+            return parsedate_to_datetime(line[6:].decode("ascii")).timestamp(), None, b""
+        except (ValueError, TypeError, UnicodeDecodeError):
+            return None, None, line
+    if len(line) > 24 and line[3] == 32 and line[:3] in WEEKDAYS and line[13] == 58 and line[19] == 32:
+        try:
+            timestamp = time.mktime((int(line[20:24]), MONTHS[line[4:7]], int(line[8:10]), int(line[11:13]),
+                                     int(line[14:16]), int(line[17:19]), 0, 0, -1))
+            return timestamp, None, line[25:]
+        except (KeyError, ValueError, OverflowError):
+            return None, None, line
+    return None, None, line
+
+
+class LegacyTest:
+    """One test being rebuilt from iperf3's text output, as printed by the client or the server."""
+    __slots__ = ('start', 'role', 'server', 'port', 'client', 'timestamp', 'streams', 'udp', 'sending', 'bidir',
+                 'reverse_mode', 'error', 'parsers')
+
+    def __init__(self, start, role, timestamp):
+        self.start = start
+        self.role = role
+        self.server = None
+        self.port = None
+        self.client = None
+        self.timestamp = timestamp
+        self.streams = 0
+        self.udp = False
+        self.sending = None
+        self.bidir = False
+        self.reverse_mode = False
+        self.error = None
+        self.parsers = {}
+
+    def feed(self, line):
+        close = line.find(b"]")
+        tag = None
+        body = line[close + 1:]
+        if body[:1] == b"[":
+            # --bidir role tags: [TX-C], [RX-S], and [Role] in the header
+            end = body.find(b"]")
+            tag, body = body[1:end], body[end + 1:]
+        body = body.lstrip()
+        if body.startswith(b"local "):
+            # "local 10.0.0.2 port 53412 connected to 10.0.0.1 port 5201", once per stream
+            tokens = body.split()
+            if len(tokens) >= 9:
+                self.streams += 1
+                local, remote = tokens[1].decode(), tokens[6].decode()
+                if self.role == "client":
+                    self.client = local
+                    self.server = self.server or remote
+                    self.port = self.port or int(tokens[8])
+                else:
+                    self.server, self.client, self.port = local, self.client or remote, int(tokens[3])
+        elif body.startswith(b"Interval"):
+            if self.sending is None:
+                self.bidir = tag == b"Role"
+                self.udp = b"Datagrams" in body or b"Jitter" in body
+                # Only the sending side prints Retr (TCP) or datagrams without jitter (UDP)
+                self.sending = b"Retr" in body or (b"Datagrams" in body and b"Jitter" not in body)
+        elif self.sending is not None:
+            parser = self.parsers.get(tag)
+            if parser is None:
+                streams = max(self.streams // 2 if self.bidir else self.streams, 1)
+                parser = self.parsers[tag] = TextResultParser(num_streams=streams, udp=self.udp)
+            parser.feed_line(line.decode("utf-8", "replace"))
+
+    def _reverse(self, tag):
+        sending = tag.startswith(b"TX") if tag is not None else self.sending
+        if self.role == "client":
+            return self.reverse_mode if tag is None else not sending
+        return bool(sending)
+
+    def results(self, fallback_time=None):
+        """The TestResults of this test, one per direction; none for a connection that never tested."""
+        if not self.parsers:
+            if self.error is None:
+                return []
+            parser = TextResultParser(udp=self.udp)
+            parser.result.reverse = self.reverse_mode
+            self.parsers[None] = parser
+        results = []
+        for tag, parser in self.parsers.items():
+            result = parser.finish(self.error)
+            result.server = self.server or ''
+            result.port = self.port
+            result.timestamp = self.timestamp or fallback_time
+            result.reverse = self._reverse(tag)
+            results.append(result)
+        return results
+
+
+class LogScanner:
+    """
+    Rebuilds tests from legacy logs: the raw iperf3 output that iperf3_v2 saved (client
+    and server), with or without its timestamped messages in between, and IperfServer's
+    log with debug output on, where several servers' lines interleave. Feed it lines with
+    their byte offsets. Only tests that start before `limit` are taken, so chunks of one
+    file can be scanned independently: each finishes the tests it started past its end.
+    """
+
+    def __init__(self, timestamp=None, limit=None, fallback_time=None):
+        self.timestamp = timestamp
+        self.limit = limit
+        self.fallback_time = fallback_time
+        self.tests = {}
+        # (start offset, client, TestResult) of every finished test
+        self.finished = []
+
+    @property
+    def pending(self):
+        """Offset of the first test still running at the end of the input, or None."""
+        return min((test.start for test in self.tests.values()), default=None)
+
+    def feed(self, offset, line):
+        timestamp, channel, rest = split_prefix(line.rstrip(b"\r"))
+        if timestamp is not None:
+            self.timestamp = timestamp
+        if not rest or rest[0] not in MARKERS:
+            return
+        test = self.tests.get(channel)
+        if rest[0] == 91:
+            if test is not None:
+                test.feed(rest)
+        elif rest.startswith(b"Connecting to host ") or rest.startswith(b"Accepted connection from "):
+            self._finish(channel)
+            if self.limit is None or offset < self.limit:
+                role = "client" if rest[0] == 67 else "server"
+                test = self.tests[channel] = LegacyTest(offset, role, self.timestamp)
+                host, _, port = rest[19 if role == "client" else 25:].partition(b", port ")
+                if role == "client":
+                    test.server, test.port = host.decode(), int(port or 0) or None
+                else:
+                    test.client = host.decode()
+        elif test is None:
+            return
+        elif rest.startswith(b"Reverse mode"):
+            test.reverse_mode = True
+        elif rest.startswith(b"iperf3: error"):
+            test.error = rest.split(b"-", 1)[-1].strip().decode("utf-8", "replace")
+            if test.role == "client":
+                self._finish(channel)
+        elif rest.startswith(b"iperf Done") or rest.startswith(b"Server listening on"):
+            self._finish(channel)
+
+    def _finish(self, channel):
+        test = self.tests.pop(channel, None)
+        if test is not None:
+            for result in test.results(self.fallback_time):
+                self.finished.append((test.start, test.client, result))
+
+
+def context_timestamp(data, start, size=CONTEXT_SIZE):
+    """The last timestamp logged before `start`, looking back up to `size` bytes."""
+    floor = max(0, start - size)
+    end = start
+    while end > floor:
+        begin = data.rfind(b"\n", floor, end - 1) + 1
+        if begin == 0 and floor > 0:
+            break
+        timestamp = split_prefix(data[begin:end].rstrip(b"\r\n"))[0]
+        if timestamp is not None:
+            return timestamp
+        end = begin
+    return None
+
+
+def scan_lines(data, start, end, scanner):
+    """Feeds the whole lines of data[start:] to scanner until past `end` with no test open; returns where it stopped."""
+    find = data.find
+    size = len(data)
+    position = start
+    while position < size:
+        if position >= end and not scanner.tests:
+            break
+        newline = find(b"\n", position)
+        if newline < 0:
+            # A partial last line is still being written, the next import reads it
+            break
+        scanner.feed(position, data[position:newline])
+        position = newline + 1
+    return position
+
+
+def scan_chunk(path, start, end, fallback_time=None):
+    """Scans the tests that start in [start, end) of a file; runs in the worker processes."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if start > 0 and data[start - 1] != 10:
+            start = data.find(b"\n", start) + 1 or len(data)
+        scanner = LogScanner(context_timestamp(data, start), end, fallback_time)
+        stopped = scan_lines(data, start, end, scanner)
+        return scanner.finished, scanner.pending, stopped
+
+
+def head_digest(data, length):
+    return hashlib.sha256(data[:min(length, HEAD_SIZE)]).hexdigest()
+
+
+def open_log(path):
+    """Opens a log for mapping; a .gz backup is decompressed into a temporary file, a block at a time."""
+    if not path.endswith(".gz"):
+        return open(path, "rb")
+    temporary = tempfile.TemporaryFile(prefix="log_import-")
+    try:
+        with gzip.open(path, "rb") as f:
+            shutil.copyfileobj(f, temporary, 1048576)
+        temporary.flush()
+    except BaseException:
+        temporary.close()
+        raise
+    return temporary
+
+
+def import_log(store, path, workers=None, chunk_size=CHUNK_SIZE, full=False, log=print):
+    """
+    Loads the tests of a legacy log into a ResultStore, resuming from where the previous
+    import of the same file stopped. Plain files are memory-mapped and, when larger than
+    one chunk, scanned in chunks across a process pool. Rotated .gz backups are decompressed
+    to a temporary file, which needs their uncompressed size free in the temporary directory,
+    and mapped the same way but scanned in this process. Tests without any timestamp in the log get the file's modification time. Returns the
+    number of runs stored.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    started = time.perf_counter()
+    source = open_log(path)
+    data = b""
+    try:
+        if os.fstat(source.fileno()).st_size:
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = 0
+        state = None if full else store.import_state(path)
+        if state is not None:
+            if state["offset"] <= len(data) and head_digest(data, state["offset"]) == state["head"]:
+                offset = state["offset"]
+            else:
+                log(f"{path} changed since it was last imported, reading it from the start")
+        if offset >= len(data):
+            log(f"{path}: nothing new since offset {offset}")
+            return 0
+
+        end = len(data)
+        if path.endswith(".gz") or end - offset <= chunk_size or workers == 1:
+            scanner = LogScanner(context_timestamp(data, offset), None, stat.st_mtime)
+            stopped = scan_lines(data, offset, end, scanner)
+            finished, pending = scanner.finished, scanner.pending
+        else:
+            bounds = list(range(offset, end, chunk_size))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunks = list(pool.map(scan_chunk, [path] * len(bounds), bounds,
+                                       bounds[1:] + [end], [stat.st_mtime] * len(bounds)))
+            finished = [entry for chunk in chunks for entry in chunk[0]]
+            pending = min((chunk[1] for chunk in chunks if chunk[1] is not None), default=None)
+            stopped = chunks[-1][2]
+        # Tests still running at the end of the file are read again, whole, by the next import, and so
+        # is every test that starts after them: only those before the resume offset are stored now
+        resume = pending if pending is not None else stopped
+        finished.sort(key=lambda entry: entry[0])
+        items = [(result, client) for start, client, result in finished if start < resume]
+        store.record_import(path, items, resume, stat.st_size, head_digest(data, resume))
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+        source.close()
+
+    elapsed = time.perf_counter() - started
+    log(f"{path}: {len(items)} runs from {(end - offset) / 1048576:.1f} MB in {elapsed:.2f}s "
+        f"({(end - offset) / 1048576 / elapsed if elapsed > 0 else 0:.1f} MB/s), next import resumes at {resume}")
+    return len(items)
+
+
+def main(argv=None):
+    from result_store import ResultStore
+
+    parser = argparse.ArgumentParser(description="Import legacy iperf3 text logs into the result store")
+    parser.add_argument('paths', nargs='+', help="iperf3_iperf_log.txt, iperf3_server_log.txt, ... (.gz too)")
+    parser.add_argument('--db', default='./iperf3_results.db', help="result store path")
+    parser.add_argument('--workers', type=int, help="processes per file, the CPU count by default")
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_SIZE // 1048576, help="bytes per worker task, in MB")
+    parser.add_argument('--full', action='store_true', help="ignore saved offsets and read every file whole")
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.db)
+    try:
+        total = sum(import_log(store, path, args.workers, args.chunk_mb * 1048576, args.full) for path in args.paths)
+    finally:
+        store.close()
+    print(f"Imported {total} runs")
+
+
+if __name__ == "__main__":
+    main()
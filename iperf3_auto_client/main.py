@@ -1,17 +1,108 @@
 import sys
 from network_utils import listen_for_server
+from discovery import solicit_servers, DISCOVERY_PORT
+from discovery_cache import DiscoveryCache
 from iperf_client import IperfClient
+from scheduler import CycleScheduler
+from regression import EXIT_REGRESSION
 
 if __name__ == "__main__":
     client = IperfClient()
 
-    # Try to listen for a server using multicast
-    server_ip, server_port = listen_for_server(client.port)
+    settings = client.config['settings']
+
+    discovery_port = settings.getint('discovery_port', fallback=DISCOVERY_PORT)
+    cache = DiscoveryCache(
+        settings.get('discovery_cache', fallback='./iperf3_server_cache.json'),
+        ttl=settings.getint('discovery_cache_ttl', fallback=86400)
+    )
+
+    # Servers we used recently come first, full discovery only runs when none of them answers
+    server_ip, server_ports = cache.find_live_server(discovery_port)
     if server_ip:
-        client.log(f"Found server via multicast: {server_ip}:{server_port}")
+        client.log(f"Using cached server {server_ip}:{','.join(str(p) for p in server_ports)}")
     else:
-        client.log("No server found via multicast. Proceeding with manual input.")
-        server_ip = input("Enter server IP manually: ")
-        server_port = client.port
+        # Ask servers to answer right away, then fall back to waiting for an announcement
+        offers = solicit_servers(
+            multicast_group=settings.get('multicast_group', fallback='224.0.0.1'),
+            discovery_port=discovery_port,
+            timeout=settings.getfloat('discovery_timeout', fallback=0.5),
+            strategy=settings.get('discovery_strategy', fallback='least_loaded')
+        )
+        if offers:
+            offer = offers[0]
+            server_ip, server_ports = offer.ip, offer.free_ports or [offer.port]
+            client.log(f"Server answered discovery in {offer.latency * 1000:.1f} ms: {offer}")
+        else:
+            server_ip, server_ports = listen_for_server(client.port, settings.getint('timeout', fallback=10), all_ports=True)
+
+        if server_ip:
+            client.log(f"Found server via multicast: {server_ip}:{','.join(str(p) for p in server_ports)}")
+            cache.record(server_ip, server_ports)
+        else:
+            client.log("No server found via multicast. Proceeding with manual input.")
+            server_ip = input("Enter server IP manually: ")
+            server_ports = [client.port]
+            cache.record(server_ip, server_ports, "manual")
+
+    cycles = settings.getint('cycles', fallback=0)
+    duration = settings.getint('duration', fallback=60)
+    # Wait for our turn on a busy server rather than racing other clients for its ports
+    if settings.getboolean('udp_search', fallback=False):
+        expected = 2 * settings.getint('udp_max_trials', fallback=10) * settings.getint('udp_trial_duration', fallback=5)
+    elif settings.getboolean('soak', fallback=False):
+        expected = settings.getint('soak_duration', fallback=86400)
+    elif cycles > 0:
+        expected = 2 * cycles * duration
+    elif settings.getboolean('adaptive', fallback=False):
+        expected = settings.getint('adaptive_max_duration', fallback=60)
+    else:
+        expected = 60
+    if settings.getboolean('sweep', fallback=False) or settings.getboolean('auto_tune', fallback=False):
+        expected += 2 * 10 * settings.getint('sweep_max_duration', fallback=20)
+    reservation = client.reserve(server_ip, expected, ports=min(len(server_ports), 2) if cycles > 0 else 1)
+    if reservation is not None:
+        server_ports = reservation.ports
+    server_port = server_ports[0]
+
+    try:
+        # Find the fastest -P/-w/-l/-Z for this path; tests below pick the cached result up
+        if settings.getboolean('sweep', fallback=False):
+            client.run_sweep(server_ip, server_port)
+            client.run_sweep(server_ip, server_port, reverse=True)
+        elif settings.getboolean('auto_tune', fallback=False):
+            client.ensure_tuned(server_ip, server_port)
+
+        if settings.getboolean('udp_search', fallback=False):
+            client.run_udp_rate_search(server_ip, server_port)
+            client.run_udp_rate_search(server_ip, server_port, reverse=True)
+        elif settings.getboolean('soak', fallback=False):
+            client.run_soak_test(server_ip, port=server_port)
+        elif cycles > 0:
+            scheduler = CycleScheduler(
+                client, server_ip, ports=server_ports,
+                mode=settings.get('cycle_mode', fallback='auto'),
+                duration=duration,
+                adaptive=settings.getboolean('adaptive', fallback=False)
+            )
+            cycle_results = scheduler.run(cycles)
+            try:
+                from analytics import IntervalTable, analyze, describe
+                for line in describe(analyze(IntervalTable.from_results(cycle_results, client.client_ip))):
+                    client.log(f"Across cycles: {line}")
+            except ImportError as e:
+                client.log(f"Cross-cycle statistics need NumPy: {str(e)}")
+        elif settings.getboolean('adaptive', fallback=False):
+            client.run_adaptive_test(server_ip, port=server_port)
+        else:
+            client.run_test(server_ip, json_output=client.json_output, port=server_port)
+    finally:
+        if reservation is not None:
+            reservation.release()
 
-    client.run_test(server_ip)
\ No newline at end of file
+    # Scheduled runs find out from the exit code that a path got slower
+    if client.regressions is not None and client.regressions.regressions:
+        client.log(f"{len(client.regressions.regressions)} regression(s) in this run:")
+        for verdict in client.regressions.regressions:
+            client.log(verdict.describe())
+        sys.exit(EXIT_REGRESSION)
\ No newline at end of file
@@ -0,0 +1,220 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from control import Connection, CONTROL_PORT, MESH_DISCOVERY_PORT
+from discovery import solicit_servers
+from results import TestResult, split_bidir
+
+
+def schedule_rounds(hosts, bidir=False):
+    """
+    Orders the tests between every pair of hosts into rounds in which no host takes part
+    in more than one test: the circle method edge-colours the complete graph in N - 1
+    rounds (N for odd N), the minimum. Each round is a list of (client, server, reverse).
+    With bidir one test covers both directions, otherwise every colour becomes two
+    rounds, one per direction, so the N x (N - 1) ordered pairs take 2(N - 1) rounds.
+    """
+    hosts = list(hosts)
+    if len(hosts) < 2:
+        return []
+    ring = hosts + [None] if len(hosts) % 2 else list(hosts)
+    rounds = []
+    for _ in range(len(ring) - 1):
+        pairs = [(ring[i], ring[-1 - i]) for i in range(len(ring) // 2)]
+        pairs = [(a, b) for a, b in pairs if a is not None and b is not None]
+        rounds.append([(a, b, False) for a, b in pairs])
+        if not bidir:
+            rounds.append([(a, b, True) for a, b in pairs])
+        # Keep the first host fixed and rotate the others one place
+        ring = [ring[0], ring[-1]] + ring[1:-1]
+    return rounds
+
+
+class AgentHandle:
+    """The orchestrator's side of one mesh agent, reached over its control port."""
+
+    def __init__(self, host, control_port=CONTROL_PORT, timeout=5, token=None):
+        self.host = host
+        self.control_port = control_port
+        self.timeout = timeout
+        self.token = token or None
+        self.name = f"{host}:{control_port}"
+        self.iperf_port = None
+        self.version = None
+        self._connection = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def __repr__(self):
+        return f"AgentHandle({self.name}, iperf port {self.iperf_port})"
+
+    def request(self, message):
+        # One request at a time per agent, on a connection that stays open between rounds
+        with self._lock:
+            message = dict(message, id=next(self._ids), token=self.token)
+            for attempt in range(2):
+                if self._connection is None:
+                    self._connection = Connection.connect(self.host, self.control_port, self.timeout)
+                try:
+                    self._connection.send(message)
+                    reply = self._connection.receive()
+                    if reply is not None:
+                        return reply
+                    error = ConnectionError("agent closed the connection")
+                except OSError as e:
+                    error = e
+                self._connection.close()
+                self._connection = None
+            raise error
+
+    def connect(self):
+        reply = self.request({"op": "info"})
+        if "info" not in reply:
+            raise ValueError(reply.get("error", "no agent info"))
+        info = reply["info"]
+        self.name = info.get("name", self.name)
+        self.iperf_port = info["iperf_port"]
+        self.version = info.get("version")
+        return self
+
+    def run_test(self, server, reverse=False, duration=10, extra_args=None):
+        """Has this agent test towards the iperf3 server of agent `server`."""
+        try:
+            reply = self.request({"op": "test", "server": server.host, "port": server.iperf_port,
+                                  "reverse": reverse, "duration": duration, "args": extra_args or []})
+        except (OSError, ValueError) as e:
+            return TestResult(server=server.host, port=server.iperf_port, reverse=reverse, error=str(e))
+        if "result" not in reply:
+            return TestResult(server=server.host, port=server.iperf_port, reverse=reverse,
+                              error=reply.get("error", "no result"))
+        return TestResult.from_dict(reply["result"])
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class MeshOrchestrator:
+    """
+    Measures every ordered pair of agents. Rounds come from schedule_rounds, the tests
+    of a round run in parallel and the next round starts when all of them are done.
+    """
+
+    def __init__(self, agents, duration=10, bidir=False, extra_args=None, log=print):
+        self.agents = list(agents)
+        self.duration = duration
+        self.bidir = bidir
+        self.extra_args = list(extra_args or [])
+        self.log = log
+        self.results = {}
+
+    def _record(self, client, server, reverse, result):
+        if result.bidir:
+            regular, backward = split_bidir(result)
+            self.results[(client.name, server.name)] = regular
+            self.results[(server.name, client.name)] = backward
+        elif reverse:
+            self.results[(server.name, client.name)] = result
+        else:
+            self.results[(client.name, server.name)] = result
+
+    def run(self):
+        rounds = schedule_rounds(self.agents, self.bidir)
+        args = self.extra_args + (["--bidir"] if self.bidir else [])
+        self.log(f"Mesh of {len(self.agents)} agents: {sum(len(r) for r in rounds)} tests in {len(rounds)} rounds")
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(len(self.agents) // 2, 1)) as executor:
+            for number, tests in enumerate(rounds, 1):
+                round_started = time.monotonic()
+                futures = [
+                    (client, server, reverse,
+                     executor.submit(client.run_test, server, reverse, self.duration, args))
+                    for client, server, reverse in tests
+                ]
+                for client, server, reverse, future in futures:
+                    self._record(client, server, reverse, future.result())
+                failed = sum(1 for _, _, _, f in futures if not f.result())
+                self.log(f"Round {number}/{len(rounds)}: {len(tests)} tests in "
+                         f"{time.monotonic() - round_started:.1f}s" + (f", {failed} failed" if failed else ""))
+        self.log(f"Mesh finished in {time.monotonic() - started:.1f}s")
+        return self.matrix()
+
+    def matrix(self):
+        """Rows are senders, columns receivers; cells are bits/s, or None where a test failed."""
+        names = [agent.name for agent in self.agents]
+        rows = []
+        for source in names:
+            row = []
+            for target in names:
+                result = self.results.get((source, target))
+                row.append(result.bits_per_second if result else None)
+            rows.append(row)
+        return names, rows
+
+    def describe(self):
+        names, rows = self.matrix()
+        width = max([len(n) for n in names] + [10])
+        lines = ["from \\ to".ljust(width) + "".join(n.rjust(width + 2) for n in names)]
+        for name, row in zip(names, rows):
+            cells = []
+            for target, value in zip(names, row):
+                if target == name:
+                    cells.append("-".rjust(width + 2))
+                elif value is None:
+                    cells.append("failed".rjust(width + 2))
+                else:
+                    cells.append(f"{value / 1e6:.1f}M".rjust(width + 2))
+            lines.append(name.ljust(width) + "".join(cells))
+        return "\n".join(lines)
+
+
+def discover_agents(discovery_port=MESH_DISCOVERY_PORT, timeout=1.0, token=None):
+    """Every mesh agent that answers a solicit on the mesh discovery port; its offer carries the control port."""
+    offers = solicit_servers(discovery_port=discovery_port, timeout=timeout, strategy="least_loaded", settle=timeout)
+    return [AgentHandle(offer.ip, offer.port, token=token) for offer in offers]
+
+
+def parse_agents(text, token=None, control_port=CONTROL_PORT):
+    agents = []
+    for item in text.split(","):
+        item = item.strip()
+        if item:
+            host, _, port = item.rpartition(":")
+            agents.append(AgentHandle(host or item, int(port) if host else control_port, token=token))
+    return agents
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test every pair of mesh agents")
+    parser.add_argument('--agents', help="comma-separated host:control_port list; discovered when omitted")
+    parser.add_argument('--control-port', type=int, default=CONTROL_PORT, help="for --agents given without a port")
+    parser.add_argument('--discovery-port', type=int, default=MESH_DISCOVERY_PORT)
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--bidir', action='store_true', help="one --bidir test per pair (iperf3 3.7+)")
+    parser.add_argument('--json', action='store_true', help="print the matrix as JSON")
+    parser.add_argument('--token', help="the agents' mesh_token")
+    args = parser.parse_args()
+
+    if args.agents:
+        agents = parse_agents(args.agents, args.token, args.control_port)
+    else:
+        agents = discover_agents(args.discovery_port, token=args.token)
+    reachable = []
+    for agent in agents:
+        try:
+            reachable.append(agent.connect())
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Skipping agent {agent.name}: {e}")
+    orchestrator = MeshOrchestrator(reachable, args.duration, args.bidir)
+    names, rows = orchestrator.run()
+    if args.json:
+        print(json.dumps({"agents": names, "bits_per_second": rows}))
+    else:
+        print(orchestrator.describe())
+    for agent in reachable:
+        agent.close()
@@ -0,0 +1,274 @@
+import argparse
+import hmac
+import ipaddress
+import re
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from control import Connection, CONTROL_PORT, MESH_DISCOVERY_PORT
+from discovery import DiscoveryResponder
+from network_utils import get_default_interface_ip
+from supervisor import ServerSupervisor, NativeSupervisor
+from iperf_client import IperfClient
+
+# The only iperf3 options a peer may ask for, and whether they take a value: anything else,
+# -F or --logfile for instance, would let it read or write files on this host
+ALLOWED_ARGS = {"-P": True, "-w": True, "-l": True, "-b": True, "-Z": False, "-u": False, "--bidir": False,
+                "-R": False}
+ARG_VALUE = re.compile(r"^\d+(\.\d+)?[KMGTkmgt]?(/\d+)?$")
+
+
+def check_args(args):
+    """Returns `args` if every option is in ALLOWED_ARGS with a plain numeric value; raises ValueError."""
+    if not isinstance(args, list):
+        raise ValueError("args must be a list")
+    args = [str(arg) for arg in args]
+    index = 0
+    while index < len(args):
+        option = args[index]
+        if option not in ALLOWED_ARGS:
+            raise ValueError(f"iperf3 option {option!r} is not allowed")
+        if ALLOWED_ARGS[option]:
+            index += 1
+            if index == len(args) or not ARG_VALUE.match(args[index]):
+                raise ValueError(f"iperf3 option {option} needs a numeric value")
+        index += 1
+    return args
+
+
+def parse_job(message):
+    """The run_json_test/run_adaptive_test arguments of a test request; raises ValueError when it is malformed."""
+    server = message.get("server")
+    if not isinstance(server, str) or not server:
+        raise ValueError("test request without a server")
+    port = message.get("port")
+    duration = message.get("duration", 10)
+    if port is not None and (not isinstance(port, int) or not 0 < port < 65536):
+        raise ValueError(f"invalid port {port!r}")
+    if duration is not None and (not isinstance(duration, (int, float)) or duration <= 0):
+        raise ValueError(f"invalid duration {duration!r}")
+    return {"server": server, "port": port, "duration": duration, "reverse": bool(message.get("reverse")),
+            "args": check_args(message.get("args") or [])}
+
+
+class MeshAgent:
+    """
+    Runs on every host of a mesh: keeps a supervised iperf3 server up on `iperf_port`
+    for the other hosts to test against, and runs client tests towards them when asked,
+    either on its own control port or over a persistent connection it keeps open to a
+    coordinator. Serving its own control port, it answers discovery solicits on
+    `discovery_port` with an offer whose port is the control port and whose one free
+    port is the iperf3 port (see mesh.discover_agents). Requests and replies are JSON
+    messages (see control.py):
+
+        {"id": 1, "op": "info"}
+        {"id": 2, "op": "test", "server": "10.0.0.2", "port": 5201, "reverse": false,
+         "duration": 10, "args": ["--bidir"], "adaptive": false, "stream": true}
+
+    Jobs run concurrently and answer by id; with "stream" every interval is sent as
+    {"id": 2, "event": "interval", "interval": {...}} before the final reply.
+
+    With a `token`, every request must carry it as "token". Without one, the control port
+    only listens on loopback. Test requests may only pass the iperf3 options in ALLOWED_ARGS.
+    """
+
+    def __init__(self, client, iperf_port=None, control_port=CONTROL_PORT, bind="", name=None, token=None,
+                 discovery_port=MESH_DISCOVERY_PORT):
+        self.client = client
+        self.iperf_port = iperf_port or client.port
+        self.control_port = control_port
+        self.discovery_port = discovery_port
+        self.bind = bind
+        self.token = token or None
+        self.name = name or f"{socket.gethostname()}:{self.iperf_port}"
+        self.supervisor = None
+        self.responder = None
+        self.sock = None
+        self.jobs = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-job")
+        self._closing = threading.Event()
+
+    def log(self, message):
+        self.client.log(f"[agent {self.name}] {message}")
+
+    def start_iperf_server(self, check_interval=1.0):
+        # Supervised as in IperfServer's pool: its output and errors reach the log, and it is
+        # restarted when it exits or stops listening
+        core = self.client.cores[0] if self.client.cores else None
+        if self.client.engine == "native":
+            self.supervisor = NativeSupervisor(self.iperf_port, core, log=self.log, bind=self.bind)
+        else:
+            self.supervisor = ServerSupervisor(self.client.iperf_path, self.iperf_port, core, log=self.log,
+                                               bind=self.bind)
+        self.supervisor.check()
+        threading.Thread(target=self._supervise, args=(check_interval,), name="agent-supervisor", daemon=True).start()
+
+    def _supervise(self, interval):
+        while not self._closing.wait(interval):
+            self.supervisor.check()
+
+    def start_responder(self, address):
+        version = ".".join(str(v) for v in self.client.iperf_version())
+        self.responder = DiscoveryResponder(
+            address or get_default_interface_ip(), self.control_port,
+            free_ports=lambda: [] if self.supervisor.busy else [self.iperf_port],
+            load=lambda: 1.0 if self.supervisor.busy else 0.0,
+            version=f"mesh-agent {version}", discovery_port=self.discovery_port, log=self.log
+        )
+        try:
+            self.responder.start()
+        except OSError as e:
+            self.log(f"Cannot answer discovery on UDP {self.discovery_port}, agents must be listed: {e}")
+            self.responder = None
+
+    def info(self):
+        version = self.client.iperf_version()
+        return {"name": self.name, "iperf_port": self.iperf_port, "address": self.bind or None,
+                "version": ".".join(str(v) for v in version)}
+
+    def authorized(self, message):
+        token = message.get("token")
+        return self.token is None or (isinstance(token, str) and hmac.compare_digest(token, self.token))
+
+    def handle(self, message, send):
+        """Answers one request through send(reply)."""
+        request_id = message.get("id")
+        op = message.get("op")
+        if not self.authorized(message):
+            self.log(f"Rejected {op!r} request {request_id} with a wrong or missing token")
+            send({"id": request_id, "ok": False, "error": "wrong or missing token"})
+        elif op == "info":
+            send({"id": request_id, "ok": True, "info": self.info()})
+        elif op == "test":
+            self.jobs.submit(self.run_job, message, send)
+        else:
+            send({"id": request_id, "ok": False, "error": f"unknown op {op!r}"})
+
+    def run_job(self, message, send):
+        request_id = message.get("id")
+        try:
+            try:
+                job = parse_job(message)
+            except ValueError as e:
+                self.log(f"Rejected job {request_id}: {e}")
+                send({"id": request_id, "ok": False, "error": str(e)})
+                return
+            self.log(f"Testing to {job['server']}:{job['port']}{' (reverse)' if job['reverse'] else ''}")
+            on_interval = None
+            if message.get("stream"):
+                on_interval = lambda report: send({"id": request_id, "event": "interval", "interval": report.to_dict()})
+            try:
+                if message.get("adaptive"):
+                    result = self.client.run_adaptive_test(
+                        job["server"], reverse=job["reverse"], port=job["port"], extra_args=job["args"],
+                        on_interval=on_interval, max_duration=job["duration"]
+                    )
+                else:
+                    result = self.client.run_json_test(
+                        job["server"], reverse=job["reverse"], duration=job["duration"], port=job["port"],
+                        extra_args=job["args"], on_interval=on_interval
+                    )
+            except Exception as e:
+                # Whoever asked waits for a reply by id, so a failure must still produce one
+                self.log(f"Job {request_id} failed: {e}")
+                send({"id": request_id, "ok": False, "error": str(e) or type(e).__name__})
+                return
+            send({"id": request_id, "ok": bool(result), "result": result.to_dict()})
+        except OSError as e:
+            # The connection is gone, the coordinator will hear from us when we reconnect
+            self.log(f"Could not send the result of job {request_id}: {e}")
+
+    def serve_connection(self, connection):
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                self.handle(message, connection.send)
+        except (OSError, ValueError) as e:
+            self.log(f"Control connection from {connection.peer[0]} failed: {e}")
+        finally:
+            connection.close()
+
+    def serve_forever(self):
+        if self.supervisor is None:
+            self.start_iperf_server()
+        address = self.bind
+        if self.token is None and not ipaddress.ip_address(address or "0.0.0.0").is_loopback:
+            # Anyone who reaches the port could have this host send traffic wherever they like
+            self.log("No mesh_token is set, so the control port only listens on loopback")
+            address = "127.0.0.1"
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((address, self.control_port))
+        self.sock.listen(16)
+        self.log(f"Waiting for the orchestrator on {address or 'all addresses'}, control port {self.control_port}")
+        if self.discovery_port:
+            self.start_responder(address)
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve_connection, args=(Connection(conn),), daemon=True).start()
+
+    def connect_to(self, host, port, retry_min=1, retry_max=30):
+        """Keeps a control connection open to the coordinator at host:port and serves its jobs."""
+        if self.supervisor is None:
+            self.start_iperf_server()
+        delay = retry_min
+        while not self._closing.is_set():
+            try:
+                connection = Connection.connect(host, port)
+                connection.send({"op": "hello", "info": self.info(), "token": self.token})
+            except OSError as e:
+                self.log(f"Coordinator {host}:{port} unreachable ({e}), retrying in {delay}s")
+                self._closing.wait(delay)
+                delay = min(delay * 2, retry_max)
+                continue
+            self.log(f"Connected to coordinator {host}:{port}")
+            delay = retry_min
+            self.serve_connection(connection)
+            if not self._closing.is_set():
+                self.log(f"Lost the coordinator at {host}:{port}, reconnecting")
+                self._closing.wait(retry_min)
+
+    def close(self):
+        self._closing.set()
+        self.jobs.shutdown(wait=False)
+        if self.sock is not None:
+            self.sock.close()
+        if self.responder is not None:
+            self.responder.close()
+        if self.supervisor is not None:
+            self.supervisor.stop()
+
+
+if __name__ == "__main__":
+    client = IperfClient()
+    settings = client.config['settings']
+    parser = argparse.ArgumentParser(description="iperf3 mesh agent")
+    parser.add_argument('--iperf-port', type=int, default=client.port)
+    parser.add_argument('--control-port', type=int, default=settings.getint('mesh_control_port', fallback=CONTROL_PORT))
+    parser.add_argument('--bind', default='', help="address to serve on, e.g. 127.0.0.2 for loopback meshes")
+    parser.add_argument('--name')
+    parser.add_argument('--discovery-port', type=int,
+                        default=settings.getint('mesh_discovery_port', fallback=MESH_DISCOVERY_PORT),
+                        help="UDP port to answer mesh discovery on, 0 to not be discoverable")
+    parser.add_argument('--coordinator', default=settings.get('coordinator', fallback=''),
+                        help="host:port of a coordinator to keep a control connection to")
+    parser.add_argument('--token', default=settings.get('mesh_token', fallback=''),
+                        help="shared secret every request must carry; without it only loopback is served")
+    args = parser.parse_args()
+
+    agent = MeshAgent(client, args.iperf_port, args.control_port, args.bind, args.name, args.token,
+                      args.discovery_port)
+    try:
+        if args.coordinator:
+            host, _, port = args.coordinator.rpartition(":")
+            agent.connect_to(host, int(port))
+        else:
+            agent.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.close()
@@ -0,0 +1,734 @@
+import asyncio
+import json
+import os
+import secrets
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+NATIVE_VERSION = "1.0"
+# What the engine offers in iperf3 terms: intervals while the test runs (--json-stream) and --bidir
+IPERF_COMPATIBLE = (3, 17)
+# Every connection opens with magic, kind (control or data stream), stream index and the test's cookie
+HELLO = struct.Struct("!4sBxH8s")
+MAGIC = b"PYPF"
+CONTROL, STREAM = 0, 1
+# UDP payloads start with a sequence number (0 only announces the socket) and the send time in ns
+DATAGRAM = struct.Struct("!QQ")
+# A probe from the discovery code: iperf3's 37 byte cookie, answered with its state byte
+IPERF_COOKIE_SIZE = 37
+IPERF_PARAM_EXCHANGE = 9
+IPERF_ACCESS_DENIED = 0xFF
+TCP_LENGTH = 128 * 1024
+# Below this the event loop's overhead per sendfile() call costs more than the copy it saves
+SENDFILE_SIZE = 1024 * 1024
+UDP_LENGTH = 1460
+UDP_RATE = 1e6
+SETUP_TIMEOUT = 10.0
+# How long a UDP receiver keeps listening after the sender stopped, for datagrams still in flight
+UDP_GRACE = 0.25
+BUSY = "the server is busy running a test. try again later"
+# struct tcp_info from linux/tcp.h up to tcpi_total_retrans: 8 one-byte fields, then 24 u32
+TCP_INFO = struct.Struct("8B24I")
+
+
+class NativeError(Exception):
+    pass
+
+
+def parse_size(text, base=1024):
+    """'128K' -> 131072, '100M' with base 1000 -> 100000000: iperf3's -l/-w and -b notation."""
+    text = str(text).strip()
+    multiplier = {"K": base, "M": base ** 2, "G": base ** 3, "T": base ** 4}.get(text[-1:].upper())
+    return int(float(text[:-1] if multiplier else text) * (multiplier or 1))
+
+
+def tcp_info(sock):
+    """(total retransmits, smoothed RTT in us, congestion window in bytes) from TCP_INFO, or None off Linux."""
+    if not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        data = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO.size)
+    except OSError:
+        return None
+    if len(data) < TCP_INFO.size:
+        return None
+    fields = TCP_INFO.unpack(data)
+    snd_mss, rtt, snd_cwnd, total_retrans = fields[8 + 2], fields[8 + 15], fields[8 + 18], fields[8 + 23]
+    return total_retrans, rtt, snd_cwnd * snd_mss
+
+
+def process_cpu():
+    times = os.times()
+    return times.user + times.system
+
+
+def set_window(sock, window):
+    if window:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, window)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, window)
+
+
+class TestParams:
+    """What an iperf3 client command line asks for, in the terms of the native engine."""
+    __slots__ = ('host', 'port', 'duration', 'streams', 'udp', 'bitrate', 'length', 'window', 'reverse', 'bidir',
+                 'zerocopy', 'interval')
+
+    def __init__(self, host=None, port=5201, duration=10, streams=1, udp=False, bitrate=None, length=None,
+                 window=None, reverse=False, bidir=False, zerocopy=False, interval=1.0):
+        self.host = host
+        self.port = port
+        self.duration = duration
+        self.streams = streams
+        self.udp = udp
+        # Per stream, like iperf3's -b; None is iperf3's default (1 Mbit/s for UDP, unlimited for TCP)
+        self.bitrate = bitrate if bitrate is not None else (UDP_RATE if udp else 0)
+        self.length = length or (UDP_LENGTH if udp else TCP_LENGTH)
+        self.window = window
+        self.reverse = reverse
+        self.bidir = bidir
+        self.zerocopy = zerocopy
+        self.interval = interval
+
+    @classmethod
+    def from_args(cls, args):
+        """Reads the iperf3 flags the engine understands; the rest (--json-stream, -A, ...) only shape iperf3's output."""
+        args = list(args)
+
+        def value(*names, default=None):
+            for name in names:
+                if name in args and args.index(name) + 1 < len(args):
+                    return args[args.index(name) + 1]
+            return default
+
+        udp = "-u" in args or "--udp" in args
+        bitrate = value("-b", "--bitrate", "--bandwidth")
+        length = value("-l", "--length")
+        window = value("-w", "--window")
+        return cls(
+            host=value("-c", "--client"),
+            port=int(value("-p", "--port", default=5201)),
+            duration=float(value("-t", "--time", default=10)),
+            streams=int(value("-P", "--parallel", default=1)),
+            udp=udp,
+            bitrate=parse_size(bitrate, 1000) if bitrate is not None else None,
+            length=parse_size(length) if length is not None else None,
+            window=parse_size(window) if window is not None else None,
+            reverse="-R" in args or "--reverse" in args,
+            bidir="--bidir" in args,
+            zerocopy="-Z" in args or "--zerocopy" in args,
+            interval=float(value("-i", "--interval", default=1.0)) or 1.0,
+        )
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def directions(self):
+        """For every stream, whether the client sends on it: forward streams first, then --bidir's reverse ones."""
+        if self.bidir:
+            return [True] * self.streams + [False] * self.streams
+        return [not self.reverse] * self.streams
+
+    def describe(self):
+        text = (f"{'UDP' if self.udp else 'TCP'} to {self.host}:{self.port}, {self.streams} stream(s), "
+                f"{self.duration:g}s, {'bidir' if self.bidir else 'reverse' if self.reverse else 'regular'}")
+        if self.bitrate:
+            text += f", {self.bitrate / 1e6:g} Mbits/sec per stream"
+        return text + (", sendfile" if self.zerocopy and not self.udp else "")
+
+
+class Stream:
+    """Counters of one data connection; interval figures are the differences between two snapshots."""
+    __slots__ = ('index', 'sock', 'socket_id', 'sending', 'udp', 'bytes', 'packets', 'max_seq', 'jitter',
+                 'transit', 'retransmits', 'rtt', 'cwnd', '_last')
+
+    def __init__(self, index, sock, sending, udp):
+        self.index = index
+        self.sock = sock
+        self.socket_id = sock.fileno()
+        self.sending = sending
+        self.udp = udp
+        self.bytes = 0
+        self.packets = 0
+        self.max_seq = 0
+        # RFC 3550 interarrival jitter, in ns
+        self.jitter = 0.0
+        self.transit = None
+        self.retransmits = None
+        self.rtt = None
+        self.cwnd = None
+        self._last = (0, 0, 0, 0)
+
+    @property
+    def lost(self):
+        return max(self.max_seq - self.packets, 0) if self.udp and not self.sending else 0
+
+    def _refresh(self):
+        if self.sending and not self.udp:
+            info = tcp_info(self.sock)
+            if info is not None:
+                self.retransmits, self.rtt, self.cwnd = info
+
+    def interval(self, start, end):
+        self._refresh()
+        current = (self.bytes, self.packets, self.lost, self.retransmits or 0)
+        last, self._last = self._last, current
+        return self._record(start, end, *(now - before for now, before in zip(current, last)))
+
+    def total(self, start, end):
+        self._refresh()
+        return self._record(start, end, self.bytes, self.packets, self.lost, self.retransmits or 0)
+
+    def _record(self, start, end, count, packets, lost, retransmits):
+        seconds = end - start
+        data = {"socket": self.socket_id, "start": start, "end": end, "seconds": seconds, "bytes": count,
+                "bits_per_second": count * 8 / seconds if seconds > 0 else 0.0, "omitted": False,
+                "sender": self.sending}
+        if self.udp and self.sending:
+            data["packets"] = packets
+        elif self.udp:
+            # Like iperf3: packets counts what was sent, lost_packets the part of it that never arrived
+            data.update(packets=packets + lost, lost_packets=lost, jitter_ms=self.jitter / 1e6,
+                        lost_percent=100.0 * lost / (packets + lost) if packets + lost else 0.0)
+        elif self.sending and self.retransmits is not None:
+            data.update(retransmits=retransmits, rtt=self.rtt, snd_cwnd=self.cwnd)
+        return data
+
+
+def sum_records(records, start, end, sender):
+    """The 'sum' of per-stream records, in iperf3's format."""
+    seconds = end - start
+    total = sum(r["bytes"] for r in records)
+    data = {"start": start, "end": end, "seconds": seconds, "bytes": total,
+            "bits_per_second": total * 8 / seconds if seconds > 0 else 0.0, "omitted": False, "sender": sender}
+    retransmits = [r["retransmits"] for r in records if "retransmits" in r]
+    if retransmits:
+        data["retransmits"] = sum(retransmits)
+    if any("packets" in r for r in records):
+        data["packets"] = sum(r.get("packets", 0) for r in records)
+    jitters = [r["jitter_ms"] for r in records if "jitter_ms" in r]
+    if jitters:
+        lost = sum(r["lost_packets"] for r in records)
+        data.update(jitter_ms=sum(jitters) / len(jitters), lost_packets=lost,
+                    lost_percent=100.0 * lost / data["packets"] if data["packets"] else 0.0)
+    return data
+
+
+class Pacer:
+    """Holds a stream to `rate` bits/s (0: as fast as it goes) and regularly lets the rest of the event loop run."""
+    __slots__ = ('rate', 'every', 'started', 'calls')
+
+    def __init__(self, rate, every=1):
+        self.rate = rate
+        self.every = every
+        self.started = time.perf_counter()
+        self.calls = 0
+
+    async def wait(self, sent):
+        self.calls += 1
+        if self.rate:
+            delay = sent * 8 / self.rate - (time.perf_counter() - self.started)
+            # Sleeps shorter than the event loop's timer resolution would only spin
+            if delay > 0.0005:
+                await asyncio.sleep(delay)
+                return
+        if self.calls % self.every == 0:
+            # The fast paths of the sock_* calls complete without suspending, so nothing else would run
+            await asyncio.sleep(0)
+
+
+async def send_tcp(loop, stream, stop, params, source):
+    """Sends until `stop` is set, with sendfile() from `source` when it is a file, else from a memoryview."""
+    pacer = Pacer(params.bitrate)
+    zerocopy = not isinstance(source, memoryview)
+    count = max(params.length, SENDFILE_SIZE)
+    while not stop.is_set():
+        if zerocopy:
+            stream.bytes += await loop.sock_sendfile(stream.sock, source, 0, count)
+        else:
+            await loop.sock_sendall(stream.sock, source)
+            stream.bytes += len(source)
+        await pacer.wait(stream.bytes)
+
+
+async def receive_tcp(loop, stream, params):
+    view = memoryview(bytearray(max(params.length, TCP_LENGTH)))
+    while True:
+        count = await loop.sock_recv_into(stream.sock, view)
+        if not count:
+            return
+        stream.bytes += count
+        await asyncio.sleep(0)
+
+
+async def send_udp(loop, stream, stop, params):
+    buffer = bytearray(max(params.length, DATAGRAM.size))
+    view = memoryview(buffer)
+    pacer = Pacer(params.bitrate, every=32)
+    while not stop.is_set():
+        DATAGRAM.pack_into(buffer, 0, stream.packets + 1, time.time_ns())
+        try:
+            await loop.sock_sendall(stream.sock, view)
+            stream.bytes += len(view)
+            stream.packets += 1
+        except ConnectionError:
+            # An ICMP port unreachable for an earlier datagram, reported on this send
+            pass
+        await pacer.wait(stream.bytes)
+
+
+async def receive_udp(loop, stream, params):
+    view = memoryview(bytearray(65536))
+    while True:
+        try:
+            count = await loop.sock_recv_into(stream.sock, view)
+        except ConnectionError:
+            continue
+        if count < DATAGRAM.size:
+            continue
+        seq, sent_ns = DATAGRAM.unpack_from(view)
+        if seq == 0:
+            continue
+        # Only differences of the transit time matter, so the two clocks need not agree
+        transit = time.time_ns() - sent_ns
+        if stream.transit is not None:
+            stream.jitter += (abs(transit - stream.transit) - stream.jitter) / 16
+        stream.transit = transit
+        stream.bytes += count
+        stream.packets += 1
+        stream.max_seq = max(stream.max_seq, seq)
+        if stream.packets % 32 == 0:
+            await asyncio.sleep(0)
+
+
+def start_movers(loop, streams, stop, params):
+    """Starts a sender or receiver task per stream; returns (senders, receivers, sendfile source or None)."""
+    senders, receivers = [], []
+    source = None
+    if params.zerocopy and not params.udp and any(s.sending for s in streams):
+        source = tempfile.TemporaryFile()
+        source.write(os.urandom(max(params.length, SENDFILE_SIZE)))
+        source.flush()
+    payload = memoryview(os.urandom(params.length))
+    for stream in streams:
+        if stream.sending and params.udp:
+            senders.append(loop.create_task(send_udp(loop, stream, stop, params)))
+        elif stream.sending:
+            senders.append(loop.create_task(send_tcp(loop, stream, stop, params, source or payload)))
+        elif params.udp:
+            receivers.append(loop.create_task(receive_udp(loop, stream, params)))
+        else:
+            receivers.append(loop.create_task(receive_tcp(loop, stream, params)))
+    return senders, receivers, source
+
+
+async def stop_senders(streams, senders, udp):
+    """After `stop` was set: lets the senders finish their last write and shuts their TCP streams."""
+    if senders:
+        await asyncio.wait(senders, timeout=2.0)
+    for task in senders:
+        task.cancel()
+    await asyncio.gather(*senders, return_exceptions=True)
+    for stream in streams:
+        if stream.sending and not udp:
+            try:
+                stream.sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+
+async def drain_receivers(receivers, udp, timeout=SETUP_TIMEOUT):
+    """Waits for the other end's TCP streams to close, or for UDP datagrams still in flight."""
+    if receivers:
+        await asyncio.wait(receivers, timeout=UDP_GRACE if udp else timeout)
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+
+async def send_json(writer, message):
+    writer.write((json.dumps(message) + "\n").encode("utf-8"))
+    await writer.drain()
+
+
+async def read_json(reader, timeout):
+    """The next message, or None when the other end closed the connection."""
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    return json.loads(line) if line.strip() else None
+
+
+async def read_exact(loop, sock, size, timeout):
+    data = b""
+    while len(data) < size:
+        chunk = await asyncio.wait_for(loop.sock_recv(sock, size - len(data)), timeout)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class NativeClient:
+    """
+    Runs one test against a NativeServer. on_event receives what iperf3 --json-stream
+    would print - ('start', data), ('interval', data) per interval and ('end', data) -
+    so ResultParser builds the same TestResult from it.
+    """
+
+    def __init__(self, params, timeout=SETUP_TIMEOUT):
+        self.params = params
+        self.timeout = timeout
+
+    def run(self, on_event, should_stop=None):
+        """Blocks for the test; returns True when should_stop() ended it early. Raises NativeError or OSError."""
+        return asyncio.run(self._run(on_event, should_stop))
+
+    async def _run(self, on_event, should_stop):
+        loop = asyncio.get_running_loop()
+        params = self.params
+        cookie = secrets.token_bytes(8)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(params.host, params.port), self.timeout)
+        control = writer.get_extra_info("socket")
+        address = writer.get_extra_info("peername")
+        streams, senders, receivers, source, udp_sockets = [], [], [], None, []
+        stop = asyncio.Event()
+        try:
+            writer.write(HELLO.pack(MAGIC, CONTROL, 0, cookie))
+            for _ in params.directions() if params.udp else []:
+                sock = socket.socket(control.family, socket.SOCK_DGRAM)
+                udp_sockets.append(sock)
+                sock.bind(("", 0))
+            await send_json(writer, {"op": "test", "params": params.to_dict(),
+                                     "udp_ports": [s.getsockname()[1] for s in udp_sockets]})
+            # A real iperf3 server answers the hello with its one-byte state instead
+            first = await asyncio.wait_for(reader.read(1), self.timeout)
+            if first != b"{":
+                raise NativeError(f"{params.host}:{params.port} is not a native engine server"
+                                  + (" (an iperf3 server?)" if first else ""))
+            reply = json.loads(first + await asyncio.wait_for(reader.readline(), self.timeout))
+            if reply.get("error"):
+                raise NativeError(reply["error"])
+
+            for index, sending in enumerate(params.directions()):
+                if params.udp:
+                    sock = udp_sockets[index]
+                    set_window(sock, params.window)
+                    sock.setblocking(False)
+                    sock.connect((address[0], reply["udp_ports"][index]))
+                    try:
+                        # Lets the server's datagrams through stateful firewalls on this side
+                        sock.send(DATAGRAM.pack(0, 0))
+                    except OSError:
+                        pass
+                else:
+                    sock = socket.socket(control.family, socket.SOCK_STREAM)
+                    set_window(sock, params.window)
+                    sock.setblocking(False)
+                    streams.append(Stream(index, sock, sending, False))
+                    await asyncio.wait_for(loop.sock_connect(sock, address), self.timeout)
+                    await loop.sock_sendall(sock, HELLO.pack(MAGIC, STREAM, index, cookie))
+                    continue
+                streams.append(Stream(index, sock, sending, True))
+            ready = await read_json(reader, self.timeout)
+            if not ready or ready.get("event") != "ready":
+                raise NativeError((ready or {}).get("error") or "the server did not start the test")
+
+            on_event("start", {
+                "version": f"native {NATIVE_VERSION}",
+                "timestamp": {"timesecs": int(time.time())},
+                "connecting_to": {"host": params.host, "port": params.port},
+                "test_start": {"protocol": "UDP" if params.udp else "TCP", "num_streams": params.streams,
+                               "blksize": params.length, "duration": params.duration,
+                               "reverse": int(params.reverse), "bidir": int(params.bidir)},
+            })
+            cpu = process_cpu()
+            started = loop.time()
+            senders, receivers, source = start_movers(loop, streams, stop, params)
+            elapsed, stopped = await self._report(loop, streams, senders + receivers, on_event, should_stop, started)
+            stop.set()
+            await stop_senders(streams, senders, params.udp)
+            await send_json(writer, {"op": "done"})
+            results = await read_json(reader, self.timeout)
+            if not results or results.get("event") != "results":
+                raise NativeError("the server did not report its side of the test")
+            # The server shut its sending streams before answering, so they are about drained
+            await drain_receivers(receivers, params.udp, self.timeout)
+            cpu_percent = 100.0 * (process_cpu() - cpu) / elapsed if elapsed > 0 else 0.0
+            on_event("end", self._end(streams, results, elapsed, cpu_percent))
+            return stopped
+        finally:
+            stop.set()
+            for task in senders + receivers:
+                task.cancel()
+            for sock in [stream.sock for stream in streams] + udp_sockets:
+                sock.close()
+            if source is not None:
+                source.close()
+            writer.close()
+
+    async def _report(self, loop, streams, tasks, on_event, should_stop, started):
+        params = self.params
+        forward = not params.reverse
+        last = 0.0
+        while True:
+            target = min(last + params.interval, params.duration)
+            done, _ = await asyncio.wait(tasks, timeout=max(target - (loop.time() - started), 0))
+            if done:
+                task = next(iter(done))
+                error = task.exception() if not task.cancelled() else None
+                raise NativeError(f"a data stream ended during the test: {error or 'closed by the server'}")
+            now = loop.time() - started
+            records = [stream.interval(last, now) for stream in streams]
+            interval = {"streams": records,
+                        "sum": sum_records([r for r in records if r["sender"] == forward], last, now, forward)}
+            if params.bidir:
+                interval["sum_bidir_reverse"] = sum_records([r for r in records if not r["sender"]], last, now, False)
+            on_event("interval", interval)
+            last = now
+            if now >= params.duration - 0.001:
+                return now, False
+            if should_stop is not None and should_stop():
+                return now, True
+
+    def _end(self, streams, results, elapsed, cpu_percent):
+        params = self.params
+        remote = {r["stream"]: r for r in results.get("streams", [])}
+        sent, received = {True: [], False: []}, {True: [], False: []}
+        for stream in streams:
+            local = stream.total(0.0, elapsed)
+            other = remote.get(stream.index)
+            # Keyed by direction: True for what the client sent
+            (sent if stream.sending else received)[stream.sending].append(local)
+            if other is not None:
+                (received if stream.sending else sent)[stream.sending].append(other)
+        forward = not params.reverse
+        end = {
+            "sum_sent": sum_records(sent[forward], 0.0, elapsed, True),
+            "sum_received": sum_records(received[forward], 0.0, elapsed, False),
+            "cpu_utilization_percent": {"host_total": cpu_percent, "remote_total": results.get("cpu_percent")},
+        }
+        if params.bidir:
+            end["sum_sent_bidir_reverse"] = sum_records(sent[False], 0.0, elapsed, True)
+            end["sum_received_bidir_reverse"] = sum_records(received[False], 0.0, elapsed, False)
+        if params.udp:
+            end["sum"] = end["sum_received"]
+        return end
+
+
+class ServerTest:
+    __slots__ = ('cookie', 'params', 'streams', 'connected')
+
+    def __init__(self, cookie, params):
+        self.cookie = cookie
+        self.params = params
+        self.streams = [None] * len(params.directions())
+        self.connected = asyncio.Event()
+
+    def attach(self, index, sock):
+        if not 0 <= index < len(self.streams) or self.streams[index] is not None:
+            return False
+        set_window(sock, self.params.window)
+        self.streams[index] = Stream(index, sock, not self.params.directions()[index], False)
+        if all(self.streams):
+            self.connected.set()
+        return True
+
+
+class NativeServer:
+    """
+    The server side of the native engine on TCP `port`, one test at a time like iperf3 -s.
+    UDP tests use a socket per stream on a port chosen per test. Connections that open
+    with an iperf3 cookie get iperf3's state byte, so discovery probes find this server.
+    on_start(client) and on_end(summary) are called from the server's thread.
+    """
+
+    def __init__(self, port, bind="", log=print, on_start=None, on_end=None, cores=None):
+        self.port = port
+        self.bind = bind
+        self.log = log
+        self.on_start = on_start
+        self.on_end = on_end
+        self.cores = cores
+        self.test = None
+        self.tests_completed = 0
+        self._loop = None
+        self._stop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Listens in a thread of its own; raises OSError when the port cannot be bound."""
+        self._ready.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=f"native-server:{self.port}", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def _run(self):
+        if self.cores and hasattr(os, "sched_setaffinity"):
+            # Pins just this thread: on Linux pid 0 is the calling thread
+            try:
+                os.sched_setaffinity(0, self.cores)
+            except OSError as e:
+                self.log(f"Could not pin the native server on port {self.port} to CPUs {self.cores}: {e}")
+        try:
+            asyncio.run(self._serve())
+        except OSError as e:
+            self._error = e
+        finally:
+            self._ready.set()
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._stop = asyncio.Event()
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.bind, self.port))
+            listener.listen(64)
+            listener.setblocking(False)
+            self._ready.set()
+            accept = loop.create_task(self._accept_loop(loop, listener))
+            await self._stop.wait()
+            accept.cancel()
+        finally:
+            listener.close()
+
+    async def _accept_loop(self, loop, listener):
+        while True:
+            conn, address = await loop.sock_accept(listener)
+            conn.setblocking(False)
+            loop.create_task(self._handle(loop, conn, address))
+
+    async def _handle(self, loop, conn, address):
+        keep = False
+        try:
+            hello = await read_exact(loop, conn, HELLO.size, SETUP_TIMEOUT)
+            if len(hello) < HELLO.size or hello[:4] != MAGIC:
+                rest = await read_exact(loop, conn, IPERF_COOKIE_SIZE - len(hello), 1.0) if len(hello) else b""
+                if len(hello) + len(rest) == IPERF_COOKIE_SIZE:
+                    state = IPERF_ACCESS_DENIED if self.test is not None else IPERF_PARAM_EXCHANGE
+                    await loop.sock_sendall(conn, bytes([state]))
+                return
+            _, kind, index, cookie = HELLO.unpack(hello)
+            if kind == STREAM:
+                test = self.test
+                keep = test is not None and test.cookie == cookie and test.attach(index, conn)
+                return
+            keep = True
+            await self._run_test(loop, conn, address[0], cookie)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            pass
+        finally:
+            if not keep:
+                conn.close()
+
+    async def _run_test(self, loop, conn, client, cookie):
+        reader, writer = await asyncio.open_connection(sock=conn)
+        try:
+            request = await read_json(reader, SETUP_TIMEOUT)
+            if not request or request.get("op") != "test":
+                return
+            if self.test is not None:
+                await send_json(writer, {"error": BUSY})
+                return
+            test = self.test = ServerTest(cookie, TestParams.from_dict(request["params"]))
+            try:
+                await self._serve_test(loop, test, reader, writer, client, request.get("udp_ports") or [])
+            finally:
+                self.test = None
+        finally:
+            writer.close()
+
+    async def _serve_test(self, loop, test, reader, writer, client, udp_ports):
+        params = test.params
+        directions = params.directions()
+        reply = {"ok": True, "version": NATIVE_VERSION}
+        stop = asyncio.Event()
+        senders, receivers, source = [], [], None
+        summary = {"client": client, "seconds": 0.0, "bytes": 0, "bits_per_second": 0.0, "error": None}
+        started_test = False
+        try:
+            if params.udp:
+                if len(udp_ports) != len(directions):
+                    raise NativeError("UDP test without the client's ports")
+                for index, port in enumerate(udp_ports):
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    test.streams[index] = Stream(index, sock, not directions[index], True)
+                    sock.bind((self.bind, 0))
+                    set_window(sock, params.window)
+                    sock.setblocking(False)
+                    sock.connect((client, port))
+                reply["udp_ports"] = [s.sock.getsockname()[1] for s in test.streams]
+            await send_json(writer, reply)
+            if not params.udp:
+                await asyncio.wait_for(test.connected.wait(), SETUP_TIMEOUT)
+            await send_json(writer, {"event": "ready"})
+            started_test = True
+            if self.on_start is not None:
+                self.on_start(client)
+            cpu = process_cpu()
+            started = loop.time()
+            senders, receivers, source = start_movers(loop, test.streams, stop, params)
+            # The client says when the test is over; one that disappears ends it too
+            try:
+                done = await read_json(reader, params.duration + 3 * SETUP_TIMEOUT)
+            except (asyncio.TimeoutError, ValueError):
+                done = None
+            elapsed = loop.time() - started
+            stop.set()
+            await stop_senders(test.streams, senders, params.udp)
+            await drain_receivers(receivers, params.udp)
+            moved = sum(s.bytes for s in test.streams)
+            summary.update(seconds=elapsed, bytes=moved, bits_per_second=moved * 8 / elapsed if elapsed > 0 else 0.0)
+            if done is None:
+                summary["error"] = "the client went away during the test"
+                return
+            await send_json(writer, {
+                "event": "results",
+                "streams": [dict(s.total(0.0, elapsed), stream=s.index) for s in test.streams],
+                "cpu_percent": 100.0 * (process_cpu() - cpu) / elapsed if elapsed > 0 else 0.0,
+            })
+        except (NativeError, OSError, asyncio.TimeoutError) as e:
+            summary["error"] = str(e) or type(e).__name__
+            if not started_test:
+                try:
+                    await send_json(writer, {"error": summary["error"]})
+                except OSError:
+                    pass
+        finally:
+            stop.set()
+            for task in senders + receivers:
+                task.cancel()
+            for stream in test.streams:
+                if stream is not None:
+                    stream.sock.close()
+            if source is not None:
+                source.close()
+            if started_test:
+                self.tests_completed += 1
+                if self.on_end is not None:
+                    self.on_end(summary)
+
+    def close(self):
+        if self._loop is not None and self._stop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                pass
+        if self._thread is not None:
+            self._thread.join(5)
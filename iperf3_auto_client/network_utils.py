@@ -1,5 +1,12 @@
 import socket
+import random
+import string
 import configparser
+from tracing import traced
+
+IPERF_COOKIE_SIZE = 37
+IPERF_PARAM_EXCHANGE = 9
+IPERF_ACCESS_DENIED = 0xFF
 
 def get_default_interface_ip():
     """
@@ -16,7 +23,12 @@ def get_default_interface_ip():
         print(f"Error getting default interface IP: {str(e)}")
         return None
 
-def listen_for_server(port=5201, timeout=10):
+@traced("listen_for_server")
+def listen_for_server(port=5201, timeout=10, all_ports=False):
+    """
+    Waits for a server advertisement. Returns (ip, port), or (ip, [ports]) with every idle
+    port of a pooled server when all_ports is set.
+    """
     multicast_group = "224.0.0.1"
     local_ip = get_default_interface_ip()
     
@@ -38,8 +50,32 @@ def listen_for_server(port=5201, timeout=10):
             data, address = sock.recvfrom(1024)
             print(f"Received message from {address}: {data.decode()}")
             if data.startswith(b"iperf3_server:"):
-                _, ip, server_port = data.decode().split(":")
-                return ip, int(server_port)
+                fields = data.decode().split(":")
+                ip, server_port = fields[1], int(fields[2])
+                if len(fields) > 3:
+                    # Pooled server: pick one of the idle instances so clients spread out
+                    free_ports = [int(p) for p in fields[3].split(",") if p]
+                    if not free_ports:
+                        continue
+                    if all_ports:
+                        return ip, free_ports
+                    server_port = random.choice(free_ports)
+                return ip, [server_port] if all_ports else server_port
     except socket.timeout:
         print("Timeout while listening for server")
-        return None, None
\ No newline at end of file
+        return None, None
+
+def probe_iperf_server(ip, port=5201, timeout=0.3):
+    """
+    Returns True if an iperf3 server answers the control handshake on ip:port: it replies
+    to the cookie with PARAM_EXCHANGE when idle or ACCESS_DENIED when busy. An idle server
+    takes it for a client whose session then fails, so use it only after discovery.
+    """
+    cookie = "".join(random.choice(string.ascii_lowercase + "234567") for _ in range(IPERF_COOKIE_SIZE - 1))
+    try:
+        with socket.create_connection((ip, port), timeout=timeout) as sock:
+            sock.sendall(cookie.encode("ascii") + b"\0")
+            state = sock.recv(1)
+            return len(state) == 1 and state[0] in (IPERF_PARAM_EXCHANGE, IPERF_ACCESS_DENIED)
+    except OSError:
+        return False
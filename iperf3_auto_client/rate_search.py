@@ -0,0 +1,102 @@
+RATE_UNITS = {'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+
+
+def parse_rate(text):
+    """'500M' -> 500e6 bits/s, the same suffixes iperf3 -b accepts."""
+    text = str(text).strip()
+    if text[-1:].upper() in RATE_UNITS:
+        return float(text[:-1]) * RATE_UNITS[text[-1].upper()]
+    return float(text)
+
+
+class RateStep:
+    __slots__ = ('rate', 'passed', 'bits_per_second', 'lost_percent', 'jitter_ms', 'error')
+
+    def __init__(self, rate, passed, bits_per_second=0.0, lost_percent=None, jitter_ms=None, error=None):
+        self.rate = rate
+        self.passed = passed
+        self.bits_per_second = bits_per_second
+        self.lost_percent = lost_percent
+        self.jitter_ms = jitter_ms
+        self.error = error
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def describe(self):
+        if self.error:
+            return f"{self.rate / 1e6:.2f} Mbits/sec: failed ({self.error})"
+        return (f"{self.rate / 1e6:.2f} Mbits/sec: {'pass' if self.passed else 'fail'}, received "
+                f"{self.bits_per_second / 1e6:.2f} Mbits/sec, loss {self.lost_percent or 0:.3f}%, "
+                f"jitter {self.jitter_ms or 0:.3f} ms")
+
+
+class UdpRateSearch:
+    """
+    RFC 2544-style search for the highest UDP rate (iperf3 -u -b) whose loss and jitter
+    stay within budget. Each step is a short JSON trial; the offered rate is halved
+    between the highest rate that passed and the lowest that failed until the two are
+    within `precision` (relative) of each other or `max_trials` is reached.
+    """
+
+    def __init__(self, client, server_ip, port=None, reverse=False, min_rate=1e6, max_rate=1e9,
+                 max_loss=0.0, max_jitter=None, precision=0.01, trial_duration=5, max_trials=10):
+        self.client = client
+        self.server_ip = server_ip
+        self.port = port
+        self.reverse = reverse
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_loss = max_loss
+        self.max_jitter = max_jitter
+        self.precision = precision
+        self.trial_duration = trial_duration
+        self.max_trials = max_trials
+        self.steps = []
+        self.rate = None
+
+    def trial(self, rate):
+        result = self.client.run_json_test(
+            self.server_ip, reverse=self.reverse, duration=self.trial_duration, port=self.port,
+            extra_args=["-u", "-b", f"{rate:.0f}"], trial=True
+        )
+        summary = result.received or result.sent
+        if not result or summary is None:
+            step = RateStep(rate, False, error=result.error or "no summary")
+        else:
+            lost_percent = summary.lost_percent or 0.0
+            jitter_ms = summary.jitter_ms or 0.0
+            passed = lost_percent <= self.max_loss and (self.max_jitter is None or jitter_ms <= self.max_jitter)
+            step = RateStep(rate, passed, result.bits_per_second, lost_percent, jitter_ms)
+        self.steps.append(step)
+        self.client.log(f"UDP step {len(self.steps)}: {step.describe()}")
+        return step.passed
+
+    def run(self):
+        """Returns the highest passing rate in bits/s, or None if even min_rate fails."""
+        low, high = self.min_rate, self.max_rate
+        if self.trial(high):
+            self.rate = high
+        elif not self.trial(low):
+            self.rate = None
+        else:
+            while len(self.steps) < self.max_trials and (high - low) > self.precision * high:
+                middle = (low + high) / 2
+                if self.trial(middle):
+                    low = middle
+                else:
+                    high = middle
+            self.rate = low
+        budget = f"loss <= {self.max_loss}%" + (f", jitter <= {self.max_jitter} ms" if self.max_jitter is not None else "")
+        if self.rate is None:
+            self.client.log(f"No UDP rate to {self.server_ip} stays within {budget}, "
+                            f"even {self.min_rate / 1e6:.2f} Mbits/sec")
+        else:
+            self.client.log(f"Max UDP rate to {self.server_ip} within {budget}: {self.rate / 1e6:.2f} Mbits/sec "
+                            f"after {len(self.steps)} trials")
+        return self.rate
+
+    def to_dict(self):
+        return {'server': self.server_ip, 'reverse': self.reverse, 'rate': self.rate,
+                'max_loss': self.max_loss, 'max_jitter': self.max_jitter,
+                'steps': [step.to_dict() for step in self.steps]}
@@ -0,0 +1,347 @@
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from results import split_bidir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    server TEXT NOT NULL,
+    port INTEGER,
+    client TEXT,
+    direction TEXT NOT NULL,
+    protocol TEXT,
+    num_streams INTEGER,
+    duration REAL,
+    version TEXT,
+    bits_per_second REAL,
+    bytes INTEGER,
+    retransmits INTEGER,
+    jitter_ms REAL,
+    lost_percent REAL,
+    cpu_local REAL,
+    cpu_remote REAL,
+    error TEXT,
+    bound TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS runs_server ON runs (server, timestamp);
+CREATE INDEX IF NOT EXISTS runs_client ON runs (client, timestamp);
+CREATE INDEX IF NOT EXISTS runs_direction ON runs (direction, timestamp);
+CREATE TABLE IF NOT EXISTS intervals (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    start REAL NOT NULL,
+    end REAL,
+    bits_per_second REAL,
+    bytes INTEGER,
+    retransmits INTEGER,
+    rtt_ms REAL,
+    jitter_ms REAL,
+    lost_percent REAL,
+    PRIMARY KEY (run_id, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    size INTEGER,
+    head TEXT,
+    runs INTEGER NOT NULL DEFAULT 0,
+    imported REAL
+);
+"""
+
+FILTERS = ('server', 'client', 'direction', 'protocol')
+GROUP_COLUMNS = ('server', 'client', 'direction', 'protocol', 'port')
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_time(value, now=None):
+    """Accepts epoch seconds, an ISO date/time or an age such as '7d' or '12h'."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = value.strip()
+    if value[-1:] in DURATION_UNITS:
+        try:
+            return (now or time.time()) - float(value[:-1]) * DURATION_UNITS[value[-1]]
+        except ValueError:
+            pass
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def parse_bucket(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if value[-1:] in DURATION_UNITS:
+        return float(value[:-1]) * DURATION_UNITS[value[-1]]
+    return float(value)
+
+
+class ResultStore:
+    """
+    SQLite store for every test, direction and interval, indexed by server, client,
+    direction and time. Queries aggregate in SQL and iterate over cursors, so callers
+    never load whole runs into memory. Safe to share between the client's test threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # WAL lets dashboards read while a test is being written
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(runs)")}
+        if "bound" not in columns:
+            # Stores created before host sampling existed
+            self.db.execute("ALTER TABLE runs ADD COLUMN bound TEXT")
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def record(self, result, client=None):
+        """Stores a TestResult (both directions of a --bidir run); returns the new run ids."""
+        results = split_bidir(result) if result.bidir else (result,)
+        with self._lock, self.db:
+            return [self._insert(r, client) for r in results]
+
+    def import_state(self, path):
+        """Where the last import of log file `path` stopped (see log_import.py), or None."""
+        row = self.db.execute("SELECT * FROM imports WHERE path = ?", (path,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def record_import(self, path, items, offset, size, head):
+        """
+        Stores the (TestResult, client) pairs read from a log together with the offset to
+        resume from, in one transaction, so an interrupted import is neither lost nor doubled.
+        """
+        with self._lock, self.db:
+            for result, client in items:
+                self._insert(result, client)
+            self.db.execute(
+                "INSERT INTO imports (path, offset, size, head, runs, imported) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET offset = excluded.offset, size = excluded.size, "
+                "head = excluded.head, runs = runs + excluded.runs, imported = excluded.imported",
+                (path, offset, size, head, len(items), time.time())
+            )
+
+    def _insert(self, result, client):
+        summary = result.received or result.sent
+        cpu = result.cpu_utilization or {}
+        cursor = self.db.execute(
+            "INSERT INTO runs (timestamp, server, port, client, direction, protocol, num_streams, duration, "
+            "version, bits_per_second, bytes, retransmits, jitter_ms, lost_percent, cpu_local, cpu_remote, error, "
+            "bound) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                result.timestamp or time.time(), result.server or '', result.port, client,
+                'reverse' if result.reverse else 'regular', result.protocol, result.num_streams,
+                result.duration, result.version, result.bits_per_second,
+                summary.bytes if summary is not None else None, result.retransmits,
+                summary.jitter_ms if summary is not None else None,
+                summary.lost_percent if summary is not None else None,
+                cpu.get('host_total'), cpu.get('remote_total'), result.error, result.bound,
+            )
+        )
+        run_id = cursor.lastrowid
+        self.db.executemany(
+            "INSERT OR REPLACE INTO intervals (run_id, start, end, bits_per_second, bytes, retransmits, rtt_ms, "
+            "jitter_ms, lost_percent) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (run_id, report.start, report.end, report.bits_per_second, report.sum.bytes,
+                 report.sum.retransmits, _mean_rtt(report), report.sum.jitter_ms, report.sum.lost_percent)
+                for report in result.intervals if not report.sum.omitted
+            )
+        )
+        return run_id
+
+    def _where(self, filters, prefix=''):
+        clauses, params = [], []
+        for name in FILTERS:
+            value = filters.get(name)
+            if value is not None:
+                clauses.append(f"{prefix}{name} = ?")
+                params.append(value)
+        since = parse_time(filters.get('since'))
+        until = parse_time(filters.get('until'))
+        if since is not None:
+            clauses.append(f"{prefix}timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{prefix}timestamp < ?")
+            params.append(until)
+        if filters.get('successful'):
+            clauses.append(f"{prefix}error IS NULL")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def runs(self, limit=None, newest_first=True, **filters):
+        """Yields matching runs as dicts; filters: server, client, direction, protocol, since, until, successful."""
+        where, params = self._where(filters)
+        sql = f"SELECT * FROM runs{where} ORDER BY timestamp {'DESC' if newest_first else 'ASC'}"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for row in self.db.execute(sql, params):
+            yield dict(row)
+
+    def intervals(self, run_id):
+        for row in self.db.execute("SELECT * FROM intervals WHERE run_id = ? ORDER BY start", (run_id,)):
+            yield dict(row)
+
+    def interval_rows(self, **filters):
+        """
+        Cursor over (run_id, start, bits_per_second, seconds, retransmits, rtt_ms, jitter_ms,
+        lost_percent) for every interval of the matching runs, for bulk loading into arrays.
+        """
+        where, params = self._where(filters, prefix='r.')
+        return self.db.execute(
+            "SELECT i.run_id, i.start, i.bits_per_second, i.end - i.start, i.retransmits, i.rtt_ms, i.jitter_ms, "
+            f"i.lost_percent FROM intervals i JOIN runs r ON r.id = i.run_id{where} ORDER BY i.run_id, i.start",
+            params
+        )
+
+    def summary(self, group_by=('server', 'direction'), bucket=None, **filters):
+        """
+        Per-group aggregates of whole runs: run count, failures and mean/min/max throughput.
+        `bucket` (seconds, or e.g. '1d') adds a time column so results form a time series.
+        """
+        columns = [c for c in group_by if c in GROUP_COLUMNS]
+        keys = list(columns)
+        params = []
+        bucket = parse_bucket(bucket)
+        if bucket:
+            keys.append("CAST(timestamp / ? AS INTEGER) * ? AS period")
+            params.extend([bucket, bucket])
+        where, where_params = self._where(filters)
+        select = ", ".join(keys + [
+            "COUNT(*) AS runs",
+            "SUM(error IS NOT NULL) AS failures",
+            "AVG(CASE WHEN error IS NULL THEN bits_per_second END) AS mean_bps",
+            "MIN(CASE WHEN error IS NULL THEN bits_per_second END) AS min_bps",
+            "MAX(CASE WHEN error IS NULL THEN bits_per_second END) AS max_bps",
+            "SUM(retransmits) AS retransmits",
+            "AVG(lost_percent) AS mean_lost_percent",
+            "MIN(timestamp) AS first",
+            "MAX(timestamp) AS last",
+        ])
+        group = columns + (["period"] if bucket else [])
+        sql = f"SELECT {select} FROM runs{where}"
+        if group:
+            sql += f" GROUP BY {', '.join(group)} ORDER BY {', '.join(group)}"
+        for row in self.db.execute(sql, params + where_params):
+            yield dict(row)
+
+    def interval_summary(self, group_by=('server', 'direction'), **filters):
+        """Aggregates over individual intervals of the matching runs, computed inside SQLite."""
+        columns = [f"r.{c}" for c in group_by if c in GROUP_COLUMNS]
+        where, params = self._where(filters, prefix='r.')
+        select = ", ".join(columns + [
+            "COUNT(*) AS intervals",
+            "AVG(i.bits_per_second) AS mean_bps",
+            "MIN(i.bits_per_second) AS min_bps",
+            "MAX(i.bits_per_second) AS max_bps",
+            "SUM(i.retransmits) AS retransmits",
+            "AVG(i.rtt_ms) AS mean_rtt_ms",
+            "AVG(i.jitter_ms) AS mean_jitter_ms",
+        ])
+        sql = f"SELECT {select} FROM intervals i JOIN runs r ON r.id = i.run_id{where}"
+        if columns:
+            sql += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+        for row in self.db.execute(sql, params):
+            yield {key.split('.')[-1]: row[key] for key in row.keys()}
+
+    def prune(self, before):
+        """Deletes runs (and their intervals) older than `before`; returns how many went."""
+        with self._lock, self.db:
+            return self.db.execute("DELETE FROM runs WHERE timestamp < ?", (parse_time(before),)).rowcount
+
+
+def _mean_rtt(report):
+    rtts = [s.rtt for s in report.streams if s.rtt is not None]
+    return sum(rtts) / len(rtts) if rtts else None
+
+
+def _format(value, key):
+    if value is None:
+        return "-"
+    if key in ('timestamp', 'first', 'last', 'period'):
+        return datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+    if key.endswith('bps') or key == 'bits_per_second':
+        return f"{value / 1e6:.2f}M"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def print_rows(rows, as_json=False, out=sys.stdout):
+    header = None
+    for row in rows:
+        if as_json:
+            out.write(json.dumps(row) + "\n")
+            continue
+        if header is None:
+            header = list(row)
+            out.write("\t".join(header) + "\n")
+        out.write("\t".join(_format(row[key], key) for key in header) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query stored iperf3 results")
+    parser.add_argument('--db', default='./iperf3_results.db', help="result store path")
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--json', action='store_true', help="print one JSON object per line")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_filters(command):
+        command.add_argument('--server')
+        command.add_argument('--client')
+        command.add_argument('--direction', choices=('regular', 'reverse'))
+        command.add_argument('--protocol', choices=('TCP', 'UDP'))
+        command.add_argument('--since', help="epoch, ISO time or age such as 7d / 12h")
+        command.add_argument('--until')
+        command.add_argument('--successful', action='store_true', help="skip failed runs")
+
+    runs = commands.add_parser('runs', parents=[output], help="list runs, newest first")
+    add_filters(runs)
+    runs.add_argument('--limit', type=int, default=50)
+    summary = commands.add_parser('summary', parents=[output], help="aggregate runs per group")
+    add_filters(summary)
+    summary.add_argument('--group-by', default='server,direction')
+    summary.add_argument('--bucket', help="time bucket such as 1h or 1d")
+    summary.add_argument('--intervals', action='store_true', help="aggregate individual intervals instead")
+    intervals = commands.add_parser('intervals', parents=[output], help="print the intervals of one run")
+    intervals.add_argument('run_id', type=int)
+    prune = commands.add_parser('prune', help="delete runs older than a time or age")
+    prune.add_argument('before')
+
+    args = parser.parse_args(argv)
+    store = ResultStore(args.db)
+    filters = {name: getattr(args, name, None) for name in FILTERS + ('since', 'until', 'successful')}
+    try:
+        if args.command == 'runs':
+            print_rows(store.runs(limit=args.limit, **filters), args.json)
+        elif args.command == 'summary':
+            group_by = [c.strip() for c in args.group_by.split(',') if c.strip()]
+            if args.intervals:
+                print_rows(store.interval_summary(group_by, **filters), args.json)
+            else:
+                print_rows(store.summary(group_by, args.bucket, **filters), args.json)
+        elif args.command == 'intervals':
+            print_rows(store.intervals(args.run_id), args.json)
+        elif args.command == 'prune':
+            print(f"Deleted {store.prune(args.before)} runs")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
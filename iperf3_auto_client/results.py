@@ -0,0 +1,457 @@
+import json
+from host_stats import HostStats
+
+
+class StreamInterval:
+    """
+    Throughput figures for one stream (or the sum of all streams) over one reporting interval.
+    Fields that iperf3 does not report for the protocol in use stay None.
+    """
+    __slots__ = (
+        'socket', 'start', 'end', 'bytes', 'bits_per_second', 'retransmits',
+        'rtt', 'jitter_ms', 'lost_packets', 'packets', 'lost_percent',
+        'sender', 'omitted'
+    )
+
+    def __init__(self, socket=None, start=0.0, end=0.0, bytes=0, bits_per_second=0.0,
+                 retransmits=None, rtt=None, jitter_ms=None, lost_packets=None,
+                 packets=None, lost_percent=None, sender=True, omitted=False):
+        self.socket = socket
+        self.start = start
+        self.end = end
+        self.bytes = bytes
+        self.bits_per_second = bits_per_second
+        self.retransmits = retransmits
+        self.rtt = rtt
+        self.jitter_ms = jitter_ms
+        self.lost_packets = lost_packets
+        self.packets = packets
+        self.lost_percent = lost_percent
+        self.sender = sender
+        self.omitted = omitted
+
+    @property
+    def seconds(self):
+        return self.end - self.start
+
+    @classmethod
+    def from_json(cls, data):
+        # iperf3 reports RTT in microseconds, keep milliseconds like jitter
+        rtt = data.get('rtt', data.get('mean_rtt'))
+        return cls(
+            socket=data.get('socket'),
+            start=float(data.get('start', 0.0)),
+            end=float(data.get('end', 0.0)),
+            bytes=int(data.get('bytes', 0)),
+            bits_per_second=float(data.get('bits_per_second', 0.0)),
+            retransmits=data.get('retransmits'),
+            rtt=rtt / 1000.0 if rtt is not None else None,
+            jitter_ms=data.get('jitter_ms'),
+            lost_packets=data.get('lost_packets'),
+            packets=data.get('packets'),
+            lost_percent=data.get('lost_percent'),
+            sender=bool(data.get('sender', True)),
+            omitted=bool(data.get('omitted', False)),
+        )
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def __repr__(self):
+        return (f"StreamInterval(socket={self.socket}, {self.start:.2f}-{self.end:.2f}s, "
+                f"{self.bits_per_second / 1e6:.2f} Mbits/sec)")
+
+
+class IntervalReport:
+    """
+    One reporting interval: the per-stream figures plus their sum. For --bidir tests
+    sum_reverse holds the sum of the streams flowing in the other direction.
+    """
+    __slots__ = ('streams', 'sum', 'sum_reverse')
+
+    def __init__(self, streams, sum, sum_reverse=None):
+        self.streams = streams
+        self.sum = sum
+        self.sum_reverse = sum_reverse
+
+    @property
+    def start(self):
+        return self.sum.start
+
+    @property
+    def end(self):
+        return self.sum.end
+
+    @property
+    def bits_per_second(self):
+        return self.sum.bits_per_second
+
+    @classmethod
+    def from_json(cls, data):
+        streams = [StreamInterval.from_json(s) for s in data.get('streams', [])]
+        if 'sum' in data:
+            total = StreamInterval.from_json(data['sum'])
+        else:
+            total = sum_streams(streams)
+        reverse = data.get('sum_bidir_reverse')
+        return cls(streams, total, StreamInterval.from_json(reverse) if reverse else None)
+
+    def to_dict(self):
+        return {
+            'streams': [s.to_dict() for s in self.streams],
+            'sum': self.sum.to_dict(),
+            'sum_reverse': self.sum_reverse.to_dict() if self.sum_reverse else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        reverse = data.get('sum_reverse')
+        return cls(
+            [StreamInterval.from_dict(s) for s in data.get('streams', [])],
+            StreamInterval.from_dict(data['sum']),
+            StreamInterval.from_dict(reverse) if reverse else None,
+        )
+
+
+class TestResult:
+    """
+    Summary of one iperf3 run. Evaluates as False when the test failed so it can be
+    used wherever run_test's boolean result was expected.
+    """
+    __slots__ = (
+        'server', 'port', 'reverse', 'protocol', 'num_streams', 'duration', 'version',
+        'timestamp', 'intervals', 'sent', 'received', 'cpu_utilization', 'error',
+        'bidir', 'reverse_sent', 'reverse_received', 'host'
+    )
+    SUMMARY_FIELDS = ('sent', 'received', 'reverse_sent', 'reverse_received')
+
+    def __init__(self, server=None, port=None, reverse=False, protocol='TCP', num_streams=1,
+                 duration=None, version=None, timestamp=None, intervals=None, sent=None,
+                 received=None, cpu_utilization=None, error=None, bidir=False,
+                 reverse_sent=None, reverse_received=None, host=None):
+        self.server = server
+        self.port = port
+        self.reverse = reverse
+        self.protocol = protocol
+        self.num_streams = num_streams
+        self.duration = duration
+        self.version = version
+        self.timestamp = timestamp
+        self.intervals = intervals if intervals is not None else []
+        self.sent = sent
+        self.received = received
+        self.cpu_utilization = cpu_utilization
+        self.error = error
+        self.bidir = bidir
+        self.reverse_sent = reverse_sent
+        self.reverse_received = reverse_received
+        # HostStats sampled on this machine while the test ran, if sampling was on
+        self.host = host
+
+    @property
+    def success(self):
+        return self.error is None and (self.sent is not None or self.received is not None)
+
+    def __bool__(self):
+        return self.success
+
+    @property
+    def bits_per_second(self):
+        """Receiver-side throughput, falling back to the sender side or the interval mean."""
+        for summary in (self.received, self.sent):
+            if summary is not None and summary.bits_per_second:
+                return summary.bits_per_second
+        if self.intervals:
+            return sum(i.bits_per_second for i in self.intervals) / len(self.intervals)
+        return 0.0
+
+    @property
+    def retransmits(self):
+        return self.sent.retransmits if self.sent is not None else None
+
+    @property
+    def bound(self):
+        """'cpu' or 'nic' when the host sampler found this end of the test saturated."""
+        return self.host.bound if self.host is not None else None
+
+    def describe(self):
+        if not self.success:
+            return f"Test to {self.server}:{self.port} failed: {self.error}"
+        direction = 'reverse' if self.reverse else 'regular'
+        text = (f"{self.protocol} {direction} test to {self.server}:{self.port}: "
+                f"{self.bits_per_second / 1e6:.2f} Mbits/sec over {len(self.intervals)} intervals")
+        if self.retransmits is not None:
+            text += f", {self.retransmits} retransmits"
+        summary = self.received or self.sent
+        if summary is not None and summary.lost_percent is not None:
+            text += f", jitter {summary.jitter_ms:.3f} ms, loss {summary.lost_percent:.2f}%"
+        if self.bound:
+            text += f", {self.bound.upper()}-bound"
+        return text
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['intervals'] = [i.to_dict() for i in self.intervals]
+        for name in self.SUMMARY_FIELDS:
+            summary = getattr(self, name)
+            data[name] = summary.to_dict() if summary else None
+        data['host'] = self.host.to_dict() if self.host is not None else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        kwargs = {name: data[name] for name in cls.__slots__ if name in data}
+        kwargs['intervals'] = [IntervalReport.from_dict(i) for i in data.get('intervals', [])]
+        for name in cls.SUMMARY_FIELDS:
+            kwargs[name] = StreamInterval.from_dict(data[name]) if data.get(name) else None
+        kwargs['host'] = HostStats.from_dict(data['host']) if data.get('host') else None
+        return cls(**kwargs)
+
+
+def sum_streams(streams):
+    if not streams:
+        return StreamInterval()
+    total_bytes = sum(s.bytes for s in streams)
+    retransmits = [s.retransmits for s in streams if s.retransmits is not None]
+    return StreamInterval(
+        start=min(s.start for s in streams),
+        end=max(s.end for s in streams),
+        bytes=total_bytes,
+        bits_per_second=sum(s.bits_per_second for s in streams),
+        retransmits=sum(retransmits) if retransmits else None,
+        sender=streams[0].sender,
+        omitted=all(s.omitted for s in streams),
+    )
+
+
+def split_bidir(result):
+    """Splits a --bidir TestResult into separate (regular, reverse) results."""
+    regular = TestResult(
+        server=result.server, port=result.port, reverse=False, protocol=result.protocol,
+        num_streams=result.num_streams, duration=result.duration, version=result.version,
+        timestamp=result.timestamp, sent=result.sent, received=result.received,
+        cpu_utilization=result.cpu_utilization, error=result.error, host=result.host
+    )
+    reverse = TestResult(
+        server=result.server, port=result.port, reverse=True, protocol=result.protocol,
+        num_streams=result.num_streams, duration=result.duration, version=result.version,
+        timestamp=result.timestamp, sent=result.reverse_sent, received=result.reverse_received,
+        cpu_utilization=result.cpu_utilization, error=result.error, host=result.host
+    )
+    for report in result.intervals:
+        regular.intervals.append(IntervalReport([s for s in report.streams if s.sender], report.sum))
+        if report.sum_reverse is not None:
+            reverse.intervals.append(IntervalReport([s for s in report.streams if not s.sender], report.sum_reverse))
+    return regular, reverse
+
+
+class ResultParser:
+    """
+    Builds a TestResult from iperf3 JSON output. Feed it the events of --json-stream
+    one line at a time, or the whole --json document at once; on_interval is called
+    with every IntervalReport as soon as it is parsed.
+    """
+
+    def __init__(self, server=None, port=None, reverse=False, on_interval=None, keep_intervals=True):
+        self.result = TestResult(server=server, port=port, reverse=reverse)
+        self.on_interval = on_interval
+        # Long soak tests hand intervals to on_interval only, so memory stays flat
+        self.keep_intervals = keep_intervals
+
+    def feed_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return
+        self.feed_event(message.get('event'), message.get('data'))
+
+    def feed_event(self, event, data):
+        if event == 'start':
+            self._parse_start(data)
+        elif event == 'interval':
+            self._add_interval(data)
+        elif event == 'end':
+            self._parse_end(data)
+        elif event == 'error':
+            self.result.error = str(data)
+
+    def feed_document(self, document):
+        if isinstance(document, str):
+            document = json.loads(document)
+        self._parse_start(document.get('start', {}))
+        for interval in document.get('intervals', []):
+            self._add_interval(interval)
+        self._parse_end(document.get('end', {}))
+        if document.get('error'):
+            self.result.error = document['error']
+
+    def _parse_start(self, data):
+        result = self.result
+        test_start = data.get('test_start', {})
+        result.protocol = test_start.get('protocol', result.protocol)
+        result.num_streams = test_start.get('num_streams', result.num_streams)
+        result.duration = test_start.get('duration', result.duration)
+        result.reverse = bool(test_start.get('reverse', result.reverse))
+        result.bidir = bool(test_start.get('bidir', result.bidir))
+        result.version = data.get('version', result.version)
+        result.timestamp = data.get('timestamp', {}).get('timesecs', result.timestamp)
+        connecting_to = data.get('connecting_to', {})
+        result.server = connecting_to.get('host', result.server)
+        result.port = connecting_to.get('port', result.port)
+
+    def _add_interval(self, data):
+        self._add_report(IntervalReport.from_json(data))
+
+    def _add_report(self, report):
+        if self.keep_intervals:
+            self.result.intervals.append(report)
+        if self.on_interval is not None:
+            self.on_interval(report)
+
+    def _parse_end(self, data):
+        result = self.result
+        if 'sum_sent' in data:
+            result.sent = StreamInterval.from_json(data['sum_sent'])
+        if 'sum_received' in data:
+            result.received = StreamInterval.from_json(data['sum_received'])
+        if 'sum_sent_bidir_reverse' in data:
+            result.reverse_sent = StreamInterval.from_json(data['sum_sent_bidir_reverse'])
+        if 'sum_received_bidir_reverse' in data:
+            result.reverse_received = StreamInterval.from_json(data['sum_received_bidir_reverse'])
+        if 'sum' in data:
+            # UDP tests report loss and jitter in a single "sum" record
+            udp_sum = StreamInterval.from_json(data['sum'])
+            if result.received is None:
+                result.received = udp_sum
+            elif result.received.jitter_ms is None:
+                result.received.jitter_ms = udp_sum.jitter_ms
+                result.received.lost_packets = udp_sum.lost_packets
+                result.received.packets = udp_sum.packets
+                result.received.lost_percent = udp_sum.lost_percent
+        if 'cpu_utilization_percent' in data:
+            result.cpu_utilization = data['cpu_utilization_percent']
+
+    def finish(self, error=None):
+        result = self.result
+        if error and result.error is None:
+            result.error = error
+        if result.sent is None and result.received is None and result.intervals and result.error is None:
+            # iperf3 was stopped before it printed its summary, rebuild it from the intervals
+            result.sent = sum_streams([i.sum for i in result.intervals if not i.sum.omitted])
+            seconds = result.sent.seconds
+            result.sent.bits_per_second = result.sent.bytes * 8 / seconds if seconds > 0 else 0.0
+        return result
+
+
+BYTE_UNITS = {
+    'Bytes': 1, 'KBytes': 1024, 'MBytes': 1024 ** 2, 'GBytes': 1024 ** 3, 'TBytes': 1024 ** 4
+}
+BIT_UNITS = {
+    'bits/sec': 1, 'Kbits/sec': 1e3, 'Mbits/sec': 1e6, 'Gbits/sec': 1e9, 'Tbits/sec': 1e12
+}
+
+
+def parse_text_line(line, udp=False):
+    """
+    Parses one interval or summary line of iperf3's human readable output, e.g.
+    "[  5]   0.00-1.00   sec   112 MBytes   941 Mbits/sec    0   1.25 MBytes".
+    Returns (stream_id, StreamInterval, role) where stream_id is 'SUM' for sum lines and
+    role is 'sender', 'receiver' or None for interval lines; None if it is not such a line.
+    Uses plain string splitting so it stays cheap on multi-GB logs.
+    """
+    line = line.strip()
+    if not line.startswith('['):
+        return None
+    close = line.find(']')
+    if close < 0:
+        return None
+    stream_id = line[1:close].strip()
+    tokens = line[close + 1:].split()
+    if tokens and tokens[0].startswith('['):
+        # --bidir role tags such as [TX-C] / [RX-S]
+        tokens = tokens[1:]
+    if len(tokens) < 6 or tokens[1] != 'sec' or '-' not in tokens[0]:
+        return None
+    byte_unit = BYTE_UNITS.get(tokens[3])
+    bit_unit = BIT_UNITS.get(tokens[5])
+    if byte_unit is None or bit_unit is None:
+        return None
+    try:
+        start, end = tokens[0].split('-', 1)
+        interval = StreamInterval(
+            socket=None if stream_id == 'SUM' else int(stream_id) if stream_id.isdigit() else stream_id,
+            start=float(start),
+            end=float(end),
+            bytes=int(float(tokens[2]) * byte_unit),
+            bits_per_second=float(tokens[4]) * bit_unit,
+        )
+    except ValueError:
+        return None
+
+    role = tokens[-1] if tokens[-1] in ('sender', 'receiver') else None
+    rest = tokens[6:-1] if role else tokens[6:]
+    if udp or (len(rest) >= 2 and rest[1] == 'ms'):
+        if len(rest) >= 3 and rest[1] == 'ms':
+            # receiver side: jitter, lost/total datagrams and loss percentage
+            interval.jitter_ms = float(rest[0])
+            lost, total = rest[2].split('/', 1)
+            interval.lost_packets = int(lost)
+            interval.packets = int(total)
+            interval.lost_percent = interval.lost_packets * 100.0 / interval.packets if interval.packets else 0.0
+        elif rest and rest[0].isdigit():
+            interval.packets = int(rest[0])
+    elif rest and rest[0].isdigit():
+        interval.retransmits = int(rest[0])
+    if role == 'receiver':
+        interval.sender = False
+    return stream_id, interval, role
+
+
+class TextResultParser(ResultParser):
+    """
+    Same interface as ResultParser for iperf3 builds without --json-stream: parses the
+    human readable output (run with -i 1 --forceflush) into IntervalReports as they arrive.
+    """
+
+    def __init__(self, server=None, port=None, reverse=False, on_interval=None, num_streams=1, udp=False,
+                 keep_intervals=True):
+        super().__init__(server, port, reverse, on_interval, keep_intervals)
+        self.result.num_streams = num_streams
+        self.result.protocol = 'UDP' if udp else 'TCP'
+        self.udp = udp
+        self._pending = []
+        self._in_summary = False
+
+    def feed_line(self, line):
+        if line.startswith('- - -'):
+            self._in_summary = True
+            return
+        if line.startswith('iperf3: error'):
+            self.result.error = line.split('-', 1)[-1].strip()
+            return
+        parsed = parse_text_line(line, self.udp)
+        if parsed is None:
+            return
+        stream_id, interval, role = parsed
+        if self._in_summary or role is not None:
+            if stream_id == 'SUM' or self.result.num_streams == 1:
+                if role == 'receiver':
+                    self.result.received = interval
+                else:
+                    self.result.sent = interval
+            return
+        if stream_id == 'SUM':
+            self._add_report(IntervalReport(self._pending, interval))
+            self._pending = []
+            return
+        self._pending.append(interval)
+        if self.result.num_streams == 1:
+            self._add_report(IntervalReport(self._pending, interval))
+            self._pending = []
@@ -0,0 +1,134 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from results import split_bidir
+
+
+class CycleResult:
+    __slots__ = ('index', 'mode', 'regular', 'reverse')
+
+    def __init__(self, index, mode, regular=None, reverse=None):
+        self.index = index
+        self.mode = mode
+        self.regular = regular
+        self.reverse = reverse
+
+    @property
+    def complete(self):
+        return self.regular is not None and self.reverse is not None
+
+    def describe(self):
+        parts = []
+        for name, result in (('regular', self.regular), ('reverse', self.reverse)):
+            if result:
+                parts.append(f"{name} {result.bits_per_second / 1e6:.2f} Mbits/sec")
+            else:
+                parts.append(f"{name} failed")
+        return f"Cycle {self.index + 1} ({self.mode}): " + ", ".join(parts)
+
+
+class CycleScheduler:
+    """
+    Runs test cycles (a regular and a reverse test each) against one server as fast as
+    the two ends allow:
+
+    - bidir:      one --bidir test per cycle (iperf3 3.7+ on both ends)
+    - pipelined:  regular and reverse tests run concurrently on two server ports, and each
+                  direction moves on to its next cycle as soon as its own test is done
+    - sequential: the classic regular-then-reverse order
+
+    'auto' picks bidir when the local iperf3 supports it and falls back to pipelined (two
+    or more ports) or sequential if the server rejects it. Results are always reported per
+    direction, and on_cycle runs off the test path so the next cycle starts immediately.
+    """
+
+    def __init__(self, client, server_ip, ports=None, mode='auto', duration=60, adaptive=False, on_cycle=None):
+        self.client = client
+        self.server_ip = server_ip
+        self.ports = list(ports) if ports else [client.port]
+        self.mode = mode
+        self.duration = duration
+        self.adaptive = adaptive
+        self.on_cycle = on_cycle
+        self._lock = threading.Lock()
+        self._callbacks = None
+
+    def resolve_mode(self):
+        if self.mode != 'auto':
+            return self.mode
+        version = self.client.iperf_version()
+        # Adaptive bidir tests need --json-stream to see intervals while the test runs
+        if version >= (3, 7) and (not self.adaptive or version >= (3, 17)):
+            return 'bidir'
+        return self._fallback_mode()
+
+    def _fallback_mode(self):
+        return 'pipelined' if len(self.ports) > 1 else 'sequential'
+
+    def run(self, cycles):
+        mode = self.resolve_mode()
+        self.client.log(f"Running {cycles} test cycles against {self.server_ip} in {mode} mode")
+        results = [CycleResult(i, mode) for i in range(cycles)]
+        self._callbacks = ThreadPoolExecutor(max_workers=1)
+        try:
+            if mode == 'bidir':
+                self._run_bidir(results)
+            elif mode == 'pipelined':
+                self._run_pipelined(results)
+            else:
+                self._run_sequential(results)
+        finally:
+            self._callbacks.shutdown(wait=True)
+        return results
+
+    def _run_one(self, port, reverse=False, extra_args=None):
+        if self.adaptive:
+            return self.client.run_adaptive_test(self.server_ip, reverse=reverse, port=port, extra_args=extra_args,
+                                                 max_duration=self.duration)
+        return self.client.run_json_test(self.server_ip, reverse=reverse, duration=self.duration, port=port,
+                                         extra_args=extra_args)
+
+    def _finish(self, cycle):
+        self.client.log(cycle.describe())
+        if self.on_cycle is not None:
+            self._callbacks.submit(self.on_cycle, cycle)
+
+    def _run_bidir(self, results):
+        for index, cycle in enumerate(results):
+            result = self._run_one(self.ports[0], extra_args=["--bidir"])
+            if not result and index == 0:
+                # Old servers reject --bidir: switch the whole run to the fallback mode
+                fallback = self._fallback_mode()
+                self.client.log(f"Bidirectional test failed ({result.error}), falling back to {fallback} mode")
+                for pending in results:
+                    pending.mode = fallback
+                if fallback == 'pipelined':
+                    self._run_pipelined(results)
+                else:
+                    self._run_sequential(results)
+                return
+            cycle.regular, cycle.reverse = split_bidir(result)
+            self._finish(cycle)
+
+    def _run_sequential(self, results):
+        for cycle in results:
+            cycle.regular = self._run_one(self.ports[0])
+            cycle.reverse = self._run_one(self.ports[0], reverse=True)
+            self._finish(cycle)
+
+    def _run_pipelined(self, results):
+        def lane(port, reverse):
+            for cycle in results:
+                result = self._run_one(port, reverse=reverse)
+                with self._lock:
+                    if reverse:
+                        cycle.reverse = result
+                    else:
+                        cycle.regular = result
+                    done = cycle.complete
+                if done:
+                    self._finish(cycle)
+
+        with ThreadPoolExecutor(max_workers=2) as lanes:
+            futures = [lanes.submit(lane, self.ports[0], False), lanes.submit(lane, self.ports[1], True)]
+            for future in futures:
+                future.result()
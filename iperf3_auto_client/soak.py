@@ -0,0 +1,160 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from logger import get_writer
+
+HISTORY_HEADER = "timestamp,start,end,intervals,mean_bps,min_bps,max_bps,retransmits,mean_rtt_ms\n"
+
+
+class RollingStats:
+    """
+    Running min/max/mean plus approximate percentiles for an unbounded series in constant
+    memory: values are counted in logarithmic buckets `resolution` (relative) wide.
+    """
+
+    def __init__(self, resolution=0.01):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self._log_base = math.log1p(resolution)
+        self._buckets = {}
+        self._zeros = 0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        if value <= 0:
+            self._zeros += 1
+        else:
+            bucket = int(math.floor(math.log(value) / self._log_base))
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * (self.count - 1)
+        seen = self._zeros
+        if rank < seen:
+            return 0.0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if rank < seen:
+                # Middle of the bucket, clamped to the exact extremes we do know
+                value = math.exp((bucket + 0.5) * self._log_base)
+                return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            'count': self.count, 'min': self.minimum, 'max': self.maximum, 'mean': self.mean,
+            'p1': self.percentile(1), 'p5': self.percentile(5), 'p50': self.percentile(50),
+            'p95': self.percentile(95), 'p99': self.percentile(99),
+        }
+
+
+class SoakMonitor:
+    """
+    Consumes the intervals of a long test: keeps the last `recent` intervals in a ring
+    buffer, rolling statistics over the whole run, and appends one downsampled row per
+    `downsample` intervals to a CSV history file.
+    """
+
+    def __init__(self, recent=3600, downsample=60, history_file=None):
+        self.recent = deque(maxlen=recent)
+        self.downsample = downsample
+        new_file = bool(history_file) and not (os.path.exists(history_file) and os.path.getsize(history_file))
+        # Never rotated: the header is only written to a new file, and a row per `downsample`
+        # intervals stays small even over days
+        self.history = get_writer(history_file, max_bytes=0) if history_file else None
+        self.throughput = RollingStats()
+        self.rtt = RollingStats()
+        self.retransmits = 0
+        self.intervals = 0
+        self.started = time.time()
+        self.result = None
+        self._bucket = []
+        if new_file:
+            self.history.write(HISTORY_HEADER)
+
+    def add(self, report):
+        interval = report.sum
+        if interval.omitted:
+            return
+        self.intervals += 1
+        self.recent.append(report)
+        self.throughput.add(interval.bits_per_second)
+        if interval.retransmits:
+            self.retransmits += interval.retransmits
+        rtts = [s.rtt for s in report.streams if s.rtt is not None]
+        if rtts:
+            self.rtt.add(sum(rtts) / len(rtts))
+        self._bucket.append(report)
+        if len(self._bucket) >= self.downsample:
+            self._flush_bucket()
+
+    def _flush_bucket(self):
+        bucket, self._bucket = self._bucket, []
+        if self.history is None or not bucket:
+            return
+        rates = [r.bits_per_second for r in bucket]
+        retransmits = sum(r.sum.retransmits or 0 for r in bucket)
+        rtts = [s.rtt for r in bucket for s in r.streams if s.rtt is not None]
+        mean_rtt = f"{sum(rtts) / len(rtts):.3f}" if rtts else ""
+        self.history.write(
+            f"{time.strftime('%Y-%m-%d %H:%M:%S')},{bucket[0].start:.2f},{bucket[-1].end:.2f},{len(bucket)},"
+            f"{sum(rates) / len(rates):.0f},{min(rates):.0f},{max(rates):.0f},{retransmits},{mean_rtt}\n"
+        )
+
+    def close(self):
+        self._flush_bucket()
+
+    def describe(self):
+        stats = self.throughput
+        return (f"{self.intervals} intervals: mean {stats.mean / 1e6:.2f} Mbits/sec, "
+                f"min {(stats.minimum or 0) / 1e6:.2f}, p5 {stats.percentile(5) / 1e6:.2f}, "
+                f"p50 {stats.percentile(50) / 1e6:.2f}, p95 {stats.percentile(95) / 1e6:.2f}, "
+                f"max {(stats.maximum or 0) / 1e6:.2f}, {self.retransmits} retransmits")
+
+    def to_dict(self):
+        return {
+            'intervals': self.intervals,
+            'throughput': self.throughput.to_dict(),
+            'rtt_ms': self.rtt.to_dict(),
+            'retransmits': self.retransmits,
+        }
+
+
+async def stream_process(cmd, on_line, line_limit=64 * 1024, on_start=None):
+    """Runs cmd and hands each output line to on_line as it arrives; returns the exit code."""
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        limit=line_limit
+    )
+    if on_start is not None:
+        on_start(process.pid)
+    try:
+        while True:
+            try:
+                line = await process.stdout.readline()
+            except ValueError:
+                # A line longer than the limit: drop it rather than buffer it
+                continue
+            if not line:
+                break
+            on_line(line.decode("utf-8", "replace"))
+        return await process.wait()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
@@ -0,0 +1,354 @@
+import errno
+import socket
+import subprocess
+import threading
+import time
+from collections import deque
+from host_stats import affinity_args, pin_process
+from native_engine import NativeServer
+import tracing
+
+MAX_LINE_LENGTH = 4096
+
+
+def port_is_listening(port, address=""):
+    # Binding fails with EADDRINUSE while a server holds the port, and does not disturb it
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        probe.bind((address, port))
+        return False
+    except OSError as e:
+        return e.errno in (errno.EADDRINUSE, getattr(errno, "WSAEADDRINUSE", errno.EADDRINUSE), errno.EACCES)
+    finally:
+        probe.close()
+
+
+class ServerSupervisor:
+    """
+    Keeps one long-lived `iperf3 -s` process running. Output is read line by line into
+    bounded buffers, test boundaries are detected from the output, and the process is
+    only restarted when it exits or stops listening, with exponential backoff. A session
+    that ends without a summary line, such as the cookie handshake of a discovery probe
+    (probe_iperf_server), is not counted as a test and its errors only go to debug.
+    """
+
+    def __init__(self, iperf_path, port, core=None, log=print, debug=None, on_busy=None, on_idle=None,
+                 history=200, backoff_base=1.0, backoff_max=60.0, stable_after=30.0,
+                 health_interval=5.0, health_failures=3, host_sampler=None, bind=""):
+        self.iperf_path = iperf_path
+        self.port = port
+        self.core = core
+        self.bind = bind
+        self.log = log
+        self.debug = debug or (lambda message: None)
+        self.on_busy = on_busy
+        self.on_idle = on_idle
+        self.recent_output = deque(maxlen=history)
+        self.recent_errors = deque(maxlen=history)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        # Called with the pinned cores at the start of each test, returns a started HostSampler or None
+        self.host_sampler = host_sampler
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.tests_completed = 0
+        self.last_summary = None
+        self.last_host_stats = None
+        self._client = None
+        # False from "Accepted connection" until a stream connects or a summary arrives
+        self._connected = True
+        self._test_started = None
+        self._test_span_start = None
+        self._sampler = None
+        self._crashes = 0
+        self._next_start = 0.0
+        self._exited_at = None
+        self._next_health_check = 0.0
+        self._failed_checks = 0
+
+    def command(self):
+        # On a pipe iperf3 block-buffers its output, and test boundaries are detected from it
+        cmd = [self.iperf_path, "-s", "-p", str(self.port), "--forceflush"]
+        if self.bind:
+            cmd += ["-B", self.bind]
+        if self.core is not None:
+            cmd += affinity_args([self.core])
+        return cmd
+
+    @property
+    def busy(self):
+        return self._client is not None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        if self.core is not None:
+            try:
+                pin_process(self.process.pid, [self.core])
+            except OSError as e:
+                self.log(f"Could not pin iperf3 on port {self.port} to CPU {self.core}: {e}")
+        self.started_at = time.monotonic()
+        self._next_health_check = self.started_at + self.health_interval
+        self._failed_checks = 0
+        threading.Thread(target=self._read_stream, args=(self.process.stdout, self._handle_output), daemon=True).start()
+        threading.Thread(target=self._read_stream, args=(self.process.stderr, self._handle_error), daemon=True).start()
+        pinned = f" pinned to CPU {self.core}" if self.core is not None else ""
+        self.log(f"iperf3 server started on port {self.port}{pinned} (pid {self.process.pid})")
+
+    def _read_stream(self, stream, handler):
+        for line in iter(lambda: stream.readline(MAX_LINE_LENGTH), ""):
+            line = line.rstrip()
+            if line:
+                handler(line)
+
+    def _handle_output(self, line):
+        self.recent_output.append(line)
+        self.debug(f"[{self.port}] {line}")
+        if line.startswith("Accepted connection from"):
+            self._client = line[len("Accepted connection from "):].split(",")[0]
+            self._connected = False
+            self._test_started = time.monotonic()
+            self._test_span_start = time.perf_counter_ns()
+            if self.host_sampler is not None:
+                self._sampler = self.host_sampler([self.core] if self.core is not None else None)
+            self.log(f"Port {self.port}: test started by {self._client}")
+            if self.on_busy:
+                self.on_busy(self.port)
+        elif line.endswith("receiver") or line.endswith("sender"):
+            self.last_summary = line
+            self._connected = True
+        elif " connected to " in line:
+            self._connected = True
+        elif line.startswith("Server listening on") and self._client is not None and self.last_summary is None:
+            # Only a handshake, e.g. a discovery probe: no test to count, trace or report
+            self.debug(f"[{self.port}] session from {self._client} ended without a test")
+            if self._sampler is not None:
+                self._sampler.stop()
+                self._sampler = None
+            self._client = None
+            if self.on_idle:
+                self.on_idle(self.port)
+        elif line.startswith("Server listening on") and self._client is not None:
+            self.tests_completed += 1
+            elapsed = time.monotonic() - self._test_started
+            tracing.add_span("test", self._test_span_start, port=self.port, client=self._client)
+            self.log(f"Port {self.port}: test #{self.tests_completed} from {self._client} finished in {elapsed:.1f}s"
+                     + (f" ({' '.join(self.last_summary.split())})" if self.last_summary else ""))
+            if self._sampler is not None:
+                self.last_host_stats = self._sampler.stop()
+                self._sampler = None
+                self.log(f"Port {self.port}: host during test: {self.last_host_stats.describe()}")
+            self._client = None
+            self.last_summary = None
+            if self.on_idle:
+                self.on_idle(self.port)
+
+    def _handle_error(self, line):
+        self.recent_errors.append(line)
+        if not self._connected:
+            # A client that left during the handshake, most likely a probe
+            self.debug(f"[{self.port}] error before the test started: {line}")
+            return
+        self.log(f"Server error on port {self.port}: {line}")
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_healthy(self):
+        return self.is_running() and port_is_listening(self.port, self.bind)
+
+    def check(self):
+        """Called periodically by the owner: restarts the process on crash or failed health probes."""
+        now = time.monotonic()
+        if self.process is None:
+            self.start()
+            return
+        if self.is_running():
+            if now >= self._next_health_check:
+                self._next_health_check = now + self.health_interval
+                with tracing.span("health_check", port=self.port):
+                    listening = port_is_listening(self.port, self.bind)
+                if listening:
+                    self._failed_checks = 0
+                else:
+                    self._failed_checks += 1
+                    if self._failed_checks >= self.health_failures:
+                        self.log(f"iperf3 on port {self.port} is not listening after "
+                                 f"{self._failed_checks} health checks. Killing it...")
+                        self.stop()
+            if self.is_running():
+                return
+
+        if self._next_start == 0.0:
+            uptime = now - self.started_at
+            self._crashes = 0 if uptime >= self.stable_after else self._crashes + 1
+            # The first crash restarts at once, repeated quick crashes back off exponentially
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (self._crashes - 2)) if self._crashes > 1 else 0.0
+            self._next_start = now + delay
+            self._exited_at = time.perf_counter_ns()
+            self.log(f"iperf3 on port {self.port} exited with code {self.process.returncode} after {uptime:.1f}s. "
+                     f"Restarting in {delay:.1f}s...")
+            if self._client is not None:
+                self._client = None
+                if self._sampler is not None:
+                    self._sampler.stop()
+                    self._sampler = None
+                if self.on_idle:
+                    self.on_idle(self.port)
+        if now >= self._next_start:
+            self._next_start = 0.0
+            self.restarts += 1
+            # From noticing the exit to the restart: the backoff plus however late check() ran
+            tracing.add_span("restart_wait", self._exited_at, port=self.port, restart=self.restarts)
+            with tracing.span("restart", port=self.port, restart=self.restarts):
+                self.start()
+
+    def stop(self):
+        if self.is_running():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class NativeSupervisor:
+    """
+    ServerSupervisor's counterpart for the native engine (native_engine.NativeServer):
+    the server runs in a thread of this process, reports test boundaries itself and is
+    restarted with the same backoff when its thread dies or it stops listening.
+    """
+
+    def __init__(self, port, core=None, log=print, debug=None, on_busy=None, on_idle=None,
+                 backoff_base=1.0, backoff_max=60.0, stable_after=30.0,
+                 health_interval=5.0, health_failures=3, host_sampler=None, bind=""):
+        self.port = port
+        self.core = core
+        self.bind = bind
+        self.log = log
+        self.debug = debug or (lambda message: None)
+        self.on_busy = on_busy
+        self.on_idle = on_idle
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.host_sampler = host_sampler
+        self.server = None
+        self.started_at = None
+        self.restarts = 0
+        self.last_summary = None
+        self.last_host_stats = None
+        self._tests_before = 0
+        self._client = None
+        self._test_span_start = None
+        self._sampler = None
+        self._crashes = 0
+        self._next_start = 0.0
+        self._next_health_check = 0.0
+        self._failed_checks = 0
+
+    @property
+    def busy(self):
+        return self._client is not None
+
+    @property
+    def tests_completed(self):
+        return self._tests_before + (self.server.tests_completed if self.server is not None else 0)
+
+    def start(self):
+        if self.server is not None:
+            self._tests_before += self.server.tests_completed
+        self.started_at = time.monotonic()
+        self._next_health_check = self.started_at + self.health_interval
+        self._failed_checks = 0
+        self.server = NativeServer(self.port, self.bind, log=self.log, on_start=self._test_started, on_end=self._test_ended,
+                                   cores=[self.core] if self.core is not None else None)
+        try:
+            self.server.start()
+        except OSError as e:
+            self.log(f"Native server could not listen on port {self.port}: {e}")
+            return
+        pinned = f" pinned to CPU {self.core}" if self.core is not None else ""
+        self.log(f"Native server started on port {self.port}{pinned}")
+
+    def _test_started(self, client):
+        self._client = client
+        self._test_span_start = time.perf_counter_ns()
+        if self.host_sampler is not None:
+            self._sampler = self.host_sampler([self.core] if self.core is not None else None)
+        self.log(f"Port {self.port}: test started by {client}")
+        if self.on_busy:
+            self.on_busy(self.port)
+
+    def _test_ended(self, summary):
+        self.last_summary = summary
+        tracing.add_span("test", self._test_span_start, port=self.port, client=self._client)
+        outcome = (f"error: {summary['error']}" if summary["error"]
+                   else f"{summary['bytes'] / 1048576:.1f} MBytes, {summary['bits_per_second'] / 1e6:.1f} Mbits/sec")
+        self.log(f"Port {self.port}: test #{self.tests_completed} from {self._client} finished in "
+                 f"{summary['seconds']:.1f}s ({outcome})")
+        self._idle()
+
+    def _idle(self):
+        if self._sampler is not None:
+            self.last_host_stats = self._sampler.stop()
+            self._sampler = None
+            self.log(f"Port {self.port}: host during test: {self.last_host_stats.describe()}")
+        if self._client is not None:
+            self._client = None
+            if self.on_idle:
+                self.on_idle(self.port)
+
+    def is_running(self):
+        return self.server is not None and self.server.running
+
+    def is_healthy(self):
+        return self.is_running() and port_is_listening(self.port, self.bind)
+
+    def check(self):
+        """Same contract as ServerSupervisor.check."""
+        now = time.monotonic()
+        if self.server is None:
+            self.start()
+            return
+        if self.is_running():
+            if now >= self._next_health_check:
+                self._next_health_check = now + self.health_interval
+                with tracing.span("health_check", port=self.port):
+                    listening = port_is_listening(self.port, self.bind)
+                self._failed_checks = 0 if listening else self._failed_checks + 1
+                if self._failed_checks >= self.health_failures:
+                    self.log(f"Native server on port {self.port} is not listening after "
+                             f"{self._failed_checks} health checks. Restarting it...")
+                    self.stop()
+            if self.is_running():
+                return
+
+        if self._next_start == 0.0:
+            uptime = now - self.started_at
+            self._crashes = 0 if uptime >= self.stable_after else self._crashes + 1
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (self._crashes - 2)) if self._crashes > 1 else 0.0
+            self._next_start = now + delay
+            self.log(f"Native server on port {self.port} stopped after {uptime:.1f}s. Restarting in {delay:.1f}s...")
+            self._idle()
+        if now >= self._next_start:
+            self._next_start = 0.0
+            self.restarts += 1
+            with tracing.span("restart", port=self.port, restart=self.restarts):
+                self.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+
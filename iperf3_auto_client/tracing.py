@@ -0,0 +1,179 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+_tracer = None
+
+
+class _NoSpan:
+    """Returned by span() while tracing is off: entering and leaving it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.start, time.perf_counter_ns(), self.category, self.args)
+        return False
+
+    def set(self, **args):
+        """Adds arguments (e.g. what a phase found) before the span ends."""
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    Collects timed spans from any thread. Export them with write_chrome_trace() for
+    chrome://tracing or Perfetto, or aggregate them per phase with summary(). With
+    `max_events` only the latest spans are kept for the trace, for long-running
+    processes; summary() still covers every span recorded.
+    """
+
+    def __init__(self, max_events=None):
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.events = deque(maxlen=max_events)
+        self.threads = {}
+        self.recorded = 0
+        # name -> [count, total ns, longest ns], and the first start and last end seen
+        self.phases = {}
+        self.first = None
+        self.last = None
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, category="phase", args=None):
+        thread = threading.current_thread()
+        self.threads[thread.ident] = thread.name
+        # deque.append is atomic, only the per-phase totals need the lock
+        self.events.append((name, category, start, end, thread.ident, args or None))
+        with self._lock:
+            self.recorded += 1
+            phase = self.phases.setdefault(name, [0, 0, 0])
+            phase[0] += 1
+            phase[1] += end - start
+            phase[2] = max(phase[2], end - start)
+            self.first = start if self.first is None else min(self.first, start)
+            self.last = end if self.last is None else max(self.last, end)
+
+    @property
+    def dropped(self):
+        return self.recorded - len(self.events)
+
+    def chrome_trace(self):
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(self.threads.items())
+        ]
+        for name, category, start, end, tid, args in list(self.events):
+            event = {"name": name, "cat": category, "ph": "X", "pid": self.pid, "tid": tid,
+                     "ts": (start - self.origin) / 1000.0, "dur": (end - start) / 1000.0}
+            if args:
+                event["args"] = args
+            events.append(event)
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if self.dropped:
+            trace["otherData"] = {"dropped_events": self.dropped}
+        return trace
+
+    def write_chrome_trace(self, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+        os.replace(temp_path, path)
+
+    def summary(self):
+        """Per-phase count, total, mean and max in ms, and share of the traced wall time."""
+        with self._lock:
+            if not self.phases:
+                return []
+            wall = self.last - self.first or 1
+            phases = {name: tuple(phase) for name, phase in self.phases.items()}
+        rows = [
+            {"phase": name, "count": count, "total_ms": total / 1e6, "mean_ms": total / count / 1e6,
+             "max_ms": longest / 1e6, "share": total / wall}
+            for name, (count, total, longest) in phases.items()
+        ]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def describe(self):
+        rows = self.summary()
+        width = max([len(row["phase"]) for row in rows] + [5])
+        lines = [f"{'phase'.ljust(width)}  {'count':>6}  {'total ms':>10}  {'mean ms':>10}  {'max ms':>10}  {'share':>6}"]
+        for row in rows:
+            lines.append(f"{row['phase'].ljust(width)}  {row['count']:>6}  {row['total_ms']:>10.1f}  "
+                         f"{row['mean_ms']:>10.1f}  {row['max_ms']:>10.1f}  {row['share']:>6.1%}")
+        return "\n".join(lines)
+
+
+def enable(max_events=None):
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(max_events)
+    return _tracer
+
+
+def disable():
+    """Stops tracing and returns the tracer with what it recorded, or None."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def active():
+    return _tracer
+
+
+def span(name, category="phase", **args):
+    """with span("discovery"): ... - a no-op unless tracing was enabled."""
+    if _tracer is None:
+        return NO_SPAN
+    return Span(_tracer, name, category, args)
+
+
+def add_span(name, start, end=None, category="phase", **args):
+    """Records a phase that a with-block cannot wrap, from perf_counter_ns() timestamps."""
+    if _tracer is not None:
+        _tracer.add(name, start, end or time.perf_counter_ns(), category, args)
+
+
+def traced(name=None, category="phase"):
+    """Decorator: the function's calls become spans while tracing is enabled."""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with Span(_tracer, label, category, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,142 @@
+import json
+import os
+import time
+
+DEFAULT = "default"
+TUNING_FLAGS = ("-P", "--parallel", "-w", "--window", "-l", "--length", "-Z", "--zerocopy")
+
+
+def sweep_values(text, cast=str):
+    """'default, 512K, 2M' -> [None, '512K', '2M'] ('default' leaves iperf3's own value)."""
+    values = []
+    for item in text.split(","):
+        item = item.strip()
+        if item:
+            values.append(None if item.lower() == DEFAULT else cast(item))
+    return values
+
+
+def tuning_args(params):
+    args = []
+    if params.get('streams', 1) > 1:
+        args += ["-P", str(params['streams'])]
+    if params.get('window'):
+        args += ["-w", params['window']]
+    if params.get('length'):
+        args += ["-l", params['length']]
+    if params.get('zerocopy'):
+        args.append("-Z")
+    return args
+
+
+def describe_params(params):
+    return (f"-P {params.get('streams', 1)}, -w {params.get('window') or DEFAULT}, "
+            f"-l {params.get('length') or DEFAULT}, zero-copy {'on' if params.get('zerocopy') else 'off'}")
+
+
+class TuningCache:
+    """
+    Best iperf3 settings found per path (client, server and direction), kept on disk so
+    later runs reuse them. Entries expire `ttl` seconds after they were measured, since
+    the path or the hosts may have changed.
+    """
+
+    def __init__(self, path, ttl=7 * 86400):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self.load()
+
+    @staticmethod
+    def key(client_ip, server_ip, reverse=False):
+        return f"{client_ip or 'local'}>{server_ip}/{'reverse' if reverse else 'regular'}"
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.evict()
+
+    def save(self):
+        self.evict()
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def evict(self, now=None):
+        now = now or time.time()
+        self.entries = {k: e for k, e in self.entries.items() if now - e.get("measured", 0) < self.ttl}
+
+    def get(self, client_ip, server_ip, reverse=False):
+        self.evict()
+        return self.entries.get(self.key(client_ip, server_ip, reverse))
+
+    def record(self, client_ip, server_ip, reverse, params, bits_per_second):
+        self.entries[self.key(client_ip, server_ip, reverse)] = {
+            "params": params, "args": tuning_args(params),
+            "bits_per_second": bits_per_second, "measured": time.time(),
+        }
+        self.save()
+
+
+class ParameterSweep:
+    """
+    Searches -P, -w, -l and -Z for the fastest settings on one path, one dimension at a
+    time starting from iperf3's defaults. Each trial is an adaptive test that stops once
+    throughput converges, and is cut short as soon as its confidence interval shows it
+    cannot beat the best result so far by `min_gain`. Streams, window and length are
+    tried in increasing order and the dimension is abandoned at the first value that
+    does not help.
+    """
+
+    def __init__(self, client, server_ip, port=None, reverse=False, streams=(1, 2, 4, 8),
+                 windows=(None, '512K', '2M', '8M'), lengths=(None, '128K', '1M'), zerocopy=(False, True),
+                 min_gain=0.03, max_duration=20):
+        self.client = client
+        self.server_ip = server_ip
+        self.port = port
+        self.reverse = reverse
+        self.dimensions = [
+            ('streams', list(streams)), ('window', list(windows)),
+            ('length', list(lengths)), ('zerocopy', list(zerocopy)),
+        ]
+        self.min_gain = min_gain
+        self.max_duration = max_duration
+        self.trials = []
+
+    def trial(self, params, prune_below=None):
+        result = self.client.run_adaptive_test(
+            self.server_ip, reverse=self.reverse, port=self.port, extra_args=tuning_args(params),
+            max_duration=self.max_duration, prune_below=prune_below, trial=True
+        )
+        bits_per_second = result.bits_per_second if result else 0.0
+        self.trials.append({"params": dict(params), "bits_per_second": bits_per_second,
+                            "error": result.error})
+        self.client.log(f"Sweep trial {describe_params(params)}: "
+                        + (f"{bits_per_second / 1e6:.2f} Mbits/sec" if result else f"failed ({result.error})"))
+        return bits_per_second
+
+    def run(self):
+        """Returns (best params, best bits/s)."""
+        best = {'streams': 1, 'window': None, 'length': None, 'zerocopy': False}
+        best_bps = self.trial(best)
+        for name, values in self.dimensions:
+            for value in values:
+                if value == best[name]:
+                    continue
+                params = dict(best, **{name: value})
+                target = best_bps * (1 + self.min_gain)
+                bits_per_second = self.trial(params, prune_below=target)
+                if bits_per_second > target:
+                    best, best_bps = params, bits_per_second
+                else:
+                    break
+        self.client.log(f"Best settings for {self.server_ip} ({'reverse' if self.reverse else 'regular'}): "
+                        f"{describe_params(best)} at {best_bps / 1e6:.2f} Mbits/sec after {len(self.trials)} trials")
+        return best, best_bps
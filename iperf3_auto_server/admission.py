@@ -0,0 +1,269 @@
+import heapq
+import itertools
+import json
+import secrets
+import socket
+import threading
+import time
+
+ADMISSION_PORT = 50004
+MAX_MESSAGE = 64 * 1024
+
+
+def parse_weights(text):
+    """'10.0.0.5:2, 10.0.0.6:0.5' -> {'10.0.0.5': 2.0, '10.0.0.6': 0.5}"""
+    weights = {}
+    for item in (text or "").split(","):
+        host, _, weight = item.strip().rpartition(":")
+        if host:
+            weights[host] = float(weight)
+    return weights
+
+
+class Ticket:
+    __slots__ = ('token', 'client', 'duration', 'count', 'weight', 'seq', 'virtual_start', 'virtual_finish',
+                 'enqueued', 'granted', 'ports', 'last_seen', 'position', 'notify')
+
+    def __init__(self, token, client, duration, count, weight, seq, now, notify):
+        self.token = token
+        self.client = client
+        self.duration = duration
+        self.count = count
+        self.weight = weight
+        self.seq = seq
+        self.virtual_start = 0.0
+        self.virtual_finish = 0.0
+        self.enqueued = now
+        self.granted = None
+        self.ports = None
+        self.last_seen = now
+        self.position = None
+        self.notify = notify
+
+
+class AdmissionQueue:
+    """
+    Hands the pool's ports to waiting clients in turn instead of letting them race for
+    them. "fifo" grants in arrival order; "fair" is start-time fair queueing over client
+    addresses, where a request costs duration / weight of its client's virtual time, so
+    a client queueing test after test cannot crowd out the others. The head of the queue
+    is never overtaken, so a request for several ports cannot starve. Tickets and grants
+    expire when their holder has not been heard from for `expiry` seconds.
+    """
+
+    def __init__(self, allocator, policy="fifo", weights=None, expiry=30.0, log=print, clock=time.monotonic):
+        self.allocator = allocator
+        self.policy = policy
+        self.weights = weights or {}
+        self.expiry = expiry
+        self.log = log
+        self.clock = clock
+        self.waiting = []
+        self.grants = {}
+        self.granted_total = 0
+        self.expired_total = 0
+        # Estimate for ports busy with tests we did not grant, refined from the grants we see end
+        self.mean_hold = 10.0
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._client_finish = {}
+        self._changed = threading.Condition()
+        allocator.on_free = self.wake
+
+    def wake(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def request(self, client, duration, count=1, weight=None, notify=None):
+        """Queues a request for `count` ports for about `duration` seconds; returns its Ticket."""
+        count = max(1, min(int(count), len(self.allocator.ports)))
+        # Only the server's configuration can raise a client's share, a client may only lower its own
+        weight = max(self.weights.get(client, min(weight or 1.0, 1.0)), 0.01)
+        with self._changed:
+            now = self.clock()
+            ticket = Ticket(secrets.token_hex(8), client, max(float(duration), 1.0), count, weight,
+                            next(self._seq), now, notify)
+            ticket.virtual_start = max(self._virtual_time, self._client_finish.get(client, 0.0))
+            ticket.virtual_finish = ticket.virtual_start + ticket.duration * count / weight
+            self._client_finish[client] = ticket.virtual_finish
+            self.waiting.append(ticket)
+            if self.policy == "fair":
+                self.waiting.sort(key=lambda t: (t.virtual_finish, t.seq))
+            self._changed.notify_all()
+        return ticket
+
+    def touch(self, token):
+        with self._changed:
+            ticket = self.grants.get(token) or next((t for t in self.waiting if t.token == token), None)
+            if ticket is not None:
+                ticket.last_seen = self.clock()
+            return ticket is not None
+
+    def release(self, token):
+        """Ends a grant or withdraws a waiting ticket."""
+        with self._changed:
+            ticket = self.grants.pop(token, None)
+            if ticket is None:
+                self.waiting = [t for t in self.waiting if t.token != token]
+                self._changed.notify_all()
+                return
+            held = self.clock() - ticket.granted
+            self.mean_hold += 0.2 * (held - self.mean_hold)
+        self.allocator.unreserve(ticket.ports)
+
+    def _expire(self, now, events):
+        for ticket in [t for t in self.grants.values() if now - t.last_seen > self.expiry]:
+            del self.grants[ticket.token]
+            self.allocator.unreserve(ticket.ports)
+            self.expired_total += 1
+            events.append((ticket, {"event": "expired", "token": ticket.token}))
+            self.log(f"Admission: grant of {ticket.ports} to {ticket.client} expired")
+        expired = [t for t in self.waiting if now - t.last_seen > self.expiry]
+        if expired:
+            self.waiting = [t for t in self.waiting if now - t.last_seen <= self.expiry]
+            self.expired_total += len(expired)
+            for ticket in expired:
+                events.append((ticket, {"event": "expired", "token": ticket.token}))
+
+    def _grant(self, now, events):
+        while self.waiting:
+            ticket = self.waiting[0]
+            ports = self.allocator.reserve(ticket.count)
+            if ports is None:
+                break
+            self.waiting.pop(0)
+            ticket.granted = now
+            ticket.ports = ports
+            ticket.last_seen = now
+            self.grants[ticket.token] = ticket
+            self.granted_total += 1
+            self._virtual_time = max(self._virtual_time, ticket.virtual_start)
+            events.append((ticket, {"event": "granted", "token": ticket.token, "ports": ports,
+                                    "waited": round(now - ticket.enqueued, 3), "expiry": self.expiry}))
+            self.log(f"Admission: granted {ports} to {ticket.client} after {now - ticket.enqueued:.1f}s")
+        # Clients whose last request is behind the virtual clock start from it again
+        for client in [c for c, finish in self._client_finish.items() if finish <= self._virtual_time]:
+            del self._client_finish[client]
+
+    def _estimate(self, now, events):
+        """Queue positions and ETAs: replays the waiting tickets over the ports' expected free times."""
+        free = set(self.allocator.free_ports())
+        reserved = {port: t.granted + t.duration for t in self.grants.values() for port in t.ports}
+        slots = [max(reserved.get(port, now + self.mean_hold), now) if port not in free else now
+                 for port in self.allocator.ports]
+        heapq.heapify(slots)
+        for position, ticket in enumerate(self.waiting, 1):
+            taken = [heapq.heappop(slots) for _ in range(ticket.count)]
+            start = max(taken)
+            for _ in taken:
+                heapq.heappush(slots, start + ticket.duration)
+            if ticket.position != position:
+                ticket.position = position
+                events.append((ticket, {"event": "queued", "token": ticket.token, "position": position,
+                                        "eta": round(start - now, 1), "expiry": self.expiry}))
+
+    def step(self):
+        """Expires, grants and re-estimates once; returns the (ticket, message) notifications to send."""
+        events = []
+        with self._changed:
+            now = self.clock()
+            self._expire(now, events)
+            self._grant(now, events)
+            self._estimate(now, events)
+        return events
+
+    def run(self, stop, interval=1.0):
+        while not stop.is_set():
+            for ticket, message in self.step():
+                if ticket.notify is not None:
+                    ticket.notify(message)
+            with self._changed:
+                self._changed.wait(interval)
+
+    def describe(self):
+        with self._changed:
+            return (f"{len(self.waiting)} waiting, {len(self.grants)} granted, "
+                    f"{self.granted_total} grants, {self.expired_total} expired")
+
+
+class AdmissionServer:
+    """
+    Newline-delimited JSON reservations on TCP `port`, one per connection:
+
+        -> {"op": "reserve", "duration": 120, "ports": 1, "weight": 1}
+        <- {"event": "queued", "token": "...", "position": 3, "eta": 240.0}   (again when it moves)
+        <- {"event": "granted", "token": "...", "ports": [5201], "waited": 230.5, "expiry": 30}
+        -> {"op": "renew"}      at least every `expiry` seconds while waiting or testing
+        -> {"op": "release"}    or just close the connection
+
+    A client that disconnects loses its place or its grant at once.
+    """
+
+    def __init__(self, queue, port=ADMISSION_PORT, bind="", log=print):
+        self.queue = queue
+        self.port = port
+        self.bind = bind
+        self.log = log
+        self.sock = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.bind, self.port))
+        self.sock.listen(128)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self.queue.run, args=(self._stop,), daemon=True).start()
+        self.log(f"Admission queue ({self.queue.policy}) listening on TCP {self.port}")
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, address = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(conn, address[0]), daemon=True).start()
+
+    def _serve(self, conn, client):
+        lock = threading.Lock()
+        reader = conn.makefile("rb")
+        ticket = None
+
+        def send(message):
+            data = (json.dumps(message) + "\n").encode("utf-8")
+            try:
+                with lock:
+                    conn.sendall(data)
+            except OSError:
+                pass
+
+        try:
+            # A client that stays silent for a whole expiry period is gone
+            conn.settimeout(self.queue.expiry)
+            for line in iter(lambda: reader.readline(MAX_MESSAGE), b""):
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "reserve" and ticket is None:
+                    ticket = self.queue.request(client, message.get("duration", 60), message.get("ports", 1),
+                                                message.get("weight"), notify=send)
+                elif op == "renew" and ticket is not None:
+                    if not self.queue.touch(ticket.token):
+                        send({"event": "expired", "token": ticket.token})
+                        break
+                elif op == "release":
+                    break
+                else:
+                    send({"event": "error", "error": f"unexpected {op!r}"})
+        except (OSError, ValueError):
+            pass
+        finally:
+            if ticket is not None:
+                self.queue.release(ticket.token)
+            reader.close()
+            conn.close()
+
+    def close(self):
+        self._stop.set()
+        self.queue.wake()
+        if self.sock is not None:
+            self.sock.close()
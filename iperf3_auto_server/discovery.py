@@ -0,0 +1,97 @@
+import socket
+import struct
+import threading
+
+# Wire format shared with the client's discovery.py, all integers in network byte order:
+#   solicit: magic "IPF3", type 1, protocol version, nonce (u32)
+#   offer:   magic "IPF3", type 2, protocol version, nonce (u32), IPv4 address, base port (u16),
+#            load percent (u8), port count (u8), ports (u16 each), version length (u8), version
+MAGIC = b"IPF3"
+PROTOCOL_VERSION = 1
+TYPE_SOLICIT = 1
+TYPE_OFFER = 2
+HEADER = struct.Struct("!4sBBI")
+OFFER = struct.Struct("!4sHBB")
+DISCOVERY_PORT = 50001
+
+
+def decode_solicit(data):
+    if len(data) < HEADER.size:
+        return None
+    magic, message_type, version, nonce = HEADER.unpack_from(data)
+    if magic != MAGIC or message_type != TYPE_SOLICIT:
+        return None
+    return nonce
+
+
+def encode_offer(nonce, ip, port, free_ports, load, version=""):
+    free_ports = list(free_ports)[:255]
+    version = version.encode("utf-8")[:255]
+    load = max(0, min(100, int(round(load * 100))))
+    return (
+        HEADER.pack(MAGIC, TYPE_OFFER, PROTOCOL_VERSION, nonce)
+        + OFFER.pack(socket.inet_aton(ip), port, load, len(free_ports))
+        + struct.pack(f"!{len(free_ports)}H", *free_ports)
+        + struct.pack("!B", len(version)) + version
+    )
+
+
+class DiscoveryResponder:
+    """
+    Answers client solicits on the discovery port straight away with a binary offer
+    carrying this server's address, idle ports, load and iperf3 version.
+    """
+
+    def __init__(self, ip, port, free_ports, load, version="", multicast_group="224.0.0.1",
+                 discovery_port=DISCOVERY_PORT, log=print):
+        self.ip = ip
+        self.port = port
+        self.free_ports = free_ports
+        self.load = load
+        self.version = version
+        self.multicast_group = multicast_group
+        self.discovery_port = discovery_port
+        self.log = log
+        self.sock = None
+        self.answered = 0
+
+    def open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", self.discovery_port))
+        try:
+            group = socket.inet_aton(self.multicast_group) + socket.inet_aton("0.0.0.0")
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group)
+        except OSError as e:
+            self.log(f"Discovery: could not join {self.multicast_group}, answering broadcasts only: {e}")
+        self.sock = sock
+        return sock
+
+    def serve_forever(self):
+        if self.sock is None:
+            self.open()
+        self.log(f"Discovery responder listening on UDP {self.discovery_port}")
+        while True:
+            try:
+                data, address = self.sock.recvfrom(512)
+            except OSError:
+                break
+            nonce = decode_solicit(data)
+            if nonce is None:
+                continue
+            offer = encode_offer(nonce, self.ip, self.port, self.free_ports(), self.load(), self.version)
+            try:
+                self.sock.sendto(offer, address)
+                self.answered += 1
+            except OSError as e:
+                self.log(f"Discovery: could not answer {address[0]}: {e}")
+
+    def start(self):
+        self.open()
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
@@ -1,66 +1,124 @@
-import os
+import atexit
 import sys
 import subprocess
-import zipfile
-import tempfile
-import requests
+import threading
+import time
 from datetime import datetime
-from logger import setup_logger
+from logger import setup_logger_from_config
 from network_utils import get_local_ip
+from server_pool import ServerPool
+from admission import AdmissionQueue, AdmissionServer, ADMISSION_PORT, parse_weights
+from provisioning import provision_iperf, ProvisioningError
+from native_engine import NATIVE_VERSION
+from host_stats import HostSampler, parse_cpu_list, host_sampling_supported
+import tracing
+from tracing import traced
 
 class IperfServer:
     def __init__(self, config):
         self.config = config
         self.log_file = self.config['settings']['log_file']
-        self.logger = setup_logger(self.log_file)
+        self.logger = setup_logger_from_config(self.config['settings'], 'IperfServer')
+        self.trace_file = self.config['settings'].get('trace_file', fallback='').strip()
+        if self.trace_file:
+            # A server runs for weeks: only the latest spans are kept, and the trace is rewritten
+            # every trace_interval seconds so it survives a service that is killed
+            tracing.enable(self.config['settings'].getint('trace_max_events', fallback=100000))
+            atexit.register(self.write_trace)
+            interval = self.config['settings'].getfloat('trace_interval', fallback=300)
+            if interval > 0:
+                threading.Thread(target=self._write_trace_every, args=(interval,), name="trace-writer",
+                                 daemon=True).start()
         
-        self.temp_dir = tempfile.gettempdir()
-        self.tools_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools")
         self.port = int(self.config['settings']['port'])
+        self.pool_size = self.config['settings'].getint('pool_size', fallback=1)
+        self.pin_cpus = self.config['settings'].getboolean('pin_cpus', fallback=True)
+        self.cpu_cores = parse_cpu_list(self.config['settings'].get('cpu_cores', fallback=''))
         self.server_ip = get_local_ip()
         self.iperf_path = self.setup_iperf()
+        # Without an iperf3 the pool serves tests on the built-in engine, see native_engine.py
+        self.engine = "iperf3" if self.iperf_path else "native"
         self.firewall_rule_name = "iperf3"
+        # A single server is a pool of one, so both modes share the same supervision
+        self.pool = ServerPool(
+            self.iperf_path, self.port, max(self.pool_size, 1),
+            log=self.log, debug=self.logger.debug,
+            # A single server is only pinned when cores were chosen explicitly
+            pin_cpus=self.pin_cpus and (self.pool_size > 1 or bool(self.cpu_cores)),
+            cores=self.cpu_cores, host_sampler=self.host_sampler, engine=self.engine
+        )
+        self.admission = None
+        if self.config['settings'].getboolean('admission', fallback=True):
+            settings = self.config['settings']
+            queue = AdmissionQueue(
+                self.pool.allocator,
+                policy=settings.get('admission_policy', fallback='fifo'),
+                weights=parse_weights(settings.get('admission_weights', fallback='')),
+                expiry=settings.getfloat('admission_expiry', fallback=30.0),
+                log=self.log
+            )
+            self.admission = AdmissionServer(queue, settings.getint('admission_port', fallback=ADMISSION_PORT),
+                                             log=self.log)
 
     def log(self, message):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         log_message = f"[{timestamp}] {message}"
         self.logger.info(log_message)
 
-    def setup_iperf(self):
-        iperf_path = self.config['settings']['iperf_path']
-        cygwin_dll_path = self.config['settings']['cygwin_dll_path']
-
-        os.makedirs(self.tools_dir, exist_ok=True)
+    def host_sampler(self, cores):
+        settings = self.config['settings']
+        if not settings.getboolean('host_sampling', fallback=True) or not host_sampling_supported():
+            return None
+        return HostSampler(
+            cores,
+            interval=settings.getfloat('host_sample_interval', fallback=1.0),
+            cpu_threshold=settings.getfloat('cpu_bound_threshold', fallback=90.0),
+            nic_threshold=settings.getfloat('nic_bound_threshold', fallback=90.0),
+        ).start()
 
-        if not os.path.exists(iperf_path) or not os.path.exists(cygwin_dll_path):
-            try:
-                self.log("Downloading iperf3...")
-                url = self.config['settings']['iperf_url']
-                response = requests.get(url)
-                
-                zip_path = os.path.join(self.temp_dir, "iperf.zip")
-                with open(zip_path, "wb") as f:
-                    f.write(response.content)
-                
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(self.tools_dir)
-                
-                os.remove(zip_path)
-                self.log(f"iperf3 and cygwin1.dll downloaded and extracted to {self.tools_dir}")
-            except Exception as e:
-                self.log(f"Error downloading iperf3: {e}")
-                sys.exit(1)
+    def write_trace(self, final=True):
+        tracer = tracing.active()
+        if tracer is None or not tracer.events:
+            return
+        try:
+            tracer.write_chrome_trace(self.trace_file)
+            if final:
+                self.log(f"Trace written to {self.trace_file}")
+        except OSError as e:
+            self.log(f"Could not write trace to {self.trace_file}: {e}")
+        if final:
+            for line in tracer.describe().splitlines():
+                self.log(f"Trace: {line}")
 
-        if not os.path.exists(iperf_path):
-            self.log(f"Error: iperf3.exe not found at {iperf_path}")
-            sys.exit(1)
+    def _write_trace_every(self, interval):
+        while True:
+            time.sleep(interval)
+            self.write_trace(final=False)
 
-        if not os.path.exists(cygwin_dll_path):
-            self.log(f"Error: cygwin1.dll not found at {cygwin_dll_path}")
+    @traced()
+    def setup_iperf(self):
+        settings = self.config['settings']
+        engine = settings.get('engine', fallback='auto').strip().lower()
+        if engine == 'native':
+            self.log("Using the native Python engine instead of iperf3")
+            return None
+        try:
+            return provision_iperf(
+                settings.get('iperf_path'),
+                url=settings.get('iperf_url'),
+                sha256=settings.get('iperf_sha256', fallback='').strip() or None,
+                cache_dir=settings.get('tool_cache', fallback='').strip() or None,
+                use_system=settings.getboolean('use_system_iperf', fallback=True),
+                allow_unverified=settings.getboolean('allow_unverified_download', fallback=False),
+                log=self.log
+            )
+        except (ProvisioningError, OSError) as e:
+            if engine == 'auto':
+                self.log(f"iperf3 is not available ({e}), using the native Python engine")
+                return None
+            self.log(f"Error setting up iperf3: {e}")
             sys.exit(1)
 
-        return iperf_path
-
     def add_firewall_rule(self):
         self.log("Checking if firewall rule exists...")
         check_command = 'netsh advfirewall firewall show rule name="iperf3"'
@@ -68,7 +126,10 @@ class IperfServer:
             check_process = subprocess.run(check_command, shell=True, capture_output=True, text=True)
             if "No rules match" in check_process.stdout:
                 self.log(f"Firewall rule '{self.firewall_rule_name}' not found. Adding it...")
-                add_command = 'netsh advfirewall firewall add rule name="iperf3" dir=in action=allow protocol=TCP localport=5201'
+                local_ports = str(self.port) if self.pool_size <= 1 else f"{self.port}-{self.port + self.pool_size - 1}"
+                if self.admission is not None:
+                    local_ports += f",{self.admission.port}"
+                add_command = f'netsh advfirewall firewall add rule name="iperf3" dir=in action=allow protocol=TCP localport={local_ports}'
                 subprocess.run(add_command, shell=True, check=True)
                 self.log(f"Firewall rule '{self.firewall_rule_name}' added successfully.")
             else:
@@ -77,24 +138,43 @@ class IperfServer:
             self.log(f"Error managing firewall rule: {e}")
             sys.exit(1)
 
+    def free_ports(self):
+        return self.pool.free_ports()
+
+    def load(self):
+        return self.pool.load()
+
+    def iperf_version(self):
+        if self.engine == "native":
+            return f"native {NATIVE_VERSION}"
+        try:
+            output = subprocess.run([self.iperf_path, "--version"], capture_output=True, text=True, timeout=10).stdout
+            return output.split()[1] if output.startswith("iperf") else ""
+        except Exception as e:
+            self.log(f"Could not determine iperf3 version: {e}")
+            return ""
+
     def run(self):
         self.add_firewall_rule()
-        self.log(f"Starting iperf3 server on {self.server_ip}:{self.port}")
-        while True:
+        if self.pool_size > 1:
+            self.log(f"Starting pool of {self.pool_size} iperf3 servers on {self.server_ip}:{self.port}-{self.port + self.pool_size - 1}")
+        else:
+            self.log(f"Starting iperf3 server on {self.server_ip}:{self.port}")
+        if self.admission is not None:
             try:
-                process = subprocess.Popen([self.iperf_path, "-s", "-p", str(self.port)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                while True:
-                    output, error = process.communicate()
-                    if error:
-                        self.log(f"Server error: {error}")
-                    if "iperf Done." in output:
-                        self.log("Test completed successfully. Creating new connection...")
-                        break
-                self.log("Restarting iperf3 server...")
-            except KeyboardInterrupt:
-                self.log("Server stopping due to KeyboardInterrupt...")
-                process.terminate()
-                break
-            except Exception as e:
-                self.log(f"Error running server: {e}")
-                sys.exit(1)
\ No newline at end of file
+                self.admission.start()
+            except OSError as e:
+                self.log(f"Could not start the admission queue, clients will race for ports: {e}")
+                self.admission = None
+        try:
+            self.pool.run()
+        except KeyboardInterrupt:
+            self.log("Server stopping due to KeyboardInterrupt...")
+        except Exception as e:
+            self.log(f"Error running server: {e}")
+            self.pool.stop()
+            sys.exit(1)
+        if self.admission is not None:
+            self.log(f"Admission queue: {self.admission.queue.describe()}")
+            self.admission.close()
+        self.log(f"Server stopped after {self.pool.tests_completed()} tests")
@@ -1,23 +1,194 @@
+import atexit
+import gzip
 import logging
+import os
+import queue
+import shutil
+import threading
+import time
 
-def setup_logger(log_file):
-    logger = logging.getLogger('IperfServer')
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class BatchFileWriter(threading.Thread):
+    """
+    Owns one log file. Callers only put lines on a queue; this thread writes them in
+    batches, rotates the file by size and age and optionally gzips rotated files, so
+    logging never waits on disk I/O.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5, rotate_interval=0,
+                 compress=False, batch_size=512, flush_interval=0.5):
+        super().__init__(name=f"log-writer:{os.path.basename(path)}", daemon=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self._closed = threading.Event()
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+        self.start()
+
+    def write(self, text):
+        self.queue.put(text)
+
+    def _open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        self._opened_at = time.time()
+
+    def _backup_name(self, index):
+        return f"{self.path}.{index}.gz" if self.compress else f"{self.path}.{index}"
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = self._backup_name(index)
+                if os.path.exists(source):
+                    os.replace(source, self._backup_name(index + 1))
+            if self.compress:
+                with open(self.path, "rb") as source, gzip.open(self._backup_name(1), "wb") as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self._backup_name(1))
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _should_rotate(self, incoming):
+        if self._size == 0:
+            return False
+        if self.max_bytes and self._size + incoming > self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        self._open()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._closed.is_set():
+                    break
+                continue
+            batch = self._drain(item)
+            stop = None in batch
+            text = "".join(line for line in batch if line is not None)
+            if text:
+                try:
+                    data_size = len(text.encode("utf-8"))
+                    if self._should_rotate(data_size):
+                        self._rotate()
+                    self._file.write(text)
+                    self._file.flush()
+                    self._size += data_size
+                except OSError:
+                    pass
+            if stop:
+                break
+        self._file.close()
+
+    def close(self, timeout=5):
+        if not self._closed.is_set():
+            self._closed.set()
+            self.queue.put(None)
+            self.join(timeout)
+
+
+class BatchFileHandler(logging.Handler):
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        try:
+            self.writer.write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+def get_writer(path, **options):
+    """Returns the single writer for `path`, so every logger of the process shares it."""
+    key = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None or not writer.is_alive():
+            writer = BatchFileWriter(path, **options)
+            _writers[key] = writer
+        return writer
+
+
+def close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_writers)
+
+
+def setup_logger(log_file, name='IperfServer', max_bytes=10 * 1024 * 1024, backup_count=5,
+                 rotate_interval=0, compress=False):
+    logger = logging.getLogger(name)
+    # Calling setup_logger again must not stack another set of handlers
+    if getattr(logger, 'log_file', None) == log_file and logger.handlers:
+        return logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
     logger.setLevel(logging.DEBUG)
-    
+    logger.propagate = False
+    logger.log_file = log_file
+
     # File Handler
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    writer = get_writer(log_file, max_bytes=max_bytes, backup_count=backup_count,
+                        rotate_interval=rotate_interval, compress=compress)
+    file_handler = BatchFileHandler(writer)
     file_handler.setLevel(logging.DEBUG)
-    
+
     # Console Handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    
+
     # Formatter
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    formatter = logging.Formatter(LOG_FORMAT)
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
-    
+
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+
+    return logger
+
+
+def setup_logger_from_config(settings, name='IperfServer'):
+    return setup_logger(
+        settings['log_file'],
+        name=name,
+        max_bytes=settings.getint('log_max_bytes', fallback=10 * 1024 * 1024),
+        backup_count=settings.getint('log_backup_count', fallback=5),
+        rotate_interval=settings.getint('log_rotate_interval', fallback=0),
+        compress=settings.getboolean('log_compress', fallback=False),
+    )
@@ -4,6 +4,7 @@ import os
 import sys
 from iperf_server import IperfServer
 from network_utils import broadcast_server, check_network
+from discovery import DiscoveryResponder, DISCOVERY_PORT
 
 def load_config(config_file='config.ini'):
     config = configparser.ConfigParser()
@@ -27,7 +28,17 @@ if __name__ == "__main__":
         multicast_group = config['settings']['multicast_group']
         multicast_interval = int(config['settings']['multicast_interval'])
         
-        threading.Thread(target=broadcast_server, args=(server.server_ip, server.port, multicast_group, multicast_interval), daemon=True).start()
+        # Clients solicit and get an answer at once, the periodic announcement is only a fallback
+        responder = DiscoveryResponder(
+            server.server_ip, server.port, server.free_ports, server.load, server.iperf_version(),
+            multicast_group=multicast_group,
+            discovery_port=config['settings'].getint('discovery_port', fallback=DISCOVERY_PORT),
+            log=server.log
+        )
+        responder.start()
+
+        free_ports = server.free_ports if server.pool_size > 1 else None
+        threading.Thread(target=broadcast_server, args=(server.server_ip, server.port, multicast_group, multicast_interval, free_ports), daemon=True).start()
         
         server.run()
     else:
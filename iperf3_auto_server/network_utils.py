@@ -21,10 +21,13 @@ def check_network():
     except OSError:
         return False
 
-def broadcast_server(ip, port, multicast_group="224.0.0.1", interval=5):
+def broadcast_server(ip, port, multicast_group="224.0.0.1", interval=5, free_ports=None):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-    message = f"iperf3_server:{ip}:{port}".encode()
     while True:
-        sock.sendto(message, (multicast_group, port))
+        message = f"iperf3_server:{ip}:{port}"
+        if free_ports is not None:
+            # Pooled servers append the ports of the instances that are currently idle
+            message += ":" + ",".join(str(p) for p in free_ports())
+        sock.sendto(message.encode(), (multicast_group, port))
         time.sleep(interval)
\ No newline at end of file
@@ -0,0 +1,344 @@
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import urllib.error
+import urllib.request
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+IPERF_NAMES = ("iperf3.exe", "iperf3")
+# The Windows build is linked against cygwin and needs its DLL next to the executable
+WINDOWS_COMPANIONS = ("cygwin1.dll",)
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+def default_cache_dir():
+    """One cache per user, so the client and server on a machine share their tools."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or tempfile.gettempdir()
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "iperf3_auto")
+
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_validator(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def download(url, path, sha256=None, timeout=30, chunk_size=CHUNK_SIZE, log=print):
+    """
+    Streams `url` to `path` in chunks. An interrupted download is left in path + '.part'
+    and resumed with a Range request next time, guarded by If-Range with the ETag or
+    Last-Modified of the first attempt so a changed file starts over instead of being
+    appended to. The SHA-256 is updated as bytes arrive and checked before the file is
+    moved into place. Returns the hex digest.
+    """
+    part = path + ".part"
+    validator_path = part + ".validator"
+    digest = hashlib.sha256()
+    offset = 0
+    validator = _read_validator(validator_path)
+    if os.path.exists(part) and validator is None and not sha256:
+        # Nothing would tell a changed file from the one the part file came from
+        log(f"Cannot resume {url} safely without an ETag or Last-Modified, downloading it again")
+        _remove(part)
+    if os.path.exists(part):
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+                offset += len(chunk)
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if validator:
+            headers["If-Range"] = validator
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise ProvisioningError(f"Download of {url} failed: HTTP {e.code}") from e
+        # Range not satisfiable: the part file already holds the whole archive
+        response = None
+    except (urllib.error.URLError, OSError) as e:
+        raise ProvisioningError(f"Download of {url} failed: {e}") from e
+
+    if response is not None:
+        with response:
+            if offset and response.status != 206:
+                log(f"Server ignored the resume request, downloading {url} again")
+                digest = hashlib.sha256()
+                offset = 0
+            elif offset:
+                log(f"Resuming download of {url} at {offset} bytes")
+            if not offset:
+                # Weak ETags are not allowed in If-Range
+                etag = response.headers.get("ETag")
+                validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+                if validator:
+                    with open(validator_path, "w") as f:
+                        f.write(validator)
+                else:
+                    _remove(validator_path)
+            expected = response.headers.get("Content-Length")
+            received = 0
+            try:
+                with open(part, "ab" if offset else "wb") as f:
+                    for chunk in iter(lambda: response.read(chunk_size), b""):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        received += len(chunk)
+            except (OSError, http.client.HTTPException) as e:
+                raise ProvisioningError(f"Download of {url} interrupted, it will resume next time: {e}") from e
+            # A connection closed early looks like a normal end of the body
+            if expected is not None and received < int(expected):
+                raise ProvisioningError(f"Download of {url} interrupted after {offset + received} bytes, "
+                                        f"it will resume next time")
+
+    actual = digest.hexdigest()
+    if sha256 and actual != sha256.lower():
+        _remove(part, validator_path)
+        raise ProvisioningError(f"Checksum mismatch for {url}: expected {sha256.lower()}, got {actual}")
+    os.replace(part, path)
+    _remove(validator_path)
+    return actual
+
+
+def check_zip(path):
+    """Raises ProvisioningError unless `path` is a zip archive whose members all pass their CRC."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            bad = archive.testzip()
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ProvisioningError(f"{path} is not a zip file: {e}") from e
+    if bad is not None:
+        raise ProvisioningError(f"{path} is corrupt: bad CRC for {bad}")
+
+
+def find_tool(directory, names=IPERF_NAMES):
+    for root, _, files in os.walk(directory):
+        for name in names:
+            if name in files:
+                return os.path.join(root, name)
+    return None
+
+
+def find_system_iperf():
+    # On Windows only the bundled cygwin build is trusted, elsewhere the distribution's iperf3 is preferred
+    if os.name == "nt":
+        return None
+    return shutil.which("iperf3")
+
+
+class ToolCache:
+    """
+    Content-addressed store for tool archives and what they unpack to. An archive is kept
+    as blobs/<sha256> and extracted once to tools/<sha256>/, whichever program needs it
+    first; a blob only gets its name after its checksum was verified and it was read as a
+    zip archive. Downloads without a pinned checksum are remembered by URL in urls.json.
+    """
+
+    def __init__(self, root=None, log=print, timeout=30):
+        self.root = root or default_cache_dir()
+        self.log = log
+        self.timeout = timeout
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest)
+
+    def tools_path(self, digest):
+        return os.path.join(self.root, "tools", digest)
+
+    def _index_path(self):
+        return os.path.join(self.root, "urls.json")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        temp_path = self._index_path() + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(temp_path, self._index_path())
+
+    def _remember(self, url, digest):
+        index = self._load_index()
+        index[url] = digest
+        self._save_index(index)
+
+    def forget(self, url, digest):
+        """Drops a bad blob and the index entry that points to it, so the next fetch downloads again."""
+        _remove(self.blob_path(digest))
+        index = self._load_index()
+        if index.get(url) == digest:
+            del index[url]
+            self._save_index(index)
+
+    def fetch(self, url, sha256=None):
+        """Returns the digest of the archive at `url`, downloading it unless it is cached."""
+        digest = sha256.lower() if sha256 else self._load_index().get(url)
+        if digest and os.path.exists(self.blob_path(digest)):
+            return digest
+        downloads = os.path.join(self.root, "downloads")
+        os.makedirs(downloads, exist_ok=True)
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        # Named after the URL so an interrupted download of the same archive resumes
+        path = os.path.join(downloads, hashlib.sha256(url.encode("utf-8")).hexdigest())
+        self.log(f"Downloading {url}...")
+        digest = download(url, path, sha256, timeout=self.timeout, log=self.log)
+        try:
+            check_zip(path)
+        except ProvisioningError as e:
+            # e.g. a captive portal's page: not cached, so a later attempt downloads again
+            _remove(path)
+            raise ProvisioningError(f"Download of {url} is not a usable archive: {e}") from e
+        os.replace(path, self.blob_path(digest))
+        if not sha256:
+            self.log(f"No checksum configured for {url}; cached as sha256 {digest}")
+            self._remember(url, digest)
+        return digest
+
+    def extract(self, digest):
+        """Unpacks blob `digest` once and returns its directory."""
+        target = self.tools_path(digest)
+        if os.path.isdir(target):
+            return target
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".extract-", dir=os.path.dirname(target))
+        try:
+            with zipfile.ZipFile(self.blob_path(digest)) as archive:
+                for member in archive.namelist():
+                    destination = os.path.realpath(os.path.join(staging, member))
+                    if not destination.startswith(os.path.realpath(staging) + os.sep):
+                        raise ProvisioningError(f"Archive {digest} has an unsafe path: {member}")
+                archive.extractall(staging)
+            os.replace(staging, target)
+        except zipfile.BadZipFile as e:
+            raise ProvisioningError(f"Archive {digest} is not a zip file: {e}") from e
+        except OSError:
+            # Another process extracted the same archive first
+            if not os.path.isdir(target):
+                raise
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+        return target
+
+    def add_files(self, paths):
+        """Caches loose files (e.g. tools bundled into an executable) by their content; returns the directory."""
+        digest = hashlib.sha256()
+        for path in sorted(paths, key=os.path.basename):
+            digest.update(os.path.basename(path).encode("utf-8") + b"\0" + sha256_file(path).encode("ascii"))
+        target = self.tools_path(digest.hexdigest())
+        if os.path.isdir(target):
+            return target
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".copy-", dir=os.path.dirname(target))
+        try:
+            for path in paths:
+                shutil.copy2(path, staging)
+            os.replace(staging, target)
+        except OSError:
+            if not os.path.isdir(target):
+                raise
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+        return target
+
+    def provision(self, url, sha256=None):
+        digest = self.fetch(url, sha256)
+        try:
+            return self.extract(digest)
+        except ProvisioningError:
+            self.forget(url, digest)
+            raise
+
+
+def check_companions(iperf_path):
+    if os.name != "nt":
+        return
+    directory = os.path.dirname(os.path.abspath(iperf_path))
+    missing = [name for name in WINDOWS_COMPANIONS if not os.path.exists(os.path.join(directory, name))]
+    if missing:
+        raise ProvisioningError(f"{', '.join(missing)} not found next to {iperf_path}")
+
+
+def provision_iperf(configured_path=None, url=None, sha256=None, cache_dir=None, use_system=True,
+                    allow_unverified=False, log=print):
+    """
+    Returns the path of a usable iperf3: the configured one if it exists, then a system
+    iperf3 on PATH (not on Windows), then the cached download of `url`, fetched and
+    unpacked first when needed. A download is only trusted with a pinned `sha256`, unless
+    `allow_unverified` is set. Raises ProvisioningError when there is none.
+    """
+    if configured_path and os.path.exists(configured_path):
+        check_companions(configured_path)
+        return configured_path
+    if use_system:
+        system = find_system_iperf()
+        if system:
+            log(f"Using system iperf3 at {system}")
+            return system
+    if not url:
+        raise ProvisioningError(f"iperf3 not found at {configured_path} or on PATH, and no download URL is configured")
+    if not sha256 and not allow_unverified:
+        raise ProvisioningError(f"iperf3 not found at {configured_path} or on PATH, and no iperf_sha256 is configured "
+                                f"for {url}; pin it, or set allow_unverified_download = true")
+    cache = ToolCache(cache_dir, log=log)
+    directory = cache.provision(url, sha256)
+    path = find_tool(directory)
+    if path is None:
+        raise ProvisioningError(f"No iperf3 executable in the archive from {url}")
+    check_companions(path)
+    if os.name != "nt":
+        os.chmod(path, os.stat(path).st_mode | 0o111)
+    log(f"Using iperf3 from the tool cache at {path}")
+    return path
+
+
+def provision_bundled(names=("iperf3.exe", "cygwin1.dll"), cache_dir=None, use_system=True, log=print):
+    """For frozen builds: the tools bundled next to the program, copied once into the tool cache."""
+    if use_system:
+        system = find_system_iperf()
+        if system:
+            log(f"Using system iperf3 at {system}")
+            return system
+    bundle = os.path.join(getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(sys.argv[0]))), "tools")
+    paths = [os.path.join(bundle, name) for name in names]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise ProvisioningError(f"Bundled tools missing: {', '.join(missing)}")
+    directory = ToolCache(cache_dir, log=log).add_files(paths)
+    return os.path.join(directory, names[0])
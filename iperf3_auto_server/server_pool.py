@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from functools import partial
+from supervisor import ServerSupervisor, NativeSupervisor
+
+
+class PortAllocator:
+    """
+    Tracks which iperf3 instances of the pool are free. A port is unavailable while its
+    instance runs a test, while a lease handed out by acquire() has not expired yet, or
+    while the admission queue has reserved it for a client.
+    """
+
+    def __init__(self, ports, lease_timeout=10):
+        self.ports = list(ports)
+        self.lease_timeout = lease_timeout
+        self._busy = set()
+        self._leases = {}
+        self._reserved = set()
+        self._last_used = {port: 0.0 for port in self.ports}
+        self._lock = threading.Lock()
+        # Called whenever a port may have become free, e.g. to wake the admission queue
+        self.on_free = None
+
+    def _expire_leases(self, now):
+        for port, expiry in list(self._leases.items()):
+            if expiry <= now:
+                del self._leases[port]
+
+    def _free(self, now):
+        self._expire_leases(now)
+        free = [p for p in self.ports if p not in self._busy and p not in self._leases and p not in self._reserved]
+        # Least recently used first, so clients picking from the list spread over the pool
+        return sorted(free, key=lambda p: self._last_used[p])
+
+    def _notify(self):
+        if self.on_free is not None:
+            self.on_free()
+
+    def free_ports(self):
+        with self._lock:
+            return self._free(time.monotonic())
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            free = self._free(now)
+            if not free:
+                return None
+            port = free[0]
+            self._leases[port] = now + self.lease_timeout
+            self._last_used[port] = now
+            return port
+
+    def release(self, port):
+        with self._lock:
+            self._leases.pop(port, None)
+        self._notify()
+
+    def reserve(self, count=1):
+        """Takes `count` free ports out of circulation until unreserve(), or returns None."""
+        with self._lock:
+            now = time.monotonic()
+            free = self._free(now)
+            if len(free) < count:
+                return None
+            ports = free[:count]
+            for port in ports:
+                self._reserved.add(port)
+                self._last_used[port] = now
+            return ports
+
+    def unreserve(self, ports):
+        with self._lock:
+            self._reserved.difference_update(ports)
+        self._notify()
+
+    def mark_busy(self, port):
+        with self._lock:
+            self._leases.pop(port, None)
+            self._busy.add(port)
+            self._last_used[port] = time.monotonic()
+
+    def mark_idle(self, port):
+        with self._lock:
+            self._busy.discard(port)
+        self._notify()
+
+    def busy_count(self):
+        with self._lock:
+            return len(self._busy)
+
+
+class ServerPool:
+    def __init__(self, iperf_path, base_port, size, log=print, debug=None, pin_cpus=True, cores=None,
+                 host_sampler=None, engine="iperf3"):
+        self.allocator = PortAllocator(range(base_port, base_port + size))
+        # Instances take the chosen cores round-robin, or every core of the machine in turn
+        cores = list(cores or range(os.cpu_count() or 1))
+        self.log = log
+        # The native engine's servers are threads of this process rather than iperf3 processes
+        supervisor = NativeSupervisor if engine == "native" else partial(ServerSupervisor, iperf_path)
+        self.instances = [
+            supervisor(
+                port,
+                core=cores[index % len(cores)] if pin_cpus else None,
+                log=log, debug=debug,
+                on_busy=self.allocator.mark_busy,
+                on_idle=self.allocator.mark_idle,
+                host_sampler=host_sampler
+            )
+            for index, port in enumerate(self.allocator.ports)
+        ]
+        self._stop = threading.Event()
+
+    @property
+    def ports(self):
+        return self.allocator.ports
+
+    def free_ports(self):
+        return self.allocator.free_ports()
+
+    def load(self):
+        return self.allocator.busy_count() / len(self.instances)
+
+    def start(self):
+        for instance in self.instances:
+            instance.start()
+
+    def tests_completed(self):
+        return sum(instance.tests_completed for instance in self.instances)
+
+    def run(self, check_interval=0.5):
+        self.start()
+        try:
+            while not self._stop.wait(check_interval):
+                for instance in self.instances:
+                    instance.check()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        for instance in self.instances:
+            instance.stop()
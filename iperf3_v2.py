@@ -1,37 +1,34 @@
 import os
 import sys
+import errno
 import shutil
 import subprocess
 import socket
+import signal
+import struct
+import json
 from datetime import datetime
 import threading
 import time
 import ipaddress
-from concurrent.futures import ThreadPoolExecutor
-
+import itertools
+import random
+import asyncio
+from logger import get_writer
+from provisioning import provision_bundled, ProvisioningError
+from regression import RegressionDetector, EXIT_REGRESSION
+import tracing
+from tracing import traced
+
+@traced("setup_iperf")
 def ensure_tools_exist():
-    tools_dir = os.path.join(os.environ['TEMP'], "tools")
-    exe_path = os.path.join(tools_dir, "iperf3.exe")
-    dll_path = os.path.join(tools_dir, "cygwin1.dll")
-
-    if not os.path.exists(tools_dir):
-        os.makedirs(tools_dir)
-
-    if not os.path.exists(exe_path):
-        src_exe = os.path.join(sys._MEIPASS, "tools", "iperf3.exe")
-        print(f"[INFO] Extracting iperf3.exe to {exe_path}")
-        shutil.copy(src_exe, exe_path)
-
-    if not os.path.exists(dll_path):
-        src_dll = os.path.join(sys._MEIPASS, "tools", "cygwin1.dll")
-        print(f"[INFO] Extracting cygwin1.dll to {dll_path}")
-        shutil.copy(src_dll, dll_path)
-
-    if os.path.exists(exe_path) and os.path.exists(dll_path):
-        print(f"[INFO] Tools extracted successfully to {tools_dir}")
-    else:
-        print(f"[ERROR] Tools extraction failed. Check permissions or source files.")
-
+    # A system iperf3 on Linux, otherwise the bundled tools, copied once into the shared tool cache
+    try:
+        exe_path = provision_bundled(log=lambda message: print(f"[INFO] {message}"))
+    except (ProvisioningError, OSError) as e:
+        print(f"[ERROR] Tools extraction failed: {e}")
+        return None
+    print(f"[INFO] Using iperf3 at {exe_path}")
     return exe_path
 
 def ensure_firewall_rule_exists():
@@ -40,6 +37,7 @@ def ensure_firewall_rule_exists():
     rule_command_add_tcp = f'netsh advfirewall firewall add rule name="{rule_name}" dir=in action=allow protocol=TCP localport=5201'
     rule_command_add_udp = f'netsh advfirewall firewall add rule name="{rule_name}" dir=in action=allow protocol=UDP localport=5201'
     rule_command_add_broadcast = f'netsh advfirewall firewall add rule name="{rule_name}_broadcast" dir=in action=allow protocol=UDP localport=50000'
+    rule_command_add_discovery = f'netsh advfirewall firewall add rule name="{rule_name}_discovery" dir=in action=allow protocol=UDP localport={DISCOVERY_PORT}'
 
     try:
         result = subprocess.run(rule_command_check, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -50,17 +48,37 @@ def ensure_firewall_rule_exists():
             subprocess.run(rule_command_add_udp, shell=True)
             print("[INFO] Adding firewall rule for UDP broadcast port 50000")
             subprocess.run(rule_command_add_broadcast, shell=True)
+            print(f"[INFO] Adding firewall rule for UDP discovery port {DISCOVERY_PORT}")
+            subprocess.run(rule_command_add_discovery, shell=True)
         else:
             print("[INFO] Firewall rule already exists.")
     except Exception as e:
         print(f"[ERROR] Could not ensure firewall rule: {e}")
 
+# Log files rotate at 10 MB (5 gzipped backups) so long-running servers stay bounded
+LOG_OPTIONS = {"max_bytes": 10 * 1024 * 1024, "backup_count": 5, "compress": True}
+
 def log(message, log_file):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     msg = f"[{timestamp}] {message}"
     print(msg)
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(msg + "\n")
+    # Queued for the log file's background writer, no file I/O on the caller's thread
+    get_writer(log_file, **LOG_OPTIONS).write(msg + "\n")
+
+# Set IPERF3_TRACE to a file name to get a Chrome trace (chrome://tracing) of every phase
+TRACE_FILE = os.environ.get("IPERF3_TRACE")
+
+def write_trace(log_file):
+    tracer = tracing.active()
+    if tracer is None or not tracer.events:
+        return
+    try:
+        tracer.write_chrome_trace(TRACE_FILE)
+        log(f"Trace written to {TRACE_FILE}", log_file)
+    except OSError as e:
+        log(f"Could not write trace to {TRACE_FILE}: {e}", log_file)
+    for line in tracer.describe().splitlines():
+        log(f"Trace: {line}", log_file)
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -85,44 +103,213 @@ def start_broadcast(server_ip, port, log_file):
                 try:
                     sock.sendto(msg, (addr, udp_port))
                     log(f"Broadcasting server info: {msg.decode()}", log_file)
-                    time.sleep(1)  # Reduced delay to increase broadcast frequency
+                    time.sleep(5)  # Low-rate fallback, clients solicit and get an answer at once
                 except Exception as e:
                     log(f"Broadcast error: {e}", log_file)
                     break
 
     threading.Thread(target=broadcast, daemon=True).start()
 
-def scan_ip(ip, port):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(0.5)
-            result = sock.connect_ex((str(ip), port))
-            if result == 0:
-                return str(ip)
-    except Exception:
-        pass
-    return None
+DISCOVERY_PORT = 50001
+DISCOVERY_MAGIC = b"IPF3"
+DISCOVERY_HEADER = struct.Struct("!4sBBI")
 
-def scan_subnet_for_server(subnet, port, log_file):
-    log(f"Scanning subnet {subnet} for server...", log_file)
-    found_ip = None
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_ip = {executor.submit(scan_ip, ip, port): ip for ip in ipaddress.IPv4Network(subnet, strict=False)}
-        for future in future_to_ip:
-            ip = future_to_ip[future]
+def start_discovery_responder(server_ip, port, log_file):
+    # Same wire format as iperf3_auto_server/discovery.py: answer each solicit with an offer
+    # carrying our address, port, load (unknown here, so 0), the free port list and no version
+    def respond():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('', DISCOVERY_PORT))
             try:
-                result = future.result()
-                if result:
-                    found_ip = result
+                group = socket.inet_aton("224.0.0.1") + socket.inet_aton("0.0.0.0")
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group)
+            except OSError:
+                pass
+            while True:
+                try:
+                    data, addr = sock.recvfrom(512)
+                    if len(data) < DISCOVERY_HEADER.size:
+                        continue
+                    magic, message_type, _, nonce = DISCOVERY_HEADER.unpack_from(data)
+                    if magic != DISCOVERY_MAGIC or message_type != 1:
+                        continue
+                    offer = DISCOVERY_HEADER.pack(DISCOVERY_MAGIC, 2, 1, nonce) + struct.pack(
+                        "!4sHBBHB", socket.inet_aton(server_ip), port, 0, 1, port, 0)
+                    sock.sendto(offer, addr)
+                except Exception as e:
+                    log(f"Discovery responder error: {e}", log_file)
                     break
-            except Exception as e:
-                log(f"Error scanning IP {ip}: {e}", log_file)
+
+    threading.Thread(target=respond, daemon=True).start()
+
+def solicit_offers(targets=("224.0.0.1", "<broadcast>"), timeout=0.5, first=True):
+    # Yields (ip, port, load, elapsed) for every offer until the timeout, or only the first one
+    nonce = random.getrandbits(32)
+    solicit = DISCOVERY_HEADER.pack(DISCOVERY_MAGIC, 1, 1, nonce)
+    started = time.monotonic()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        for destination in targets:
+            try:
+                sock.sendto(solicit, (destination, DISCOVERY_PORT))
+            except OSError:
+                pass
+        while True:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                return
+            sock.settimeout(remaining)
+            try:
+                data, addr = sock.recvfrom(2048)
+                magic, message_type, _, reply_nonce = DISCOVERY_HEADER.unpack_from(data)
+                if magic != DISCOVERY_MAGIC or message_type != 2 or reply_nonce != nonce:
+                    continue
+                ip, port, load, port_count = struct.unpack_from("!4sHBB", data, DISCOVERY_HEADER.size)
+                free_ports = struct.unpack_from(f"!{port_count}H", data, DISCOVERY_HEADER.size + 8)
+            except socket.timeout:
+                return
+            except (OSError, struct.error):
+                continue
+            yield socket.inet_ntoa(ip), free_ports[0] if free_ports else port, load, time.monotonic() - started
+            if first:
+                return
+
+@traced()
+def solicit_server(log_file, timeout=0.5):
+    for server_ip, server_port, load, elapsed in solicit_offers(timeout=timeout):
+        log(f"Server {server_ip}:{server_port} answered discovery in {elapsed * 1000:.1f} ms (load {load}%)",
+            log_file)
+        return server_ip, server_port
+    return None, None
+
+IPERF_COOKIE_CHARS = "abcdefghijklmnopqrstuvwxyz234567"
+IPERF_COOKIE_SIZE = 37
+IPERF_PARAM_EXCHANGE = 9
+IPERF_ACCESS_DENIED = 0xFF
+
+def get_local_subnets(prefix=24):
+    addresses = {get_local_ip()}
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            addresses.add(info[4][0])
+    except OSError:
+        pass
+    subnets = []
+    for address in sorted(addresses):
+        if address.startswith("127."):
+            continue
+        subnet = str(ipaddress.IPv4Network(f"{address}/{prefix}", strict=False))
+        if subnet not in subnets:
+            subnets.append(subnet)
+    return subnets
+
+async def probe_iperf_server(ip, port, timeout=0.3):
+    # Send an iperf3 control cookie and expect the server state byte back: PARAM_EXCHANGE
+    # when it is idle, ACCESS_DENIED when it is busy. Any other open port is not an iperf3 server.
+    # On an idle server this opens a real control session that ends with an error in its log,
+    # so it is the last resort after the discovery responder
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(str(ip), port), timeout)
+        cookie = "".join(random.choice(IPERF_COOKIE_CHARS) for _ in range(IPERF_COOKIE_SIZE - 1))
+        writer.write(cookie.encode("ascii") + b"\0")
+        state = await asyncio.wait_for(reader.read(1), timeout)
+        return len(state) == 1 and state[0] in (IPERF_PARAM_EXCHANGE, IPERF_ACCESS_DENIED)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        if writer is not None:
+            writer.close()
+
+async def scan_hosts_for_server(hosts, port, concurrency=256, timeout=0.3):
+    hosts = iter(hosts)
+
+    async def worker():
+        # Workers share one iterator, so at most `concurrency` probes are in flight
+        for ip in hosts:
+            if await probe_iperf_server(ip, port, timeout):
+                return str(ip)
+        return None
+
+    tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            found_ip = await next_done
+            if found_ip:
+                return found_ip
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+@traced()
+def scan_subnet_for_server(subnet, port, log_file, concurrency=256, timeout=0.3):
+    subnets = [subnet] if isinstance(subnet, str) else list(subnet)
+    log(f"Scanning {', '.join(subnets)} for server...", log_file)
+    hosts = itertools.chain.from_iterable(ipaddress.IPv4Network(s, strict=False).hosts() for s in subnets)
+    started = time.monotonic()
+    try:
+        found_ip = asyncio.run(scan_hosts_for_server(hosts, port, concurrency, timeout))
+    except Exception as e:
+        log(f"Error scanning {', '.join(subnets)}: {e}", log_file)
+        found_ip = None
+    elapsed = time.monotonic() - started
     if found_ip:
-        log(f"Found server at {found_ip}:{port}", log_file)
+        log(f"Found server at {found_ip}:{port} in {elapsed:.2f}s", log_file)
         return found_ip, port
-    log(f"No server found in subnet {subnet}", log_file)
+    log(f"No server found in {', '.join(subnets)} ({elapsed:.2f}s)", log_file)
     return None, None
 
+SERVER_CACHE_TTL = 86400
+SERVER_CACHE_MAX_ENTRIES = 16
+
+def load_server_cache(cache_path, ttl=SERVER_CACHE_TTL):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {ip: entry for ip, entry in entries.items() if now - entry.get("last_seen", 0) < ttl}
+
+def remember_server(cache_path, server_ip, server_port):
+    entries = load_server_cache(cache_path)
+    entries[server_ip] = {"port": server_port, "last_seen": time.time()}
+    newest = sorted(entries.items(), key=lambda item: item[1]["last_seen"], reverse=True)
+    try:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(dict(newest[:SERVER_CACHE_MAX_ENTRIES]), f, indent=2)
+    except OSError:
+        pass
+
+@traced()
+def find_cached_server(cache_path, log_file, timeout=0.3):
+    # Ask every cached server at once and take the most recently used one that answers: first
+    # its discovery responder, then an iperf3 handshake for the ones that have none
+    entries = sorted(load_server_cache(cache_path).items(), key=lambda item: item[1]["last_seen"], reverse=True)
+    if not entries:
+        return None, None
+
+    answered = {ip: port for ip, port, _, _ in solicit_offers([ip for ip, _ in entries], timeout, first=False)}
+    for ip, entry in entries:
+        if ip in answered:
+            log(f"Using cached server {ip}:{answered[ip]}", log_file)
+            return ip, answered[ip]
+
+    async def probe_all():
+        return await asyncio.gather(*(probe_iperf_server(ip, entry["port"], timeout) for ip, entry in entries))
+
+    for (ip, entry), alive in zip(entries, asyncio.run(probe_all())):
+        if alive:
+            log(f"Using cached server {ip}:{entry['port']}", log_file)
+            return ip, entry["port"]
+    log("No cached server is reachable, running full discovery", log_file)
+    return None, None
+
+@traced()
 def listen_for_broadcast(log_file, timeout=30):
     udp_port = 50000
     log("Listening for server broadcasts...", log_file)
@@ -151,36 +338,441 @@ def animated_indicator(message, stop_event):
     sys.stdout.write(f"\r{message} Done ✅\n")
     sys.stdout.flush()
 
-def perform_network_diagnostics(target_ip, log_file):
-    def log_diagnostic(message):
-        log(message, log_file)
+# Linux socket options the socket module does not export, used by the socket-based probes
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2
+IP_RECVERR = 11
+IP_MTU = 14
+SOCK_EXTENDED_ERR = struct.Struct("=IBBBBII")
+IPV4_MIN_MTU = 68
+IPV4_MAX_MTU = 65535
+ETHERNET_MTU = 1500
+WINDOWS_PING_MAX_PAYLOAD = 65500
+ICMP_HEADERS = 28  # IPv4 + ICMP/UDP header bytes on top of the ping/datagram payload
+TRACE_BASE_PORT = 33434
+# Latency and MTU probes aim here, where nothing listens, never at the iperf3 server's port:
+# a refused connection or port unreachable still answers, without starting an iperf3 session
+PROBE_PORT = TRACE_BASE_PORT
+
+def use_socket_probes(tool, method):
+    # "auto" prefers the native tools and falls back to sockets, which only work on Linux
+    sockets_available = sys.platform.startswith("linux")
+    if method == "sockets":
+        return sockets_available
+    return method == "auto" and sockets_available and shutil.which(tool) is None
+
+async def run_tool(cmd, timeout):
+    # Returns (exit code, output), or None when the tool is missing or hangs
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError:
+        return None
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+    return proc.returncode, output.decode("utf-8", "replace")
+
+def parse_ping_times(output):
+    # Linux "time=0.045 ms", Windows "time=1ms" / "time<1ms" -> [0.045, 1.0, 1.0]
+    times = []
+    for line in output.splitlines():
+        tokens = line.replace("time<", "time=").split()
+        for i, token in enumerate(tokens):
+            if not token.startswith("time="):
+                continue
+            value = token[5:].rstrip("ms") or (tokens[i + 1] if i + 1 < len(tokens) else "")
+            try:
+                times.append(float(value))
+            except ValueError:
+                pass
+    return times
+
+def parse_trace_line(line):
+    # tracepath " 2:  10.0.0.1   0.412ms" / tracert "  2    <1 ms    1 ms    <1 ms  10.0.0.1"
+    # -> {"ttl": 2, "address": "10.0.0.1", "rtt_ms": 0.412}, or None for other lines
+    tokens = line.replace("<", "").split()
+    if not tokens or "?" in tokens[0]:
+        return None
+    try:
+        ttl = int(tokens[0].rstrip(":"))
+    except ValueError:
+        return None
+    address, rtts = None, []
+    for i, token in enumerate(tokens[1:], 1):
+        try:
+            ipaddress.ip_address(token)
+            address = address or token
+            continue
+        except ValueError:
+            pass
+        number = token[:-2] if token.endswith("ms") else token
+        if token.endswith("ms") or (i + 1 < len(tokens) and tokens[i + 1] == "ms"):
+            try:
+                rtts.append(float(number))
+            except ValueError:
+                pass
+    return {"ttl": ttl, "address": address, "rtt_ms": min(rtts) if rtts else None}
 
-    ping_result = subprocess.run(['ping', '-n', '4', target_ip], capture_output=True, text=True)
-    log_diagnostic(f"Ping results:\n{ping_result.stdout}")
+def read_socket_error(sock):
+    # One queued ICMP error (IP_RECVERR) -> (errno, ICMP info, offender address)
+    try:
+        _, ancdata, _, _ = sock.recvmsg(512, 512, socket.MSG_ERRQUEUE)
+    except (BlockingIOError, InterruptedError):
+        return None
+    for level, kind, data in ancdata:
+        if level != socket.IPPROTO_IP or kind != IP_RECVERR or len(data) < SOCK_EXTENDED_ERR.size:
+            continue
+        error_number, origin, icmp_type, icmp_code, _, info, _ = SOCK_EXTENDED_ERR.unpack_from(data)
+        offender = data[SOCK_EXTENDED_ERR.size:]
+        address = socket.inet_ntoa(offender[4:8]) if len(offender) >= 8 else None
+        return error_number, info, address
+    return None
 
-    tracert_result = subprocess.run(['tracert', '-d', '-h', '15', target_ip], capture_output=True, text=True)
-    log_diagnostic(f"Route trace:\n{tracert_result.stdout}")
+async def wait_for_socket_error(sock, timeout):
+    # The event loop reports a queued socket error as readable
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(sock.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await asyncio.wait_for(ready, timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        loop.remove_reader(sock.fileno())
+    return read_socket_error(sock)
+
+def open_probe_socket(target_ip, port, ttl=None, dont_fragment=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+    if ttl is not None:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+    if dont_fragment:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    sock.connect((target_ip, port))
+    return sock
+
+async def measure_latency(target_ip, port=PROBE_PORT, count=4, timeout=1.0, method="auto"):
+    if not use_socket_probes("ping", method):
+        if sys.platform == "win32":
+            cmd = ["ping", "-n", str(count), "-w", str(int(timeout * 1000)), target_ip]
+        else:
+            cmd = ["ping", "-c", str(count), "-i", "0.2", "-W", str(max(1, int(timeout))), target_ip]
+        result = await run_tool(cmd, count * (timeout + 0.2) + 2)
+        # Exit code 1 only means no replies; anything else (e.g. no raw socket permission) is unusable
+        if result is not None and result[0] in (0, 1):
+            return summarize_latency("ping", count, parse_ping_times(result[1]))
+        if method != "auto" or not sys.platform.startswith("linux"):
+            return summarize_latency("ping", count, [], "ping is not available")
+
+    # Time TCP handshakes instead: a refused connection is still a round trip
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        writer = None
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(target_ip, port), timeout)
+            samples.append((time.perf_counter() - started) * 1000)
+        except ConnectionRefusedError:
+            samples.append((time.perf_counter() - started) * 1000)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            if writer is not None:
+                writer.close()
+    return summarize_latency("tcp", count, samples)
+
+def summarize_latency(method, sent, samples, error=None):
+    report = {"method": method, "sent": sent, "received": len(samples),
+              "loss_percent": round(100.0 * (sent - len(samples)) / sent, 1) if sent else 0.0,
+              "min_ms": None, "avg_ms": None, "max_ms": None, "samples_ms": [round(s, 3) for s in samples]}
+    if samples:
+        report.update(min_ms=round(min(samples), 3), avg_ms=round(sum(samples) / len(samples), 3),
+                      max_ms=round(max(samples), 3))
+    if error:
+        report["error"] = error
+    return report
+
+async def trace_hop(target_ip, ttl, timeout):
+    started = time.perf_counter()
+    with open_probe_socket(target_ip, TRACE_BASE_PORT + ttl, ttl=ttl) as sock:
+        try:
+            sock.send(b"iperf3-trace")
+        except OSError:
+            return {"ttl": ttl, "address": None, "rtt_ms": None}
+        error = await wait_for_socket_error(sock, timeout)
+    if error is None:
+        return {"ttl": ttl, "address": None, "rtt_ms": None}
+    error_number, _, address = error
+    hop = {"ttl": ttl, "address": address, "rtt_ms": round((time.perf_counter() - started) * 1000, 3)}
+    # Port unreachable comes from the target itself, time exceeded from a router on the way
+    if error_number == errno.ECONNREFUSED:
+        hop["reached"] = True
+    return hop
+
+async def trace_path(target_ip, max_hops=15, timeout=1.0, method="auto"):
+    if not use_socket_probes("tracert" if sys.platform == "win32" else "tracepath", method):
+        if sys.platform == "win32":
+            cmd = ["tracert", "-d", "-h", str(max_hops), "-w", str(int(timeout * 1000)), target_ip]
+            tool = "tracert"
+        else:
+            cmd = ["tracepath", "-n", "-m", str(max_hops), target_ip]
+            tool = "tracepath"
+        result = await run_tool(cmd, max_hops * (timeout * 3 + 0.5) + 2)
+        if result is None:
+            return {"method": tool, "hops": [], "reached": False, "error": f"{tool} is not available"}
+        hops = {}
+        for line in result[1].splitlines():
+            hop = parse_trace_line(line)
+            # tracepath prints a line per probe, keep the answering one for each TTL
+            if hop and (hop["ttl"] not in hops or hops[hop["ttl"]]["address"] is None):
+                hops[hop["ttl"]] = hop
+        hops = [hops[ttl] for ttl in sorted(hops)]
+        reached = any(hop["address"] == target_ip for hop in hops)
+        return {"method": tool, "hops": hops, "reached": reached}
+
+    # Every TTL is probed at once rather than hop after hop
+    hops = await asyncio.gather(*(trace_hop(target_ip, ttl, timeout) for ttl in range(1, max_hops + 1)))
+    for index, hop in enumerate(hops):
+        if hop.pop("reached", False):
+            return {"method": "udp", "hops": hops[:index + 1], "reached": True}
+    while hops and hops[-1]["address"] is None:
+        hops.pop()
+    return {"method": "udp", "hops": hops, "reached": False}
+
+async def ping_fits(target_ip, mtu, timeout):
+    payload = str(mtu - ICMP_HEADERS)
+    if sys.platform == "win32":
+        cmd = ["ping", "-n", "1", "-w", str(int(timeout * 1000)), "-f", "-l", payload, target_ip]
+    else:
+        cmd = ["ping", "-c", "1", "-W", str(max(1, int(timeout))), "-M", "do", "-s", payload, target_ip]
+    result = await run_tool(cmd, timeout + 2)
+    return result is not None and bool(parse_ping_times(result[1]))
 
-    mtus = [1500, 1492, 1472, 1452, 1442]
-    for mtu in mtus:
-        ping_mtu = subprocess.run(['ping', '-n', '1', '-f', '-l', str(mtu), target_ip], capture_output=True, text=True)
-        if "Packet needs to be fragmented" not in ping_mtu.stderr:
-            log_diagnostic(f"Max MTU: {mtu}")
-            break
+async def datagram_fits(target_ip, mtu, timeout, port=PROBE_PORT):
+    with open_probe_socket(target_ip, port, dont_fragment=True) as sock:
+        try:
+            sock.send(bytes(mtu - ICMP_HEADERS))
+        except OSError as e:
+            if e.errno == errno.EMSGSIZE:
+                return False
+            raise
+        # A router that cannot forward it answers "fragmentation needed" (EMSGSIZE)
+        error = await wait_for_socket_error(sock, timeout)
+    return error is None or error[0] != errno.EMSGSIZE
+
+def interface_mtu():
+    # Largest MTU of the connected IPv4 interfaces on Windows, None if netsh cannot tell
+    try:
+        output = subprocess.run(["netsh", "interface", "ipv4", "show", "subinterfaces"],
+                                capture_output=True, text=True, timeout=5).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    mtus = []
+    for line in output.splitlines():
+        # "  1500                1  123456789   98765432  Ethernet", the loopback reports 4294967295
+        tokens = line.split()
+        if len(tokens) >= 5 and tokens[0].isdigit() and tokens[1] == "1" and int(tokens[0]) <= IPV4_MAX_MTU:
+            mtus.append(int(tokens[0]))
+    return max(mtus) if mtus else None
+
+def route_mtu(target_ip, port=PROBE_PORT):
+    # MTU of the local route towards target_ip, a tighter upper bound than 65535
+    if sys.platform == "win32":
+        return interface_mtu() or IPV4_MAX_MTU
+    if not sys.platform.startswith("linux"):
+        return IPV4_MAX_MTU
+    try:
+        with open_probe_socket(target_ip, port) as sock:
+            return min(sock.getsockopt(socket.IPPROTO_IP, IP_MTU), IPV4_MAX_MTU)
+    except OSError:
+        return IPV4_MAX_MTU
+
+async def find_path_mtu(target_ip, port=PROBE_PORT, timeout=1.0, method="auto"):
+    if use_socket_probes("ping", method):
+        tool = "udp"
+        fits = lambda mtu: datagram_fits(target_ip, mtu, timeout, port)
+    else:
+        tool = "ping"
+        fits = lambda mtu: ping_fits(target_ip, mtu, timeout)
+    low, high = IPV4_MIN_MTU, route_mtu(target_ip, port)
+    if tool == "ping" and sys.platform == "win32":
+        # Windows ping refuses payloads above 65500 bytes, whatever the path would carry
+        high = min(high, WINDOWS_PING_MAX_PAYLOAD + ICMP_HEADERS)
+    probes = []
+
+    async def probe(mtu):
+        ok = await fits(mtu)
+        probes.append([mtu, ok])
+        return ok
+
+    # Largest size that gets through, by binary search between the IPv4 minimum and the route MTU.
+    # Most paths are Ethernet, so 1500 goes first and sizes above it are only tried when it fits:
+    # an upper bound that is far too high then costs a few probes, not a long search from below
+    guess = min(ETHERNET_MTU, high)
+    if await probe(guess):
+        if guess == high or await probe(high):
+            return {"method": tool, "path_mtu": high, "probes": probes}
+        if not await probe(guess + 1):
+            return {"method": tool, "path_mtu": guess, "probes": probes}
+        low = guess + 1
+    else:
+        high = guess
+        if not await probe(low):
+            return {"method": tool, "path_mtu": None, "probes": probes, "error": "no probe got through"}
+    while high - low > 1:
+        middle = (low + high) // 2
+        if await probe(middle):
+            low = middle
+        else:
+            high = middle
+    return {"method": tool, "path_mtu": low, "probes": probes}
+
+async def run_diagnostics(target_ip, port=PROBE_PORT, timeout=1.0, max_hops=15, method="auto"):
+    latency, path, mtu = await asyncio.gather(
+        measure_latency(target_ip, port, timeout=timeout, method=method),
+        trace_path(target_ip, max_hops, timeout, method),
+        find_path_mtu(target_ip, port, timeout, method),
+    )
+    return {"target": target_ip, "latency": latency, "path": path, "mtu": mtu}
+
+@traced()
+def perform_network_diagnostics(target_ip, log_file, port=PROBE_PORT, timeout=1.0, max_hops=15, method="auto"):
+    # Latency, route and path MTU are probed concurrently; returns the report as a dict.
+    # port is the closed port the probes aim at, never the iperf3 server's
+    started = time.monotonic()
+    try:
+        report = asyncio.run(run_diagnostics(target_ip, port, timeout, max_hops, method))
+    except Exception as e:
+        log(f"Network diagnostics to {target_ip} failed: {e}", log_file)
+        return None
+    report["elapsed"] = round(time.monotonic() - started, 3)
+
+    latency, path, mtu = report["latency"], report["path"], report["mtu"]
+    if latency["received"]:
+        log(f"Latency to {target_ip} ({latency['method']}): {latency['received']}/{latency['sent']} replies, "
+            f"min/avg/max {latency['min_ms']}/{latency['avg_ms']}/{latency['max_ms']} ms", log_file)
+    else:
+        log(f"Latency to {target_ip} ({latency['method']}): no replies", log_file)
+    route = " -> ".join(hop["address"] or "*" for hop in path["hops"]) or "unknown"
+    log(f"Route to {target_ip} ({path['method']}, {len(path['hops'])} hops"
+        f"{'' if path['reached'] else ', not reached'}): {route}", log_file)
+    log(f"Path MTU to {target_ip} ({mtu['method']}): {mtu['path_mtu'] or 'unknown'} "
+        f"after {len(mtu['probes'])} probes", log_file)
+    log(f"Diagnostics report ({report['elapsed']:.2f}s): {json.dumps(report)}", log_file)
+    return report
+
+BIT_UNITS = {"bits/sec": 1, "Kbits/sec": 1e3, "Mbits/sec": 1e6, "Gbits/sec": 1e9}
+
+def parse_bitrate(tokens):
+    for i, token in enumerate(tokens[1:], 1):
+        if token in BIT_UNITS:
+            try:
+                return float(tokens[i - 1]) * BIT_UNITS[token]
+            except ValueError:
+                return None
+    return None
 
-def start_server():
+def parse_interval_bitrate(line):
+    # "[  5]   0.00-1.00   sec   112 MBytes   941 Mbits/sec    0   1.25 MBytes" -> 941e6
+    tokens = line.split()
+    if not line.startswith("[") or "sender" in tokens or "receiver" in tokens:
+        return None
+    return parse_bitrate(tokens)
+
+def parse_receiver_bitrate(line):
+    # "[  5]   0.00-10.00  sec  1.10 GBytes   941 Mbits/sec                  receiver" -> 941e6
+    tokens = line.split()
+    if not line.startswith("[") or tokens[-1] != "receiver":
+        return None
+    return parse_bitrate(tokens)
+
+def has_converged(rates, tolerance=0.02, window=5, t_value=2.78):
+    # 95% confidence interval of the mean of the last `window` intervals (t for 4 d.o.f.)
+    if len(rates) < window:
+        return False
+    recent = rates[-window:]
+    mean = sum(recent) / window
+    if mean <= 0:
+        return False
+    stddev = (sum((r - mean) ** 2 for r in recent) / (window - 1)) ** 0.5
+    return t_value * stddev / window ** 0.5 <= tolerance * mean
+
+def get_iperf_version(exe_path):
+    try:
+        output = subprocess.run([exe_path, "--version"], capture_output=True, text=True, timeout=10).stdout
+        major, minor = output.split()[1].split(".")[:2]
+        return int(major), int(minor)
+    except Exception:
+        return 0, 0
+
+@traced()
+def run_iperf_pass(exe_path, server_ip, server_port, iperf_log_path, reverse=False, adaptive=False,
+                   min_duration=5, max_duration=60, bidir=False, detector=None, client_ip=None):
+    stop_event = threading.Event()
+    mode = "bidirectional" if bidir else "reverse" if reverse else "normal"
+    message = f"Running iperf3 to the server in {mode} mode"
+    indicator_thread = threading.Thread(target=animated_indicator, args=(message, stop_event), daemon=True)
+    indicator_thread.start()
+
+    cmd = [exe_path, "-c", server_ip, "-p", str(server_port), "-t", str(max_duration), "-i", "1"]
+    if bidir:
+        cmd.append("--bidir")
+    elif reverse:
+        cmd.append("--reverse")
+    if adaptive:
+        cmd.append("--forceflush")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    # --bidir output tags every line with [TX-C] or [RX-C], track each direction separately
+    rates = {}
+    received = {}
+    stopped = False
+    iperf_log = get_writer(iperf_log_path, **LOG_OPTIONS)
+    for line in proc.stdout:
+        iperf_log.write(line)
+        rate = parse_receiver_bitrate(line)
+        if rate is not None:
+            # Keyed by direction: a --bidir test's [RX-C] streams flow from the server, like --reverse
+            received["[RX-" in line if bidir else reverse] = rate
+        if not adaptive or stopped:
+            continue
+        rate = parse_interval_bitrate(line)
+        if rate is None:
+            continue
+        rates.setdefault("RX" if "[RX-" in line else "TX", []).append(rate)
+        # The first interval includes TCP slow start, leave it out
+        if all(len(r) > min_duration and has_converged(r[1:]) for r in rates.values()):
+            stopped = True
+            elapsed = max(len(r) for r in rates.values())
+            iperf_log.write(f"Throughput converged after {elapsed}s, stopping test early\n")
+            if os.name == "posix":
+                proc.send_signal(signal.SIGINT)
+            else:
+                proc.terminate()
+    proc.wait()
+    stop_event.set()
+    indicator_thread.join()
+    ok = proc.returncode == 0 or stopped
+    if ok and detector is not None:
+        for direction, rate in received.items():
+            verdict = detector.check(detector.key(client_ip, server_ip, direction), rate)
+            detector.log(verdict.describe())
+    return ok
+
+def start_server(exe_path):
     log_file = os.path.join(os.environ['TEMP'], "iperf3_server_log.txt")
     ensure_firewall_rule_exists()
     log("Starting iPerf3 server...", log_file)
-    tools_dir = os.path.join(os.environ['TEMP'], "tools")
-    exe_path = os.path.join(tools_dir, "iperf3.exe")
-
-    if not os.path.exists(exe_path):
-        log("iperf3.exe not found. Ensure tools are correctly extracted.", log_file)
+    if not exe_path or not os.path.exists(exe_path):
+        log("iperf3 not found. Ensure tools are correctly extracted.", log_file)
         return
 
     server_ip = get_local_ip()
     port = 5201
+    start_discovery_responder(server_ip, port, log_file)
     start_broadcast(server_ip, port, log_file)
 
     log(f"Starting iPerf3 server on {server_ip}:{port}", log_file)
@@ -191,27 +783,21 @@ def start_server():
             stderr=subprocess.STDOUT,
             text=True
         )
-        with open(log_file, "a", encoding="utf-8") as log_output:
-            while True:
-                line = proc.stdout.readline()
-                if not line and proc.poll() is not None:
-                    break
-                if line:
-                    log_output.write(line)
+        log_output = get_writer(log_file, **LOG_OPTIONS)
+        for line in proc.stdout:
+            log_output.write(line)
     except KeyboardInterrupt:
         log("Server stopping due to KeyboardInterrupt...", log_file)
     except Exception as e:
         log(f"Error running server: {e}", log_file)
+    write_trace(log_file)
 
-def start_client():
+def start_client(exe_path):
     log_file = os.path.join(os.environ['TEMP'], "iperf3_client_log.txt")
     ensure_firewall_rule_exists()
     log("Starting iPerf3 client...", log_file)
-    tools_dir = os.path.join(os.environ['TEMP'], "tools")
-    exe_path = os.path.join(tools_dir, "iperf3.exe")
-
-    if not os.path.exists(exe_path):
-        log("iperf3.exe not found. Ensure tools are correctly extracted.", log_file)
+    if not exe_path or not os.path.exists(exe_path):
+        log("iperf3 not found. Ensure tools are correctly extracted.", log_file)
         return
 
     test_count = 1
@@ -225,67 +811,61 @@ def start_client():
         except ValueError:
             print("Invalid input. Please enter a valid integer.")
 
-    server_ip, server_port = listen_for_broadcast(log_file)
+    adaptive = input("Stop each test early once throughput has converged? (y/N): ").strip().lower() == "y"
+
+    cache_path = os.path.join(os.environ['TEMP'], "iperf3_server_cache.json")
+    server_ip, server_port = find_cached_server(cache_path, log_file)
+    if not server_ip:
+        server_ip, server_port = solicit_server(log_file)
     if not server_ip:
-        subnet = '.'.join(get_local_ip().split('.')[:3]) + '.0/24'
-        server_ip, server_port = scan_subnet_for_server(subnet, 5201, log_file)
+        server_ip, server_port = listen_for_broadcast(log_file)
+    if not server_ip:
+        server_ip, server_port = scan_subnet_for_server(get_local_subnets(), 5201, log_file)
 
     if not server_ip:
         server_ip = input("Server not found via broadcast. Enter the server IP address: ")
         server_port = 5201
+    remember_server(cache_path, server_ip, server_port)
 
     log(f"Attempting to connect to server at {server_ip}:{server_port}", log_file)
     perform_network_diagnostics(server_ip, log_file)
 
+    iperf_log_path = log_file.replace("_client", "_iperf")
+    detector = RegressionDetector(os.path.join(os.environ['TEMP'], "iperf3_baselines.json"),
+                                  log=lambda message: log(message, log_file))
+    client_ip = get_local_ip()
+    # One --bidir test measures both directions at once and halves the cycle time
+    bidir = get_iperf_version(exe_path) >= (3, 7)
     try:
         for i in range(test_count):
-            stop_event = threading.Event()
-            message = f"Running iperf3 to the server in normal mode"
-            indicator_thread = threading.Thread(target=animated_indicator, args=(message, stop_event), daemon=True)
-            indicator_thread.start()
-
-            proc = subprocess.Popen(
-                [exe_path, "-c", server_ip, "-p", str(server_port), "-t", "60", "-i", "1"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True
-            )
-            with open(log_file.replace("_client", "_iperf"), "a", encoding="utf-8") as iperf_log:
-                while proc.poll() is None:
-                    line = proc.stdout.readline()
-                    if line:
-                        iperf_log.write(line)
-                proc.wait()
-            stop_event.set()
-            indicator_thread.join()
-
-            stop_event = threading.Event()
-            message = f"Running iperf3 to the server in reverse mode"
-            indicator_thread = threading.Thread(target=animated_indicator, args=(message, stop_event), daemon=True)
-            indicator_thread.start()
-
-            proc = subprocess.Popen(
-                [exe_path, "-c", server_ip, "-p", str(server_port), "-t", "60", "-i", "1", "--reverse"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True
-            )
-            with open(log_file.replace("_client", "_iperf"), "a", encoding="utf-8") as iperf_log:
-                while proc.poll() is None:
-                    line = proc.stdout.readline()
-                    if line:
-                        iperf_log.write(line)
-                proc.wait()
-            stop_event.set()
-            indicator_thread.join()
-
+            if bidir:
+                if run_iperf_pass(exe_path, server_ip, server_port, iperf_log_path, adaptive=adaptive, bidir=True,
+                                  detector=detector, client_ip=client_ip):
+                    continue
+                log("Bidirectional test failed, falling back to separate normal and reverse tests", log_file)
+                bidir = False
+            run_iperf_pass(exe_path, server_ip, server_port, iperf_log_path, reverse=False, adaptive=adaptive,
+                           detector=detector, client_ip=client_ip)
+            run_iperf_pass(exe_path, server_ip, server_port, iperf_log_path, reverse=True, adaptive=adaptive,
+                           detector=detector, client_ip=client_ip)
+
+        detector.save()
+        write_trace(log_file)
         log("Test completed. Opening log file...", log_file)
         os.startfile(log_file.replace("_client", "_iperf"))
     except Exception as e:
         log(f"Error running client: {e}", log_file)
+    # Like main.py, the exit code tells scheduled runs that a path got slower
+    if detector.regressions:
+        log(f"{len(detector.regressions)} regression(s) in this run", log_file)
+        return EXIT_REGRESSION
+    return 0
 
 if __name__ == "__main__":
-    ensure_tools_exist()
+    if TRACE_FILE:
+        tracing.enable()
+    exe_path = ensure_tools_exist()
+    exit_code = 0
 
     while True:
         print("========================================")
@@ -299,12 +879,12 @@ if __name__ == "__main__":
         try:
             choice = int(input("Enter your choice (1/2/0): "))
             if choice == 1:
-                start_server()
+                start_server(exe_path)
             elif choice == 2:
-                start_client()
+                exit_code = start_client(exe_path) or exit_code
             elif choice == 0:
                 log("Exiting... Goodbye!", os.path.join(os.environ['TEMP'], "iperf3_client_log.txt"))
-                sys.exit(0)
+                sys.exit(exit_code)
             else:
                 print("Invalid choice. Please enter 1, 2, or 0.")
         except ValueError:
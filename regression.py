@@ -0,0 +1,216 @@
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+# main.py's exit code when a test of the run fell below its path's baseline
+EXIT_REGRESSION = 3
+
+
+class Verdict:
+    """Outcome of checking one test against its path's baseline; true when it is a regression."""
+    __slots__ = ('key', 'bits_per_second', 'baseline_bps', 'z', 'cusum', 'kind')
+
+    def __init__(self, key, bits_per_second, baseline_bps=None, z=None, cusum=None, kind=None):
+        self.key = key
+        self.bits_per_second = bits_per_second
+        self.baseline_bps = baseline_bps
+        self.z = z
+        self.cusum = cusum
+        # None, 'drop' (one test far below the baseline) or 'shift' (a sustained lower level)
+        self.kind = kind
+
+    def __bool__(self):
+        return self.kind is not None
+
+    @property
+    def change(self):
+        return self.bits_per_second / self.baseline_bps - 1 if self.baseline_bps else None
+
+    def describe(self):
+        if self.baseline_bps is None:
+            return f"{self.key}: {self.bits_per_second / 1e6:.2f} Mbits/sec, building the baseline"
+        text = (f"{self.key}: {self.bits_per_second / 1e6:.2f} Mbits/sec against a baseline of "
+                f"{self.baseline_bps / 1e6:.2f} ({self.change:+.1%}, z {self.z:.1f})")
+        if self.kind == 'drop':
+            text = "REGRESSION " + text
+        elif self.kind == 'shift':
+            text = "REGRESSION (sustained) " + text
+        return text
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class PathBaseline:
+    """
+    Throughput model of one path and direction, a few numbers updated in O(1) per test.
+    It works on log(bits/s), so a drop is judged relative to the path's speed: an EWMA of
+    the level and of its variance, and a one-sided CUSUM of the standardised shortfalls
+    for sustained shifts too small to stand out in a single test. Inputs are clipped to
+    `clip` deviations before they update the level, so one outage does not drag it down.
+    """
+    __slots__ = ('count', 'mean', 'variance', 'cusum', 'updated')
+
+    def __init__(self, count=0, mean=0.0, variance=0.0, cusum=0.0, updated=None):
+        self.count = count
+        self.mean = mean
+        self.variance = variance
+        self.cusum = cusum
+        self.updated = updated
+
+    def check(self, key, bits_per_second, alpha=0.1, threshold=4.0, min_drop=0.1, warmup=5, slack=0.5,
+              limit=8.0, clip=3.0, floor=0.01, now=None):
+        """Checks one test's throughput, then learns from it; returns its Verdict."""
+        value = math.log(max(bits_per_second, 1.0))
+        self.updated = now or time.time()
+        if self.count == 0:
+            self.count, self.mean = 1, value
+            return Verdict(key, bits_per_second)
+        # The variance starts at zero and is scaled up like a bias-corrected EWMA; the floor keeps
+        # very steady paths from alarming on a fraction of a percent
+        spread = self.variance / (1 - (1 - alpha / 2) ** (self.count - 1)) if self.count > 1 else 0.0
+        deviation = max(math.sqrt(spread), floor)
+        z = (value - self.mean) / deviation
+        verdict = Verdict(key, bits_per_second, math.exp(self.mean), z)
+        if self.count >= warmup:
+            # Capped like the level's input, so it takes several low tests, not one outage, to shift
+            self.cusum = max(0.0, self.cusum + min(-z, clip) - slack)
+            verdict.cusum = self.cusum
+            large_enough = verdict.change <= -min_drop
+            if self.cusum > limit and large_enough:
+                verdict.kind = 'shift'
+            elif z < -threshold and large_enough:
+                verdict.kind = 'drop'
+        if verdict.kind == 'shift':
+            # A change point: the new level is the baseline from now on, so it alarms once
+            self.mean, self.cusum = value, 0.0
+        else:
+            difference = min(max(value - self.mean, -clip * deviation), clip * deviation)
+            self.mean += alpha * difference
+            # The spread is learnt more slowly than the level, which keeps z-scores from swinging with it
+            self.variance = (1 - alpha / 2) * (self.variance + alpha / 2 * difference * difference)
+        self.count += 1
+        return verdict
+
+    def to_list(self):
+        return [self.count, self.mean, self.variance, self.cusum, self.updated]
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(*data)
+
+
+class RegressionDetector:
+    """
+    Per-path baselines (client, server, direction and protocol), kept on disk between
+    runs in a few numbers per path. record() checks every finished test and collects the
+    regressions of this run in `regressions`. Paths not tested for `ttl` seconds are
+    dropped. Safe to share between the client's test threads.
+    """
+
+    def __init__(self, path, ttl=90 * 86400, log=print, **options):
+        self.path = path
+        self.ttl = ttl
+        self.log = log
+        # alpha, threshold, min_drop and warmup of PathBaseline.check
+        self.options = options
+        self.paths = {}
+        self.regressions = []
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def key(client, server, reverse=False, protocol='TCP'):
+        return f"{client or 'local'}>{server}/{'reverse' if reverse else 'regular'}/{protocol or 'TCP'}"
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.paths = {key: PathBaseline.from_list(state) for key, state in json.load(f).items()}
+        except (OSError, ValueError, TypeError):
+            self.paths = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        now = time.time()
+        with self._lock:
+            self.paths = {key: p for key, p in self.paths.items() if now - (p.updated or 0) < self.ttl}
+            data = {key: p.to_list() for key, p in self.paths.items()}
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.log(f"Could not save baselines to {self.path}: {str(e)}")
+
+    def check(self, key, bits_per_second, now=None):
+        with self._lock:
+            verdict = self.paths.setdefault(key, PathBaseline()).check(key, bits_per_second, now=now,
+                                                                      **self.options)
+            if verdict:
+                self.regressions.append(verdict)
+        return verdict
+
+    def record(self, result, client=None, save=True):
+        """Checks a TestResult (both directions of a --bidir run); failed tests are not judged."""
+        from results import split_bidir
+        verdicts = []
+        for r in (split_bidir(result) if result.bidir else (result,)):
+            if not r.success or not r.bits_per_second:
+                continue
+            verdict = self.check(self.key(client, r.server, r.reverse, r.protocol), r.bits_per_second,
+                                 now=r.timestamp)
+            self.log(verdict.describe())
+            verdicts.append(verdict)
+        if save and verdicts:
+            self.save()
+        return verdicts
+
+
+def main(argv=None):
+    from result_store import ResultStore, parse_time
+
+    parser = argparse.ArgumentParser(description="Replay stored iperf3 results through the regression detector")
+    parser.add_argument('--db', default='./iperf3_results.db', help="result store path")
+    parser.add_argument('--server')
+    parser.add_argument('--client')
+    parser.add_argument('--since', help="only report regressions since: epoch, ISO time or age such as 7d")
+    parser.add_argument('--threshold', type=float, default=4.0, help="z-score of a single-test drop")
+    parser.add_argument('--min-drop', type=float, default=0.1, help="smallest relative drop that counts")
+    parser.add_argument('--warmup', type=int, default=5, help="tests per path before it is judged")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per regression")
+    args = parser.parse_args(argv)
+
+    detector = RegressionDetector(None, log=lambda message: None, threshold=args.threshold,
+                                  min_drop=args.min_drop, warmup=args.warmup)
+    since = parse_time(args.since)
+    flagged = 0
+    store = ResultStore(args.db)
+    try:
+        for run in store.runs(newest_first=False, server=args.server, client=args.client, successful=True):
+            if not run['bits_per_second']:
+                continue
+            key = detector.key(run['client'], run['server'], run['direction'] == 'reverse', run['protocol'])
+            verdict = detector.check(key, run['bits_per_second'], now=run['timestamp'])
+            if verdict and (since is None or run['timestamp'] >= since):
+                flagged += 1
+                if args.json:
+                    print(json.dumps(dict(verdict.to_dict(), timestamp=run['timestamp'], run_id=run['id'])))
+                else:
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['timestamp']))} "
+                          f"run {run['id']}: {verdict.describe()}")
+    finally:
+        store.close()
+    sys.exit(EXIT_REGRESSION if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+provisioning.py against a loopback HTTP server: download, resume, checksum and archive checks.
+
+    python -m pytest tests
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from provisioning import ProvisioningError, ToolCache, download  # noqa: E402
+
+
+def make_zip(content=b"#!/bin/sh\necho iperf 3.14\n"):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("iperf3.14_64/iperf3", content)
+        archive.writestr("iperf3.14_64/cygwin1.dll", os.urandom(4096))
+    return buffer.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves `server.body` with an ETag, honouring Range and If-Range unless `server.ignore_range` is set."""
+
+    def do_GET(self):
+        body, etag = self.server.body, self.server.etag
+        self.server.requests.append(dict(self.headers))
+        start = 0
+        requested = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if requested and not self.server.ignore_range and (if_range is None or if_range == etag):
+            start = int(requested.split("=")[1].split("-")[0])
+            if start >= len(body):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class ProvisioningTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="provisioning-test-")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.serve(make_zip())
+        self.server.ignore_range = False
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/iperf3.14_64.zip"
+        self.cache = ToolCache(os.path.join(self.root, "cache"), log=lambda message: None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def serve(self, body):
+        self.server.body = body
+        self.server.etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+    def target(self):
+        return os.path.join(self.root, "archive.zip")
+
+    def write_part(self, data, validator=None):
+        with open(self.target() + ".part", "wb") as f:
+            f.write(data)
+        if validator is not None:
+            with open(self.target() + ".part.validator", "w") as f:
+                f.write(validator)
+
+    def test_download_and_extract(self):
+        directory = self.cache.provision(self.url)
+        self.assertTrue(os.path.exists(os.path.join(directory, "iperf3.14_64", "iperf3")))
+        # Cached: a second provision does not download again
+        self.cache.provision(self.url)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_resumes_part_file(self):
+        body = self.server.body
+        self.write_part(body[:1000], self.server.etag)
+        digest = download(self.url, self.target(), log=lambda message: None)
+        self.assertEqual(digest, hashlib.sha256(body).hexdigest())
+        self.assertEqual(self.server.requests[0].get("Range"), "bytes=1000-")
+        self.assertEqual(self.server.requests[0].get("If-Range"), self.server.etag)
+        with open(self.target(), "rb") as f:
+            self.assertEqual(f.read(), body)
+        self.assertFalse(os.path.exists(self.target() + ".part.validator"))
+
+    def test_range_answered_with_200(self):
+        body = self.server.body
+        self.server.ignore_range = True
+        self.write_part(body[:1000], self.server.etag)
+        digest = download(self.url, self.target(), log=lambda message: None)
+        self.assertEqual(digest, hashlib.sha256(body).hexdigest())
+
+    def test_changed_file_is_not_appended(self):
+        old = self.server.body
+        self.write_part(old[:1000], self.server.etag)
+        self.serve(make_zip(b"#!/bin/sh\necho iperf 3.16\n"))
+        digest = download(self.url, self.target(), log=lambda message: None)
+        self.assertEqual(digest, hashlib.sha256(self.server.body).hexdigest())
+
+    def test_unvalidated_part_is_discarded(self):
+        self.write_part(b"x" * 1000)
+        digest = download(self.url, self.target(), log=lambda message: None)
+        self.assertEqual(digest, hashlib.sha256(self.server.body).hexdigest())
+        self.assertNotIn("Range", self.server.requests[0])
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(ProvisioningError):
+            self.cache.provision(self.url, sha256="0" * 64)
+        self.assertEqual(os.listdir(os.path.join(self.cache.root, "blobs")), [])
+        self.assertEqual(os.listdir(os.path.join(self.cache.root, "downloads")), [])
+        # The pinned digest of the real archive still works afterwards
+        self.cache.provision(self.url, sha256=hashlib.sha256(self.server.body).hexdigest())
+
+    def test_non_zip_body_is_not_cached(self):
+        archive = self.server.body
+        self.serve(b"<html>Please log in to the network</html>")
+        with self.assertRaises(ProvisioningError):
+            self.cache.provision(self.url)
+        self.assertEqual(os.listdir(os.path.join(self.cache.root, "blobs")), [])
+        self.assertEqual(self.cache._load_index(), {})
+        # Once the upstream file is right again, provisioning recovers on its own
+        self.serve(archive)
+        directory = self.cache.provision(self.url)
+        self.assertTrue(os.path.exists(os.path.join(directory, "iperf3.14_64", "iperf3")))
+
+    def test_poisoned_cache_is_forgotten(self):
+        # A bad blob cached by an older version is dropped on the first failure
+        page = b"<html>Please log in to the network</html>"
+        digest = hashlib.sha256(page).hexdigest()
+        os.makedirs(os.path.join(self.cache.root, "blobs"))
+        with open(self.cache.blob_path(digest), "wb") as f:
+            f.write(page)
+        with open(os.path.join(self.cache.root, "urls.json"), "w") as f:
+            json.dump({self.url: digest}, f)
+        with self.assertRaises(ProvisioningError):
+            self.cache.provision(self.url)
+        self.assertFalse(os.path.exists(self.cache.blob_path(digest)))
+        self.cache.provision(self.url)
+
+
+if __name__ == "__main__":
+    unittest.main()